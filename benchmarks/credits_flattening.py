@@ -0,0 +1,189 @@
+"""
+Compares the Arrow-based flattening of credits (`_create_credits_df` in `helpers.internal_spotify_apis.credits`) with
+the reference implementation that builds one dict per credited artist (`create_credits_df_python`).
+
+By default, synthetic role credits are generated (with roughly the distribution of roles, artists and subroles found in
+the credits data). Alternatively, the responses of a credits JSONL file (as written by `get.py`) can be used.
+
+Example usage: python benchmarks/credits_flattening.py -n 200000
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pyarrow as pa  # noqa: E402
+from helpers.internal_spotify_apis.credits import (  # noqa: E402
+    _create_credits_df,
+    flatten_role_credits,
+)
+
+subroles_by_role = {
+    "Performers": [
+        ["main artist"],
+        ["main artist"],
+        ["featured artist"],
+        ["remixer", "main artist"],
+    ],
+    "Writers": [["composer"], ["composer", "lyricist"], ["lyricist"], ["author"], []],
+    "Producers": [["producer"], ["producer", "producer"]],
+}
+
+
+def create_credits_df_python(role_credits: pd.Series):
+    """
+    Reference implementation of `_create_credits_df` (one dict per credited artist), the way credits were flattened
+    before the Arrow-based implementation.
+    """
+    rows = []
+
+    for track_id, track_role_credits in role_credits.items():
+        rows.extend(create_credits_rows(track_id, track_role_credits))
+
+    roles_df = pd.DataFrame(rows)
+
+    # remove duplicates in every subroles array - nonsenical values like ['producer', 'producer'] can occur
+    roles_df.subroles = roles_df.subroles.apply(lambda x: list(set(x)))
+
+    # verify that all non-empty uri values are indeed Spotify artist URIs
+    assert roles_df.uri.apply(
+        lambda uri: uri.startswith("spotify:artist:") if type(uri) == str else True
+    ).all(), "At least one non-empty uri value is not a Spotify artist URI"
+    roles_df["artist_id"] = roles_df.uri.apply(
+        lambda uri: uri.split("spotify:artist:")[1] if type(uri) == str else np.nan
+    )
+
+    # make sure artist_id, name, and pos are first three columns
+    roles_df = roles_df[
+        ["artist_id", "name", "pos"]
+        + [col for col in roles_df.columns if col not in ["artist_id", "name", "pos"]]
+    ]
+
+    return roles_df
+
+
+def create_credits_rows(track_id: str, role_credits: list):
+    rows = []
+    for role in role_credits:
+        title = role["roleTitle"]
+        for i, artist in enumerate(role["artists"]):
+            rows.append(
+                {
+                    **artist,
+                    "roleTitle": title[:-1],
+                    "pos": i + 1,
+                    "track_id": track_id,
+                }
+            )
+    return rows
+
+
+def generate_role_credits(track_count: int, seed: int = 0) -> pd.Series:
+    rng = random.Random(seed)
+    role_credits = []
+    for _ in range(track_count):
+        roles = []
+        for role_title, subroles in subroles_by_role.items():
+            artists = []
+            for _ in range(rng.choice([0, 1, 1, 2, 3])):
+                artist_number = rng.randrange(100000)
+                artist = {}
+                if rng.random() < 0.9:
+                    artist["uri"] = f"spotify:artist:{artist_number:022d}"
+                artist["name"] = f"Artist {artist_number}"
+                if "uri" in artist:
+                    artist["imageUri"] = f"https://i.scdn.co/image/{artist_number}"
+                artist["subroles"] = list(rng.choice(subroles))
+                artist["weight"] = rng.random()
+                if role_title == "Writers" and rng.random() < 0.05:
+                    artist["externalUrl"] = f"https://example.com/{artist_number}"
+                    artist["creatorUri"] = f"spotify:creator:{artist_number}"
+                artists.append(artist)
+            roles.append({"roleTitle": role_title, "artists": artists})
+        role_credits.append(roles)
+    return pd.Series(role_credits, index=[f"track{i:017d}" for i in range(track_count)])
+
+
+def load_role_credits(jsonl_path: str) -> pd.Series:
+    df = pd.read_json(jsonl_path, lines=True).set_index("track_id")
+    return pd.DataFrame.from_records(df.content, index=df.index).roleCredits
+
+
+def measure(function, role_credits: pd.Series, repeat: int):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(role_credits)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations), result
+
+
+def main(track_count: int, jsonl_path: str, repeat: int):
+    role_credits = (
+        load_role_credits(jsonl_path)
+        if jsonl_path is not None
+        else generate_role_credits(track_count)
+    )
+    print(f"Flattening the role credits of {len(role_credits)} tracks")
+
+    python_duration, expected = measure(create_credits_df_python, role_credits, repeat)
+    arrow_duration, actual = measure(_create_credits_df, role_credits, repeat)
+    # the reference implementation deduplicates subroles with `set` (arbitrary order)
+    pd.testing.assert_frame_equal(
+        actual.assign(subroles=actual.subroles.apply(sorted)),
+        expected.assign(subroles=expected.subroles.apply(sorted)),
+    )
+
+    # when the responses are parsed with pyarrow.json (see process_credits.py), the role credits are already Arrow arrays
+    track_ids = pa.array(role_credits.index, pa.string())
+    arrow_role_credits = pa.array(role_credits.tolist())
+    flatten_duration, _ = measure(
+        lambda _: flatten_role_credits(track_ids, arrow_role_credits),
+        role_credits,
+        repeat,
+    )
+
+    print(f"{len(actual)} rows (median of {repeat} runs):")
+    print(f"    Python (one dict per artist):               {python_duration:8.3f} s")
+    print(
+        f"    Arrow (from Python objects, to DataFrame):  {arrow_duration:8.3f} s ({python_duration / arrow_duration:.1f}x faster)"
+    )
+    print(
+        f"    Arrow (from Arrow arrays, to Arrow table):  {flatten_duration:8.3f} s ({python_duration / flatten_duration:.1f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the Arrow-based and the Python-based flattening of credits."
+    )
+    parser.add_argument(
+        "-n",
+        "--track_count",
+        type=int,
+        default=100000,
+        help="Number of tracks with synthetic role credits.",
+    )
+    parser.add_argument(
+        "-i",
+        "--input_path",
+        type=str,
+        help="Path to a credits JSONL file (written by get.py) to use instead of synthetic data.",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="How often every implementation should be measured.",
+    )
+    args = parser.parse_args()
+    main(track_count=args.track_count, jsonl_path=args.input_path, repeat=args.repeat)
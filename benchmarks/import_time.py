@@ -0,0 +1,97 @@
+"""
+Measures how long it takes to import modules of the `helpers` package (or any other module) in a fresh Python interpreter.
+
+Every module is imported in a separate subprocess with `python -X importtime`, so results are not affected by modules
+that were already imported before. Besides the total import time, the slowest (cumulative) imports are listed.
+
+Example usage: python benchmarks/import_time.py helpers.spotify_util helpers.spotify_api -r 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+default_modules = [
+    "helpers.util",
+    "helpers.data",
+    "helpers.spotify_util",
+    "helpers.scraping",
+    "helpers.spotify_api",
+    "helpers.internal_spotify_apis",
+]
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def measure_import(module: str):
+    """
+    Imports the given module in a fresh interpreter.
+
+    Returns:
+        A tuple of the wall clock time (in seconds) and the parsed `-X importtime` output (list of (cumulative time in µs, module name) tuples).
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=project_root,
+        capture_output=True,
+        text=True,
+    )
+    duration = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing '{module}' failed:\n{result.stderr}")
+
+    import_times = []
+    for line in result.stderr.splitlines():
+        # format: 'import time: self [us] | cumulative | imported package'
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        import_times.append((int(cumulative), name.strip()))
+    return duration, import_times
+
+
+def main(modules: list, repeat: int, top: int):
+    for module in modules:
+        durations = []
+        for _ in range(repeat):
+            duration, import_times = measure_import(module)
+            durations.append(duration)
+        print(
+            f"{module}: {statistics.median(durations) * 1000:.1f} ms (median wall clock time of {repeat} runs, including interpreter startup)"
+        )
+        top_level = [(t, name) for t, name in import_times if not name.startswith(" ")]
+        for cumulative, name in sorted(top_level, reverse=True)[:top]:
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure import times of modules in fresh Python interpreters."
+    )
+    parser.add_argument(
+        "modules",
+        type=str,
+        nargs="*",
+        help="Modules to import. Defaults to the modules of the helpers package.",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="How often every import should be measured.",
+    )
+    parser.add_argument(
+        "-t",
+        "--top",
+        type=int,
+        default=5,
+        help="Number of slowest (top-level) imports to list for every module.",
+    )
+    args = parser.parse_args()
+    main(modules=args.modules or default_modules, repeat=args.repeat, top=args.top)
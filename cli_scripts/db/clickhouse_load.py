@@ -0,0 +1,203 @@
+"""
+Loads the combined charts (charts.parquet created with cli_scripts/spotify_charts/combine.py, or a directory of
+.parquet files) into the top200 table on ClickHouse (see sql/clickhouse/setup.sql).
+
+The data is loaded one partition (month, the partition key of the top200 table) at a time, with several partitions loaded
+in parallel (each with its own client/connection):
+- the rows of the month are streamed from the Parquet data in large batches (only the columns of the table are read)
+- every batch is converted to the column types of the table (FixedString(22)/FixedString(2), UInt8, UInt32, Date) in
+  Arrow and inserted with `insert_arrow`, i.e. sent in the Arrow format without converting it to Python objects
+- the rows are inserted into a staging table with the same structure first, which then replaces the partition of the
+  top200 table (`ALTER TABLE ... REPLACE PARTITION ... FROM ...`)
+Replacing whole partitions makes loading idempotent: running the script again (e.g. after it was interrupted, or with
+updated charts) doesn't duplicate any rows.
+"""
+
+import argparse
+import datetime
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+# Arrow types matching the column types of the top200 table
+TOP200_SCHEMA = pa.schema(
+    [
+        ("track_id", pa.binary(22)),
+        ("region_code", pa.binary(2)),
+        ("pos", pa.uint8()),
+        ("streams", pa.uint32()),
+        ("date", pa.date32()),
+    ]
+)
+
+
+def main(
+    input_path: str,
+    table: str = "top200",
+    host: str = "localhost",
+    port: int = 8123,
+    username: str = "default",
+    password: str = "",
+    database: str = "charts",
+    batch_size: int = 1_000_000,
+    parallel_partitions: int = 4,
+):
+    dataset = ds.dataset(input_path, format="parquet")
+    months = get_months(dataset)
+    print(f"Loading {len(months)} months of charts from '{input_path}' into {table}")
+
+    def create_client():
+        import clickhouse_connect
+
+        return clickhouse_connect.get_client(
+            host=host,
+            port=port,
+            username=username,
+            password=password,
+            database=database,
+        )
+
+    with ThreadPoolExecutor(max_workers=parallel_partitions) as executor:
+        futures = {
+            executor.submit(
+                load_partition, create_client, dataset, table, month, batch_size
+            ): month
+            for month in months
+        }
+        total_row_count = 0
+        for future in as_completed(futures):
+            row_count = future.result()
+            total_row_count += row_count
+            print(f"Loaded {row_count} rows for {futures[future]:%Y-%m}")
+    print(f"Loaded {total_row_count} rows into {table}")
+
+
+def get_months(dataset: ds.Dataset) -> List[datetime.date]:
+    """
+    Returns the first day of every month with charts data (in ascending order).
+    """
+    dates = dataset.to_table(columns=["date"]).column("date")
+    dates = pc.unique(dates.cast(pa.date32()).combine_chunks()).to_pylist()
+    return sorted(set(d.replace(day=1) for d in dates))
+
+
+def get_month_filter(month: datetime.date, date_type: pa.DataType) -> ds.Expression:
+    """
+    Returns a dataset filter for the rows of the given month (`date_type` is the type of the date column, e.g. a timestamp
+    type if the charts were written with pandas).
+    """
+    next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+    start, end = [
+        pa.scalar(d, pa.date32()).cast(date_type) for d in [month, next_month]
+    ]
+    return (ds.field("date") >= start) & (ds.field("date") < end)
+
+
+def convert_batch(batch: pa.RecordBatch) -> pa.Table:
+    """
+    Converts a batch of charts rows to the column types of the top200 table (`TOP200_SCHEMA`).
+    Raises an error if a value doesn't fit into its column type (e.g. a track ID without 22 characters or a position above 255).
+    """
+    columns = []
+    for field in TOP200_SCHEMA:
+        column = batch.column(field.name)
+        if pa.types.is_dictionary(column.type):
+            column = column.dictionary_decode()
+        if pa.types.is_fixed_size_binary(field.type):
+            # strings can't be cast to fixed size binary directly
+            column = column.cast(pa.binary())
+        columns.append(column.cast(field.type))
+    return pa.Table.from_arrays(columns, schema=TOP200_SCHEMA)
+
+
+def load_partition(
+    create_client,
+    dataset: ds.Dataset,
+    table: str,
+    month: datetime.date,
+    batch_size: int,
+) -> int:
+    """
+    Loads the charts of a month into a staging table and replaces the partition of the target table with it.
+
+    Returns:
+        The number of loaded rows.
+    """
+    client = create_client()
+    # unique per load, so that concurrent loads into the same table don't replace each other's staging tables
+    staging_table = f"{table}_staging_{month:%Y%m}_{uuid.uuid4().hex}"
+    row_count = 0
+    try:
+        client.command(f"CREATE TABLE {staging_table} AS {table}")
+        for batch in dataset.to_batches(
+            columns=TOP200_SCHEMA.names,
+            filter=get_month_filter(month, dataset.schema.field("date").type),
+            batch_size=batch_size,
+        ):
+            if batch.num_rows == 0:
+                continue
+            client.insert_arrow(staging_table, convert_batch(batch))
+            row_count += batch.num_rows
+        # the partition ID of the top200 table (partitioned by toYYYYMM(date))
+        client.command(
+            f"ALTER TABLE {table} REPLACE PARTITION {month:%Y%m} FROM {staging_table}"
+        )
+    finally:
+        client.command(f"DROP TABLE IF EXISTS {staging_table}")
+        client.close()
+    return row_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load the combined charts from a .parquet file (or a directory of .parquet files) into ClickHouse."
+    )
+    parser.add_argument(
+        "-i",
+        "--input_path",
+        type=str,
+        help="Path to charts.parquet (created with combine.py) or a directory of .parquet files with the same columns",
+        required=True,
+    )
+    parser.add_argument(
+        "-t",
+        "--table",
+        type=str,
+        default="top200",
+        help="The name of the target table (created with sql/clickhouse/setup.sql, has to be partitioned by toYYYYMM(date))",
+    )
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--username", type=str, default="default")
+    parser.add_argument("--password", type=str, default="")
+    parser.add_argument("--database", type=str, default="charts")
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=1_000_000,
+        help="The number of rows per insert",
+    )
+    parser.add_argument(
+        "-p",
+        "--parallel_partitions",
+        type=int,
+        default=4,
+        help="The number of partitions (months) that are loaded in parallel",
+    )
+    args = parser.parse_args()
+    main(
+        input_path=args.input_path,
+        table=args.table,
+        host=args.host,
+        port=args.port,
+        username=args.username,
+        password=args.password,
+        database=args.database,
+        batch_size=args.batch_size,
+        parallel_partitions=args.parallel_partitions,
+    )
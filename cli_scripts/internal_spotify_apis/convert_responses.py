@@ -0,0 +1,54 @@
+"""
+Converts a JSONL file with responses of internal Spotify APIs (as written by `get.py`) to a directory of Parquet files
+(the Parquet storage of `get.py`, see `helpers.internal_spotify_apis.parquet_storage`).
+
+The JSONL file (optionally zstd-compressed) is read line by line, so files larger than the available memory can be converted.
+"""
+
+import argparse
+import os
+from helpers.internal_spotify_apis.parquet_storage import convert_jsonl_to_parquet
+from helpers.internal_spotify_apis.storage import get_compression
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert JSONL responses of internal Spotify APIs to Parquet files."
+    )
+    parser.add_argument(
+        "-i",
+        "--input_path",
+        type=str,
+        help="Path to the .jsonl (or .jsonl.zst) file containing the API responses",
+        required=True,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        type=str,
+        help="Path to the directory where the Parquet files will be written to. Defaults to the input path with '.parquet' instead of '.jsonl' (e.g. 'credits.parquet' for 'credits.jsonl.zst'), so it can be used by `get.py` for resuming.",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=100000,
+        help="The number of responses per Parquet file (also the maximum number of responses held in memory)",
+    )
+    args = parser.parse_args()
+
+    input_path = args.input_path
+    output_path = args.output_path
+    if output_path is None:
+        output_path = input_path
+        if get_compression(input_path) == "zstd":
+            output_path = output_path[: -len(".zst")]
+        output_path = os.path.splitext(output_path)[0] + ".parquet"
+    if os.path.exists(output_path) and len(os.listdir(output_path)) > 0:
+        raise ValueError(
+            f"Output directory '{output_path}' already exists and is not empty"
+        )
+
+    count = convert_jsonl_to_parquet(
+        jsonl_path=input_path, parquet_path=output_path, batch_size=args.batch_size
+    )
+    print(f"Converted {count} responses from '{input_path}' to '{output_path}'")
@@ -3,18 +3,26 @@ Gets data for track IDs from internal Spotify APIs.
 Currently supports:
 - Credits
 - Lyrics
+More endpoints can be added with `register_internal_api_endpoint` (see `helpers.internal_spotify_apis`).
 
 How it works:
 The target endpoint (together with a .parquet file containing the track IDs to fetch data for in a 'track_id' column)
 has to be specified as a command line argument.
 
+Several resources can be fetched in a single run (e.g. `-r credits lyrics`), the requests to all endpoints are then sent
+at the same time (see `get_data_for_endpoints`).
+
 Output is a .jsonl file with the API responses (one JSON object per track ID).
 Another .jsonl file is created for logging errors.
+With --storage parquet, the responses (and errors) are written to directories of Parquet files instead
+(see `helpers.internal_spotify_apis.parquet_storage`, existing JSONL files can be converted with `convert_responses.py`).
 
 The exact usage is a bit more complicated and more parameters/input args are supported, check the script help
 (`python use_internal_spotify_apis.py --help`) and the implementation for more information.
 
-Features both a synchronous and an asynchronous implementation.
+Requests are sent asynchronously, with up to --parallel_requests requests in flight (see `helpers.internal_spotify_apis.engine`).
+With --priority_path (e.g. a ranking created with `cli_scripts/spotify_charts/rank_tracks.py`), the most important
+tracks are fetched first, so an interrupted run leaves gaps only among the least important tracks.
 
 Known issues:
  - The login (required for the lyrics script) can get blocked if the script is rerun too often without specifying
@@ -29,130 +37,245 @@ import argparse
 import aiohttp
 import asyncio
 import pandas as pd
-from tqdm import tqdm
 import os
 import requests
-from typing import Callable, Set
-import random
-import time
-from collections import defaultdict
+from typing import Callable, Collection, List, Optional, Set, Tuple
 import datetime
 
-from helpers.util import (
-    split_into_chunks_of_size,
-    append_line_to_file,
-)
 from helpers.internal_spotify_apis import (
     internal_api_endpoints,
-    InternalRequestHeadersGetter,
+    create_headers_pools,
+    is_valid_response,
+)
+from helpers.internal_spotify_apis.engine import run_requests
+from helpers.internal_spotify_apis.headers import HeadersPool
+from helpers.internal_spotify_apis.telemetry import RequestTelemetry, TelemetryExporter
+from helpers.internal_spotify_apis.storage import (
+    ResponseWriter,
+    create_response_writer,
+    get_storage,
+    read_status_codes,
+    repair_tail,
+    COMPRESSIONS,
+    COMPRESSION_FILE_EXTENSIONS,
+    STORAGES,
+    STORAGE_FILE_EXTENSIONS,
+)
+from helpers.scraping import find_cookies_files
+from helpers.spotify_api.markets import (
+    get_markets_file_format,
+    is_available_in_market,
+    read_market_bitmaps,
+    read_market_index,
 )
 
+# without a timeout, a request to an unresponsive server would block its worker forever
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=60, sock_connect=15)
+# exceptions of requests that are retried (like responses with a retry status code) instead of aborting the fetch
+RETRY_EXCEPTIONS = (aiohttp.ClientError, asyncio.TimeoutError)
+
 
 async def get_data(
-    url_getter: Callable[[str], str],
-    headers: dict,
+    endpoint: dict,
     output_path: str,
     error_log_path: str,
-    track_ids: Set[str],
-    new_headers_getter: Callable[[], dict],
-    parallel_requests: int = 1,
+    track_ids: Collection[str],
+    headers_pool: HeadersPool,
+    parallel_requests: int = None,
+    requests_per_second: float = None,
+    max_attempts: int = 10,
+    flush_interval: float = 5.0,
+    session: aiohttp.ClientSession = None,
+    telemetry: RequestTelemetry = None,
 ):
-    # limit number of simultaneous requests to same endpoint: https://stackoverflow.com/a/43857526/13727176
-    connector = aiohttp.TCPConnector(limit_per_host=parallel_requests)
-    async with aiohttp.ClientSession(connector=connector) as session:
-        tasks = []
-        chunk_size = parallel_requests
-        id_chunks = split_into_chunks_of_size(list(track_ids), chunk_size)
-        print(
-            f"Splitting track IDs into {len(id_chunks)} chunks of size {chunk_size} (IDs within each chunk will be processed in parallel)"
-        )
-        print("Data will be written to disk after every chunk is processed")
-        chunks_without_429 = 0
-        status_code_counts = defaultdict(int)
-        processed_count = 0
-
-        for id_chunk in tqdm(id_chunks):
-            urls = [url_getter(t_id) for t_id in id_chunk]
-            tasks = [
-                asyncio.create_task(
-                    make_request(
-                        track_id=t_id,
-                        request_url=url,
-                        request_headers=headers,
-                        session=session,
-                        time_before_sending_request=i
-                        * random.uniform(
-                            0.05, 0.1
-                        ),  # don't send each request at the exact same time
-                    )
+    """
+    Fetches data for all track IDs from an internal API endpoint (a descriptor from `internal_api_endpoints`, see `register_internal_api_endpoint`),
+    keeping up to `parallel_requests` requests in flight (see `helpers.internal_spotify_apis.engine`).
+    The requests are started in the order of `track_ids` (e.g. as returned by `prioritize_track_ids`).
+    If `parallel_requests` or `requests_per_second` are not provided, the endpoint's defaults (per session of the headers pool) are used.
+
+    Responses are written to the output file (or error log) in batches (see `helpers.internal_spotify_apis.storage`), at least every `flush_interval` seconds
+    (Parquet files are written less often, see `helpers.internal_spotify_apis.parquet_storage`).
+    Requests with the endpoint's retry status codes (by default 401 (headers expired) or 429 (too many requests)) or without a response (connection errors or
+    timeouts, see `REQUEST_TIMEOUT`) are retried (at most `max_attempts` requests per track ID).
+    Responses are written to the error log unless the endpoint's validator accepts them.
+    The request headers are taken from the headers pool, which refreshes them in the background (before they expire or as soon as a request is unauthorized)
+    and spreads the requests over all of its sessions (see `helpers.internal_spotify_apis.headers`).
+
+    If no `session` is provided, a new one is created (and closed when done).
+    If a `telemetry` is provided, the status code and latency of every request are recorded in it (see `helpers.internal_spotify_apis.telemetry`).
+
+    Returns:
+        The number of responses per status code.
+    """
+    parallel_requests, requests_per_second = get_request_limits(
+        endpoint, headers_pool, parallel_requests, requests_per_second
+    )
+    if session is None:
+        # limit number of simultaneous requests to same endpoint: https://stackoverflow.com/a/43857526/13727176
+        connector = aiohttp.TCPConnector(limit_per_host=parallel_requests)
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=REQUEST_TIMEOUT
+        ) as session:
+            return await get_data(
+                endpoint=endpoint,
+                output_path=output_path,
+                error_log_path=error_log_path,
+                track_ids=track_ids,
+                headers_pool=headers_pool,
+                parallel_requests=parallel_requests,
+                requests_per_second=requests_per_second,
+                max_attempts=max_attempts,
+                flush_interval=flush_interval,
+                session=session,
+                telemetry=telemetry,
+            )
+
+    url_getter = endpoint["url_getter"]
+    async with headers_pool:
+        with create_response_writer(output_path) as output, create_response_writer(
+            error_log_path
+        ) as error_log:
+
+            async def request_track_data(track_id: str, request_headers: dict):
+                return await make_request(
+                    track_id=track_id,
+                    request_url=url_getter(track_id),
+                    request_headers=request_headers,
+                    session=session,
                 )
-                for i, (url, t_id) in enumerate(zip(urls, id_chunk))
-            ]
-            results = await asyncio.gather(*tasks)
-            chunk_status_code_counts = defaultdict(int)
-
-            for result in results:
-                process_response_dict(
-                    result=result,
-                    output_path=output_path,
-                    error_log_path=error_log_path,
+
+            async def flush_periodically():
+                # make sure responses are not kept in the buffers for too long if only few responses arrive
+                while True:
+                    await asyncio.sleep(flush_interval)
+                    output.flush()
+                    error_log.flush()
+
+            flush_task = asyncio.create_task(flush_periodically())
+            try:
+                status_code_counts = await run_requests(
+                    track_ids=list(track_ids),
+                    make_request=request_track_data,
+                    on_response=lambda result: process_response_dict(
+                        result=result,
+                        output=output,
+                        error_log=error_log,
+                        validator=endpoint["validator"],
+                        post_processor=endpoint["post_processor"],
+                    ),
+                    max_concurrency=parallel_requests,
+                    requests_per_second=requests_per_second,
+                    headers_source=headers_pool,
+                    retry_status_codes=endpoint["retry_status_codes"],
+                    retry_exceptions=RETRY_EXCEPTIONS,
+                    max_attempts=max_attempts,
+                    description=endpoint["name"],
+                    telemetry=telemetry,
                 )
-                chunk_status_code_counts[result["status_code"]] += 1
+            finally:
+                flush_task.cancel()
 
-            if chunk_status_code_counts[429] > 0:
-                print(
-                    f"Received 429 status code {chunk_status_code_counts[429]} times in current chunk (after {chunks_without_429} chunks without any)"
+    print(f"Status code counts ({endpoint['name']}):")
+    print(status_code_counts)
+    return status_code_counts
+
+
+async def get_data_for_endpoints(
+    fetches: List[dict],
+    max_attempts: int = 10,
+    flush_interval: float = 5.0,
+    telemetry_path: str = None,
+    telemetry_interval: float = 10.0,
+    prometheus_port: int = None,
+):
+    """
+    Fetches data from several internal API endpoints at the same time (in a single pass, e.g. credits and lyrics).
+
+    Every endpoint gets its own request engine (with its own concurrency limit, rate limit and headers pool, see `get_data`),
+    all engines run concurrently on the same event loop and share one HTTP session (and connection pool).
+    The total duration is therefore close to the duration of the slowest endpoint rather than the sum of all durations.
+
+    Parameters
+    ----------
+    fetches: List[dict]
+        One dictionary per endpoint with the keyword arguments for `get_data` (endpoint, output_path, error_log_path, track_ids, headers_pool and optionally parallel_requests and requests_per_second)
+    max_attempts: int
+        The maximum number of requests per track ID (for every endpoint)
+    flush_interval: float
+        The maximum number of seconds responses are buffered before being written
+    telemetry_path: str, optional
+        Path to a JSONL file where snapshots of the request telemetry (requests per second, latency percentiles, 429/401 rates, concurrency, headers age) of every endpoint are appended to
+    telemetry_interval: float
+        The number of seconds between telemetry snapshots
+    prometheus_port: int, optional
+        If provided, the request telemetry is served on http://localhost:<port>/metrics (Prometheus text format)
+
+    Returns
+    -------
+    Dict[str, Dict[int, int]]
+        The number of responses per status code for every endpoint (by endpoint name)
+    """
+    limits = [
+        get_request_limits(
+            f["endpoint"],
+            f["headers_pool"],
+            f.get("parallel_requests"),
+            f.get("requests_per_second"),
+        )
+        for f in fetches
+    ]
+    # all endpoints are on the same host, so the connection limit has to cover the requests of all endpoints
+    connector = aiohttp.TCPConnector(
+        limit=0,
+        limit_per_host=sum(parallel_requests for parallel_requests, _ in limits),
+    )
+    telemetries = [RequestTelemetry(name=f["endpoint"]["name"]) for f in fetches]
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=REQUEST_TIMEOUT
+    ) as session, TelemetryExporter(
+        telemetries=telemetries,
+        snapshot_path=telemetry_path,
+        interval=telemetry_interval,
+        prometheus_port=prometheus_port,
+    ):
+        results = await asyncio.gather(
+            *[
+                get_data(
+                    **{
+                        **f,
+                        "parallel_requests": parallel_requests,
+                        "requests_per_second": requests_per_second,
+                    },
+                    max_attempts=max_attempts,
+                    flush_interval=flush_interval,
+                    session=session,
+                    telemetry=telemetry,
                 )
-                chunks_without_429 = 0
-                wait_time = random.uniform(1, 5)
-                print(f"Waiting {wait_time} seconds before proceeding")
-                await asyncio.sleep(wait_time)
-            if chunk_status_code_counts[401] > 0:
-                print(
-                    f"Got 401 status code for {chunk_status_code_counts[401]} requests, getting new headers"
+                for f, (parallel_requests, requests_per_second), telemetry in zip(
+                    fetches, limits, telemetries
                 )
-                headers = new_headers_getter()
-
-            results_with_401_or_429 = [
-                r for r in results if r["status_code"] == 401 or r["status_code"] == 429
             ]
-            ids_to_refetch = [r["url"] for r in results_with_401_or_429]
+        )
+    return {f["endpoint"]["name"]: result for f, result in zip(fetches, results)}
 
-            if len(ids_to_refetch) > 0:
-                print(
-                    f"Fetching missing data for {len(ids_to_refetch)} track IDs synchronously"
-                )
-                start_time = time.time()
-                for url in ids_to_refetch:
-                    while True:
-                        status_code = process_track_id_sync(
-                            track_id=result["track_id"],
-                            request_url=url,
-                            request_headers=headers,
-                            output_path=output_path,
-                            error_log_path=error_log_path,
-                        )
-                        chunk_status_code_counts[status_code] += 1
-                        if status_code != 401 and status_code != 429:
-                            break
-                        else:
-                            if status_code == 401:
-                                print("Got 401 status code, getting new headers")
-                                headers = new_headers_getter()
-                            elif status_code == 429:
-                                print("Got 429 status code, waiting a second")
-                                time.sleep(1)
-                duration = time.time() - start_time
-                print(f"Took {duration} seconds to fetch missing data")
-
-            # add chunk status code counts to overall status code counts
-            for status_code, count in chunk_status_code_counts.items():
-                status_code_counts[status_code] += count
-
-            processed_count += len(results)
-
-            print(f"Status code counts after processing {processed_count} track IDs:")
-            print(status_code_counts)
+
+def get_request_limits(
+    endpoint: dict,
+    headers_pool: HeadersPool,
+    parallel_requests: int = None,
+    requests_per_second: float = None,
+):
+    """
+    Returns the number of parallel requests and the maximum number of requests per second for an endpoint.
+    Values that are not provided default to the endpoint's defaults, which apply per session (account), so they scale with the number of sessions in the headers pool.
+    """
+    session_count = len(headers_pool.leases)
+    if parallel_requests is None:
+        parallel_requests = endpoint["parallel_requests"] * session_count
+    if requests_per_second is None:
+        requests_per_second = endpoint["requests_per_second"] * session_count
+    return parallel_requests, requests_per_second
 
 
 async def make_request(
@@ -160,9 +283,7 @@ async def make_request(
     request_url: str,
     request_headers: dict,
     session: aiohttp.ClientSession,
-    time_before_sending_request=0.0,
 ):
-    await asyncio.sleep(time_before_sending_request)
     async with session.get(request_url, headers=request_headers) as response:
         status_code = response.status
         content = await response.text()
@@ -176,38 +297,6 @@ async def make_request(
     return response_data
 
 
-def make_request_sync(url: str, headers: dict):
-    response = requests.get(url, headers=headers)
-    status_code = response.status_code
-    content = response.text
-    return status_code, content
-
-
-def process_track_id_sync(
-    track_id: str,
-    request_url: str,
-    request_headers: dict,
-    output_path: str,
-    error_log_path: str,
-    max_request_wait_time=0.3,
-):
-    random_wait_time = random.uniform(0, max_request_wait_time)
-    time.sleep(random_wait_time)
-    status_code, content = make_request_sync(url=request_url, headers=request_headers)
-    result = create_response_dict(
-        status_code=status_code,
-        content=content,
-        url=request_url,
-        track_id=track_id,
-    )
-    process_response_dict(
-        result=result,
-        output_path=output_path,
-        error_log_path=error_log_path,
-    )
-    return result["status_code"]
-
-
 def create_response_dict(status_code: int, content: str, url: str, track_id: str):
     """
     Creates a dictionary containing information about an API response to an internal Spotify API.
@@ -258,7 +347,13 @@ def create_response_dict(status_code: int, content: str, url: str, track_id: str
     }
 
 
-def process_response_dict(result: dict, output_path: str, error_log_path: str):
+def process_response_dict(
+    result: dict,
+    output: ResponseWriter,
+    error_log: ResponseWriter,
+    validator: Callable[[dict], bool] = is_valid_response,
+    post_processor: Optional[Callable[[dict], dict]] = None,
+):
     """
     Processes a dictionary with information about an API response
     and writes it to the appropriate file.
@@ -267,37 +362,29 @@ def process_response_dict(result: dict, output_path: str, error_log_path: str):
     ----------
     result: dict
         The result dictionary as returned by create_result_dict
-    output_path: str
-        The path to the file where responses with usable response data should be written
-    error_log_path: str
-        The path to the file where responses with errors should be written
+    output: ResponseWriter
+        The writer for the file where responses with usable response data should be written
+    error_log: ResponseWriter
+        The writer for the file where responses with errors should be written
+    validator: Callable[[dict], bool]
+        Decides whether the response contains usable data (the endpoint's validator, see `register_internal_api_endpoint`)
+    post_processor: Callable[[dict], dict], optional
+        Applied to usable responses before they are written (the endpoint's post-processor)
     """
-    if (result["status_code"] != 200) or "error" in result["content"]:
+    if not validator(result):
         # something went wrong
         # print(f'Got status code {result["status_code"]}')
-        append_line_to_file(
-            line=json.dumps(result),
-            file_path=error_log_path,
-        )
+        error_log.write(result)
     else:
-        append_line_to_file(
-            line=json.dumps(result),
-            file_path=output_path,
-        )
+        output.write(post_processor(result) if post_processor is not None else result)
 
 
 def get_existing_track_ids(jsonl_file_path: str):
     """
-    Returns a set of track IDs that are already contained in the JSONL file.
+    Returns a set of track IDs that are already contained in the JSONL file (or directory of Parquet files).
+    Only reads the file's index (or the track_id column of the Parquet files), not the responses themselves.
     """
-    df = pd.read_json(jsonl_file_path, lines=True)
-    if df.shape[0] == 0:
-        # file is empty
-        return set()
-    track_ids = set(
-        df["track_id"].unique().tolist()
-    )  # probably some more efficient way to do this exists
-    return track_ids
+    return set(track_id for track_id, _ in read_status_codes(jsonl_file_path))
 
 
 def read_json(file_path: str):
@@ -305,6 +392,90 @@ def read_json(file_path: str):
         return json.load(f)
 
 
+def get_track_ids_for_market(markets_path: str, market: str):
+    """
+    Returns the set of track IDs that are available in the given market.
+
+    Parameters
+    ----------
+    markets_path: str
+        Path to a market index (sorted track IDs per market, created with cli_scripts/spotify_api/create_market_index.py;
+        only the track IDs of the given market are read), a file in the long format (like markets.parquet, one row per track ID and market)
+        or market bitmaps (like market_bitmaps.parquet, one bitmap per track ID, the market codes are read from market_codes.parquet in the same directory).
+        The format is detected from the columns of the file (see `helpers.spotify_api.markets.get_markets_file_format`).
+    market: str
+        The market code (e.g. 'AT')
+    """
+    markets_format = get_markets_file_format(markets_path)
+    if markets_format == "index":
+        return set(read_market_index(markets_path, market))
+    if markets_format == "bitmap":
+        market_bitmaps, market_codes = read_market_bitmaps(markets_path)
+        return set(
+            market_bitmaps.index[
+                is_available_in_market(market_bitmaps, market_codes, market)
+            ]
+        )
+    markets_df = pd.read_parquet(markets_path, filters=[("market", "==", market)])
+    return set(markets_df.index)
+
+
+def get_output_paths(path: str, storage: str, compression: str) -> Tuple[str, str]:
+    """
+    Returns the paths of the output file and the error log for the given storage and compression.
+
+    The storage extension (and for JSONL files, the compression extension) is appended to the path if it is missing, as
+    the storage of a file is determined by its extension (see `helpers.internal_spotify_apis.storage.get_storage`).
+    The error log path is the output path with '_errors' inserted before the extensions (e.g. 'lyrics_errors.jsonl.zst'
+    for 'lyrics.jsonl.zst').
+    """
+    storage_extension = STORAGE_FILE_EXTENSIONS[storage]
+    extension = storage_extension
+    # compression extensions given explicitly in the path are kept (the compression is determined by the extension)
+    explicit_extensions = []
+    if storage == "jsonl":
+        extension += COMPRESSION_FILE_EXTENSIONS[compression]
+        explicit_extensions = [
+            storage_extension + e for e in COMPRESSION_FILE_EXTENSIONS.values() if e
+        ]
+    base_path = path.rstrip(os.sep)
+    for existing_extension in [extension, *explicit_extensions, storage_extension]:
+        if base_path.endswith(existing_extension):
+            base_path = base_path[: -len(existing_extension)]
+            if existing_extension != storage_extension:
+                extension = existing_extension
+            break
+    return base_path + extension, f"{base_path}_errors{extension}"
+
+
+def prioritize_track_ids(track_ids: Set[str], priority_path: str) -> List[str]:
+    """
+    Orders track IDs by a precomputed ranking, so that the most important tracks are fetched first.
+
+    Parameters
+    ----------
+    track_ids: Set[str]
+        The track IDs to order
+    priority_path: str
+        Path to a .parquet file with the ranked track IDs (in a column named 'track_id', ordered by a column named 'rank' if it exists,
+        otherwise by their order in the file), e.g. track_ranking.parquet created with cli_scripts/spotify_charts/rank_tracks.py
+
+    Returns
+    -------
+    The ranked track IDs in the order of the ranking, followed by the track IDs that are not ranked (sorted)
+    """
+    ranking = pd.read_parquet(priority_path)
+    if "rank" in ranking.columns:
+        ranking = ranking.sort_values("rank", kind="stable")
+    ranked_track_ids = [
+        track_id
+        for track_id in dict.fromkeys(ranking["track_id"])
+        if track_id in track_ids
+    ]
+    unranked_track_ids = sorted(track_ids.difference(ranked_track_ids))
+    return ranked_track_ids + unranked_track_ids
+
+
 def ip_info(addr=""):
     """
     Fetches IP information from ipinfo.io.
@@ -360,6 +531,75 @@ def get_error_ids_to_skip(error_log_df: pd.DataFrame, status_codes_to_skip: Set[
     return irrelevant_error_ids
 
 
+def get_remaining_track_ids(
+    track_ids: Set[str], output_path: str, error_log_path: str
+) -> Set[str]:
+    """
+    Returns the track IDs that still have to be fetched, i.e. those without a response in the output file
+    and without a response in the error log that is not worth retrying (404 or 403).
+    Creates the output file (and the directories of the output file and error log) if they don't exist yet.
+
+    Parameters
+    ----------
+    track_ids: Set[str]
+        All track IDs to fetch data for
+    output_path: str
+        Path to the output file (or directory of Parquet files)
+    error_log_path: str
+        Path to the error log (or directory of Parquet files)
+
+    Returns
+    -------
+    Set[str]
+        The remaining track IDs
+    """
+    if get_storage(output_path) == "jsonl":
+        for path in [output_path, error_log_path]:
+            # remove incomplete data written by a previous run that was killed
+            repair_tail(path)
+
+    if os.path.exists(output_path):
+        # load ids from the index of the existing file (or the track_id column of the Parquet files)
+        existing_track_ids = get_existing_track_ids(output_path)
+        print(
+            f"Found {len(existing_track_ids)} existing track IDs in output file '{output_path}'"
+        )
+        track_ids = track_ids.difference(existing_track_ids)
+        print(f"{len(track_ids)} track IDs remain")
+    else:
+        # create output file and required subdirectories if they don't exist
+        if get_storage(output_path) == "parquet":
+            os.makedirs(output_path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            open(output_path, "w").close()
+
+    print(f"Error log path: {error_log_path}")
+
+    if os.path.exists(error_log_path):
+        errors = pd.DataFrame(
+            read_status_codes(error_log_path),
+            columns=["track_id", "status_code"],
+        )
+        if errors.shape[0] == 0:
+            # file is empty
+            print("No errors found in error log file")
+        else:
+            # create sets of track IDs by error code
+            status_codes_to_skip = set([404, 403])
+            error_ids_to_skip = get_error_ids_to_skip(
+                error_log_df=errors, status_codes_to_skip=status_codes_to_skip
+            )
+            if len(error_ids_to_skip) > 0:
+                print(
+                    f"Found {len(error_ids_to_skip)} track IDs that previously produced either of HTTP status codes {status_codes_to_skip}"
+                )
+                track_ids = track_ids.difference(error_ids_to_skip)
+    else:
+        os.makedirs(os.path.dirname(error_log_path) or ".", exist_ok=True)
+    return track_ids
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -373,41 +613,103 @@ if __name__ == "__main__":
         "-o",
         "--output_path",
         type=str,
-        help="Path where the JSONL file containing the data will be saved (this file path will also be used to resume the data fetching process (skipping track_ids that are already contained in it). Defaults to '<resource>.jsonl' where <resource> is the value of the --resource argument), located in same directory as the input file.",
+        help="Path where the JSONL file containing the data will be saved (this file path will also be used to resume the data fetching process (skipping track_ids that are already contained in it). Defaults to '<resource>.jsonl' where <resource> is the value of the --resource argument), located in same directory as the input file. If several resources are fetched, this is the path of the directory where the '<resource>.jsonl' files will be saved. The extension of the storage (and compression) is appended if it is missing, the error log is saved next to it ('<name>_errors.jsonl').",
+    )
+    parser.add_argument(
+        "-z",
+        "--compression",
+        type=str,
+        choices=COMPRESSIONS,
+        default="none",
+        help="Compression of the output file and error log. With 'zstd', '.zst' is appended to the file names (if not already present in the provided output path). Only applies to JSONL storage (Parquet files are always compressed with zstd).",
+    )
+    parser.add_argument(
+        "-f",
+        "--storage",
+        type=str,
+        choices=STORAGES,
+        default="jsonl",
+        help="How the responses are stored: 'jsonl' (one JSON object per line) or 'parquet' (a directory of Parquet files with typed columns, see helpers/internal_spotify_apis/parquet_storage.py). Determines the file extension of the default output path.",
     )
     parser.add_argument(
         "-r",
         "--resource",
         type=str,
-        help='The type of resource to fetch. Must be either "credits" or "lyrics".',
+        nargs="+",
+        help=f"The type of resource to fetch, i.e. the name of a registered internal API endpoint (one of {list(internal_api_endpoints.keys())}). If several resources are provided, they are fetched at the same time (each within the rate limits of its endpoint).",
         required=True,
     )
     parser.add_argument(
         "-m",
         "--markets_path",
         type=str,
-        help="Path to a .parquet file containing the markets the provided track IDs are available in (in a column named 'markets'). If provided, only tracks that are available in the market associated with the current IP address will be fetched. This seems to be necessary for the lyrics API (as all tracks not available in a user's market return a 400 error).",
+        help="Path to a .parquet file containing the markets the provided track IDs are available in (in a column named 'market', a market_bitmaps.parquet file created with --markets_format bitmap, or - fastest - a market_index.parquet file created with cli_scripts/spotify_api/create_market_index.py; the format is detected from the columns of the file, not its name). If provided, only tracks that are available in the market associated with the current IP address (or the market provided with --market) will be fetched. This seems to be necessary for the lyrics API (as all tracks not available in a user's market return a 400 error).",
+    )
+    parser.add_argument(
+        "--priority_path",
+        type=str,
+        help="Path to a .parquet file with a ranking of the track IDs (e.g. track_ranking.parquet created with cli_scripts/spotify_charts/rank_tracks.py). If provided, track IDs are fetched in the order of the ranking (unranked track IDs last), so that an interrupted run has covered the most important tracks.",
+    )
+    parser.add_argument(
+        "--market",
+        type=str,
+        help="The market code (e.g. 'AT') used for filtering track IDs with --markets_path. If not provided, the market associated with the current IP address is looked up (on ipinfo.io).",
     )
     parser.add_argument(
         "-p",
         "--parallel_requests",
         type=int,
-        help="The number of parallel requests to send. A value of 1 is synonymous with synchronous processing. If not provided, a sensible default value will be used depending on the endpoint.",
+        help="The number of parallel requests to send (per resource). A value of 1 is synonymous with synchronous processing. If not provided, a sensible default value will be used depending on the endpoint (and the number of sessions provided with --cookies-path).",
+    )
+    parser.add_argument(
+        "-s",
+        "--requests_per_second",
+        type=float,
+        help="The maximum number of requests to send per second (on average, per resource). If not provided, a sensible default value will be used depending on the endpoint. Use 0 to disable pacing.",
+    )
+    parser.add_argument(
+        "-a",
+        "--max_attempts",
+        type=int,
+        default=10,
+        help="The maximum number of requests per track ID. Requests with 401 or 429 status codes are retried (after a random, exponentially increasing delay) until this number is reached.",
     )
     parser.add_argument(
         "-c",
         "--cookies-path",
         type=str,
-        help="Path to a Pickle file containing the cookies of a Spotify 'session' (where cookies were accepted and user is logged in (if login required by endpoint)). Used for getting the request headers. If you don't have a file yet, created one with `save_cookies.py`).",
+        nargs="+",
+        help="Path(s) to Pickle files containing the cookies of a Spotify 'session' (where cookies were accepted and user is logged in (if login required by endpoint)), or to directories containing such files. Used for getting the request headers. If you don't have a file yet, created one with `save_cookies.py`). If cookies of several sessions (e.g. different accounts) are provided, requests are spread over all of them.",
+    )
+
+    parser.add_argument(
+        "-t",
+        "--telemetry_path",
+        type=str,
+        help="Path to a JSONL file where snapshots of the request telemetry (requests per second, p50/p95/p99 latency, 429/401 rates, concurrency and headers age per resource) are appended to periodically.",
+    )
+    parser.add_argument(
+        "--telemetry_interval",
+        type=float,
+        default=10.0,
+        help="The number of seconds between telemetry snapshots.",
+    )
+    parser.add_argument(
+        "-e",
+        "--prometheus_port",
+        type=int,
+        help="If provided, the request telemetry is served on http://localhost:<port>/metrics in the Prometheus text format.",
     )
 
     args = parser.parse_args()
 
-    endpoint = internal_api_endpoints[args.resource]
-    if endpoint is None:
-        raise ValueError(
-            f"Invalid resource '{args.resource}'. Must be one of {list(internal_api_endpoints.keys())}."
-        )
+    # several resources can be fetched in a single run (sharing the input, browser sessions and HTTP connections)
+    resources = list(dict.fromkeys(args.resource))
+    for resource in resources:
+        if resource not in internal_api_endpoints:
+            raise ValueError(
+                f"Invalid resource '{resource}'. Must be one of {list(internal_api_endpoints.keys())}."
+            )
 
     input_path = args.input_path
     try:
@@ -422,24 +724,21 @@ if __name__ == "__main__":
 
     markets_path = args.markets_path
     if markets_path is not None:
-        data = ip_info()
-        market = data["country"]
         print(f"Markets file provided: '{markets_path}'")
-        print(
-            "filtering track IDs based on country/market code associated with location of IP address making request:",
-            market,
-        )
-        try:
-            markets_df = pd.read_parquet(markets_path)
-            markets_df = markets_df[markets_df.market == market]
-            ids_for_market = set(markets_df.index)
-            if len(ids_for_market) == 0:
-                raise ValueError(
-                    f"No track IDs found for '{market}' in markets file '{markets_path}'. Are you sure this is a valid Spotify market code?"
-                )
-        except Exception:
+        if args.market is not None:
+            market = args.market.upper()
+            print("filtering track IDs based on the provided market code:", market)
+        else:
+            data = ip_info()
+            market = data["country"]
+            print(
+                "filtering track IDs based on country/market code associated with location of IP address making request:",
+                market,
+            )
+        ids_for_market = get_track_ids_for_market(markets_path, market)
+        if len(ids_for_market) == 0:
             raise ValueError(
-                f"Markets file '{markets_path}' must be a .parquet file with a column named 'market'"
+                f"No track IDs found for '{market}' in markets file '{markets_path}'. Are you sure this is a valid Spotify market code?"
             )
         try:
             track_ids = track_ids.intersection(ids_for_market)
@@ -452,97 +751,93 @@ if __name__ == "__main__":
                 f"Input file '{input_path}' must contain a column named 'track_id'"
             )
 
-    output_path = (
-        args.output_path
-        if args.output_path
-        else os.path.join(os.path.dirname(input_path), f"{args.resource}.jsonl")
-    )
-    print(f"Output file path: {output_path}")
-    if os.path.exists(output_path):
-        # load ids from the existing JSON objects in the file
-        with open(output_path, "r") as f:
-            existing_track_ids = get_existing_track_ids(output_path)
-            print(
-                f"Found {len(existing_track_ids)} existing track IDs in output file '{output_path}'"
-            )
-            track_ids = track_ids.difference(existing_track_ids)
-            if len(track_ids) == 0:
-                print("No track IDs left to fetch data for!")
-                exit(0)
-            else:
-                print(f"{len(track_ids)} track IDs remain")
-                print()
-    else:
-        # create output file and required subdirectories if they don't exist
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        open(output_path, "w").close()
-
-    error_log_path = output_path.replace(".jsonl", "_errors.jsonl")
-    print(f"Error log path: {error_log_path}")
+    storage_extension = STORAGE_FILE_EXTENSIONS[args.storage]
+    fetches = []
+    for resource in resources:
+        print(f"Resource: {resource}")
+        file_name = f"{resource}{storage_extension}"
+        if args.output_path is None:
+            output_path = os.path.join(os.path.dirname(input_path), file_name)
+        elif len(resources) > 1:
+            # the output path is a directory containing the files of all resources
+            output_path = os.path.join(args.output_path, file_name)
+        else:
+            output_path = args.output_path
+        output_path, error_log_path = get_output_paths(
+            output_path, args.storage, args.compression
+        )
+        print(f"Output file path: {output_path}")
 
-    if os.path.exists(error_log_path):
-        errors = pd.read_json(error_log_path, lines=True)
-        if errors.shape[0] == 0:
-            # file is empty
-            print("No errors found in error log file")
+        remaining_track_ids = get_remaining_track_ids(
+            track_ids=track_ids,
+            output_path=output_path,
+            error_log_path=error_log_path,
+        )
+        if len(remaining_track_ids) == 0:
+            print(f"No track IDs left to fetch {resource} data for!")
         else:
-            # create sets of track IDs by error code
-            errors = errors[["track_id", "status_code"]]
-            status_codes_to_skip = set([404, 403])
-            error_ids_to_skip = get_error_ids_to_skip(
-                error_log_df=errors, status_codes_to_skip=status_codes_to_skip
-            )
-            if len(error_ids_to_skip) > 0:
-                print(
-                    f"Found {len(error_ids_to_skip)} track IDs that previously produced either of HTTP status codes {status_codes_to_skip}"
+            print(f"Fetching {resource} data for {len(remaining_track_ids)} track IDs")
+            if args.priority_path is not None:
+                remaining_track_ids = prioritize_track_ids(
+                    remaining_track_ids, args.priority_path
                 )
-                track_ids = track_ids.difference(error_ids_to_skip)
-            print()
-    else:
-        print(os.path.dirname(error_log_path))
-        os.makedirs(os.path.dirname(error_log_path), exist_ok=True)
+            fetches.append(
+                {
+                    "endpoint": internal_api_endpoints[resource],
+                    "output_path": output_path,
+                    "error_log_path": error_log_path,
+                    "track_ids": remaining_track_ids,
+                }
+            )
+        print()
 
-    if len(track_ids) == 0:
+    if len(fetches) == 0:
         print("No track IDs left to fetch data for!")
         exit(0)
-    else:
-        print(f"Fetching data for {len(track_ids)} track IDs")
-
-    cookies_path = args.cookies_path
-
-    get_headers = InternalRequestHeadersGetter(
-        resource_name=args.resource,
-        track_ids=track_ids,
-        cookies_path=cookies_path,
-    ).get_headers
-
-    headers = get_headers()
-    url_getter = endpoint["url_getter"]
 
-    # I am not even sure if varying the number of parallel requests is even that beneficial for performance lol
-    # for the lyrics endpoint, we surely cannot send too much at once, as we will get 429 errors
-    parallel_request_defaults = {
-        "credits": 100,
-        "lyrics": 50,
-    }
-    parallel_requests = args.parallel_requests or parallel_request_defaults.get(
-        args.resource, 1
+    cookies_paths = (
+        find_cookies_files(args.cookies_path) if args.cookies_path is not None else None
     )
-
-    print(
-        f"Sending {parallel_requests} parallel requests"
-        if parallel_requests > 1
-        else "Sending synchronous requests"
+    if cookies_paths is not None:
+        print(f"Using {len(cookies_paths)} cookies file(s): {cookies_paths}")
+
+    # the browser sessions for getting the request headers are shared by all resources
+    headers_pools = create_headers_pools(
+        resource_names=[f["endpoint"]["name"] for f in fetches],
+        track_ids=set().union(*[f["track_ids"] for f in fetches]),
+        cookies_paths=cookies_paths,
     )
+    for fetch in fetches:
+        fetch["headers_pool"] = headers_pools[fetch["endpoint"]["name"]]
+        # rate limits apply per session (account), so the endpoint's defaults scale with the number of sessions
+        parallel_requests, requests_per_second = get_request_limits(
+            endpoint=fetch["endpoint"],
+            headers_pool=fetch["headers_pool"],
+            parallel_requests=args.parallel_requests,
+            requests_per_second=args.requests_per_second,
+        )
+        fetch["parallel_requests"] = parallel_requests
+        fetch["requests_per_second"] = requests_per_second
+
+        print(
+            f"{fetch['endpoint']['name']}: "
+            + (
+                f"Sending {parallel_requests} parallel requests"
+                if parallel_requests > 1
+                else "Sending synchronous requests"
+            )
+        )
+        if requests_per_second:
+            print(
+                f"{fetch['endpoint']['name']}: Sending at most {requests_per_second} requests per second"
+            )
 
     asyncio.run(
-        get_data(
-            url_getter=url_getter,
-            track_ids=track_ids,
-            headers=headers,
-            output_path=output_path,
-            error_log_path=error_log_path,
-            new_headers_getter=get_headers,
-            parallel_requests=parallel_requests,
+        get_data_for_endpoints(
+            fetches,
+            max_attempts=args.max_attempts,
+            telemetry_path=args.telemetry_path,
+            telemetry_interval=args.telemetry_interval,
+            prometheus_port=args.prometheus_port,
         )
     )
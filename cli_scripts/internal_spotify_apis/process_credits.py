@@ -1,26 +1,37 @@
 """
 Processes credits data contained in (successful) API responses from internal Spotify APIs.
+
+The responses are processed in batches (see `process_credits_file` in `helpers.internal_spotify_apis.credits`):
+only the roleCredits of every response are parsed, and the rows are appended to writers.parquet, producers.parquet
+and performers.parquet batch by batch, so files of any size can be processed with constant memory usage.
+Only responses that were added since the last run are processed (unless `--full` is passed), and their rows are added
+as new part files to the output tables. The tables reference the credited persons by key, the persons (names and
+artist IDs) are stored in persons.parquet.
 """
 
 import argparse
 import os
-import pandas as pd
-from helpers.internal_spotify_apis import process_credits
-
+from helpers.internal_spotify_apis.credits import process_credits_file
+from helpers.internal_spotify_apis.persons import PERSONS_FILE_NAME, load_persons
 
-def main(input_jsonl_path: str, output_folder_path: str):
-    api_resp_df = pd.read_json(input_jsonl_path, lines=True).set_index("track_id")
 
-    dfs = process_credits(
-        pd.DataFrame.from_records(api_resp_df.content, index=api_resp_df.index)
+def main(
+    input_jsonl_path: str,
+    output_folder_path: str,
+    batch_size: int = 10000,
+    full: bool = False,
+):
+    row_counts = process_credits_file(
+        input_path=input_jsonl_path,
+        output_folder_path=output_folder_path,
+        batch_size=batch_size,
+        full=full,
     )
-
-    if not os.path.exists(output_folder_path):
-        os.makedirs(output_folder_path)
-    for name, df in dfs.items():
+    for name, row_count in row_counts.items():
         output_path = os.path.join(output_folder_path, f"{name}.parquet")
-        df.to_parquet(output_path)
-        print(f"Stored {name} in '{output_path}'")
+        print(f"Added {row_count} {name} to '{output_path}'")
+    persons_path = os.path.join(output_folder_path, PERSONS_FILE_NAME)
+    print(f"Stored {len(load_persons(output_folder_path))} persons in '{persons_path}'")
 
 
 if __name__ == "__main__":
@@ -31,7 +42,7 @@ if __name__ == "__main__":
         "-i",
         "--input_jsonl_path",
         type=str,
-        help="Path to a .jsonl file containing the (successful) API responses",
+        help="Path to a .jsonl (or .jsonl.zst) file containing the (successful) API responses, or to a directory of Parquet files written by `get.py --storage parquet`",
         required=True,
     )
     parser.add_argument(
@@ -41,8 +52,23 @@ if __name__ == "__main__":
         help="Path to a directory where output files will be written to",
         required=True,
     )
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=10000,
+        help="The number of responses that are processed at once (determines the memory usage)",
+    )
+    parser.add_argument(
+        "-f",
+        "--full",
+        action="store_true",
+        help="Process all responses again instead of only the ones that were added since the last run",
+    )
     args = parser.parse_args()
     main(
         input_jsonl_path=args.input_jsonl_path,
         output_folder_path=args.output_folder_path,
+        batch_size=args.batch_size,
+        full=args.full,
     )
@@ -0,0 +1,70 @@
+"""
+Processes lyrics data contained in (successful) API responses from internal Spotify APIs.
+
+The responses file is split into chunks that are processed in parallel (see `process_lyrics_file` in
+`helpers.internal_spotify_apis.lyrics`): only the relevant fields of the lyrics are parsed, and they are written to
+lyrics.parquet (one row per track, with the sync type and language) and lyrics_lines.parquet (one row per line, with
+its start time and words).
+"""
+
+import argparse
+import os
+from helpers.internal_spotify_apis.lyrics import process_lyrics_file
+
+
+def main(
+    input_jsonl_path: str,
+    output_folder_path: str,
+    batch_size: int = 10000,
+    processes: int = None,
+):
+    row_counts = process_lyrics_file(
+        input_path=input_jsonl_path,
+        output_folder_path=output_folder_path,
+        batch_size=batch_size,
+        processes=processes,
+    )
+    for name, row_count in row_counts.items():
+        output_path = os.path.join(output_folder_path, f"{name}.parquet")
+        print(f"Stored {row_count} rows in '{output_path}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Process lyrics data fetched from internal Spotify APIs."
+    )
+    parser.add_argument(
+        "-i",
+        "--input_jsonl_path",
+        type=str,
+        help="Path to a .jsonl (or .jsonl.zst) file containing the (successful) API responses, or to a directory of Parquet files written by `get.py --storage parquet`",
+        required=True,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_folder_path",
+        type=str,
+        help="Path to a directory where output files will be written to",
+        required=True,
+    )
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=10000,
+        help="The number of responses that are processed at once by every process (determines the memory usage)",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=None,
+        help="The number of processes (default: the number of CPUs)",
+    )
+    args = parser.parse_args()
+    main(
+        input_jsonl_path=args.input_jsonl_path,
+        output_folder_path=args.output_folder_path,
+        batch_size=args.batch_size,
+        processes=args.processes,
+    )
@@ -7,6 +7,7 @@ avoid having to log in again when using selenium in the future (loading the cook
 In the context of this project, this script is used to save cookies from a browsing session where some user is logged in to Spotify.
 
 The generated cookies file can be passed to the `internal_spotify_apis/get.py` script to load the cookies and use them to make requests to internal Spotify APIs.
+Cookies of several accounts (saved with different --name values) can be passed to it at once to spread the requests over all accounts.
 """
 
 import argparse
@@ -15,7 +16,7 @@ import pickle
 import os
 
 
-def main(output_dir: str):
+def main(output_dir: str, name: str = None):
     if not os.path.isdir(output_dir):
         if os.path.exists(output_dir):
             raise ValueError(f"Output directory '{output_dir}' is not a directory.")
@@ -33,7 +34,12 @@ def main(output_dir: str):
         # get url without protocol, subpaths, and query string
         trimmed_url = url.split("//")[1].split("/")[0].split("?")[0]
 
-        output_path = os.path.join(output_dir, f"cookies_{trimmed_url}.pkl")
+        file_name = (
+            f"cookies_{trimmed_url}_{name}.pkl"
+            if name is not None
+            else f"cookies_{trimmed_url}.pkl"
+        )
+        output_path = os.path.join(output_dir, file_name)
         with open(output_path, "wb") as file:
             pickle.dump(cookies, file)
 
@@ -50,6 +56,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "output_dir", type=str, help="Directory to save the cookie file in."
     )
+    parser.add_argument(
+        "-n",
+        "--name",
+        type=str,
+        help="Name added to the cookie file name (e.g. the account name), so that cookies of several sessions (e.g. for different accounts) can be saved in the same directory.",
+    )
     args = parser.parse_args()
 
-    main(args.output_dir)
+    main(args.output_dir, name=args.name)
@@ -0,0 +1,61 @@
+import argparse
+import os
+import pandas as pd
+from helpers.spotify_api.markets import (
+    create_market_index,
+    get_markets_file_format,
+    market_bitmaps_from_long,
+    read_market_bitmaps,
+    write_market_index,
+)
+
+
+def main(input_path: str, output_path: str = None):
+    """
+    Creates a market index (one row per market with the sorted track IDs available in it, see `helpers.spotify_api.markets`)
+    from the markets output of get_track_metadata.py, i.e. either a markets.parquet file (long format) or a
+    market_bitmaps.parquet file (with market_codes.parquet in the same directory). The format is detected from the columns
+    of the file (see `helpers.spotify_api.markets.get_markets_file_format`), not its name.
+
+    The index only has to be created once, afterwards the track IDs of a single market can be read without reading the
+    markets of all tracks (e.g. with `cli_scripts/internal_spotify_apis/get.py --markets_path market_index.parquet`).
+    """
+    markets_format = get_markets_file_format(input_path)
+    if markets_format == "index":
+        raise ValueError(
+            f"'{input_path}' is a market index already, the input has to be a markets.parquet or market_bitmaps.parquet file"
+        )
+    if markets_format == "bitmap":
+        market_bitmaps, market_codes = read_market_bitmaps(input_path)
+    else:
+        dfs = market_bitmaps_from_long(pd.read_parquet(input_path, columns=["market"]))
+        market_bitmaps, market_codes = dfs["market_bitmaps"], dfs["market_codes"]
+    print(
+        f"Found {len(market_bitmaps)} track IDs and {len(market_codes)} markets in '{input_path}'"
+    )
+
+    if output_path is None:
+        output_path = os.path.join(os.path.dirname(input_path), "market_index.parquet")
+    write_market_index(create_market_index(market_bitmaps, market_codes), output_path)
+    print(f"Stored market index in '{output_path}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create an index of the track IDs available in every market."
+    )
+    parser.add_argument(
+        "-i",
+        "--input_path",
+        type=str,
+        help="Path to a markets.parquet file (long format) or a market_bitmaps.parquet file (with market_codes.parquet in the same directory) created with get_track_metadata.py",
+        required=True,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        type=str,
+        help="Path of the market index file. Defaults to market_index.parquet in the directory of the input file.",
+    )
+    args = parser.parse_args()
+    main(input_path=args.input_path, output_path=args.output_path)
@@ -7,6 +7,7 @@ and finally artist metadata for every artist in the album metadata AND track met
 """
 import argparse
 import os
+from helpers.spotify_api.markets import MARKETS_FORMATS
 from get_album_metadata import (
     main as get_album_metadata_main,
 )
@@ -18,16 +19,24 @@ from get_artist_metadata import (
 )
 
 
-def main(chart_file_path: str, output_dir: str):
+def main(chart_file_path: str, output_dir: str, markets_format: str = "long"):
     tracks_subdir = os.path.join(output_dir, "tracks")
     print(f"Getting track metadata for {chart_file_path}")
-    get_track_metadata_main(input_path=chart_file_path, output_dir=tracks_subdir)
+    get_track_metadata_main(
+        input_path=chart_file_path,
+        output_dir=tracks_subdir,
+        markets_format=markets_format,
+    )
 
     track_metadata_path = os.path.join(tracks_subdir, "metadata.parquet")
     albums_subdir = os.path.join(output_dir, "albums")
     print()
     print(f"Getting album metadata for {track_metadata_path}")
-    get_album_metadata_main(input_path=track_metadata_path, output_dir=albums_subdir)
+    get_album_metadata_main(
+        input_path=track_metadata_path,
+        output_dir=albums_subdir,
+        markets_format=markets_format,
+    )
 
     album_artists_path = os.path.join(albums_subdir, "artists.parquet")
     track_artists_path = os.path.join(tracks_subdir, "artists.parquet")
@@ -56,6 +65,14 @@ if __name__ == "__main__":
         type=str,
         help="Path to a directory where output files with the Spotify API will be written to (in subdirectories).",
     )
+    parser.add_argument(
+        "-m",
+        "--markets_format",
+        type=str,
+        choices=MARKETS_FORMATS,
+        default="long",
+        help="How to store the available markets of tracks and albums. 'long' creates markets.parquet files (one row per track/album and market), 'bitmap' creates market_bitmaps.parquet (one bitmap per track/album) and market_codes.parquet files instead.",
+    )
     args = parser.parse_args()
     chart_file_path = args.input_path
     if not chart_file_path.endswith(".parquet"):
@@ -67,4 +84,5 @@ if __name__ == "__main__":
     main(
         chart_file_path=chart_file_path,
         output_dir=output_dir,
+        markets_format=args.markets_format,
     )
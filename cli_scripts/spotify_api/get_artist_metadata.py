@@ -1,9 +1,10 @@
 import argparse
 import os
 import pandas as pd
-from helpers.spotify_util import create_spotipy_client
+from helpers.spotify_util import get_shared_spotipy_client
 from helpers.data import write_dfs_in_dict_to_parquet_files
 from helpers.spotify_api import get_artist_metadata_from_api
+from helpers.spotify_api.checkpoints import ChunkCheckpoints
 
 
 def main(input_paths: list, output_dir: str):
@@ -15,6 +16,10 @@ def main(input_paths: list, output_dir: str):
     - metadata.parquet: Contains the metadata for each artist.
     - images.parquet: Contains the available artist image URLs and sizes for each artist.
     - genres.parquet: Contains the genres for each artist.
+    - original_responses.jsonl.gz: The original API responses (gzip-compressed JSONL, one line per API call, see `helpers.spotify_api.original_responses`).
+    - checkpoints/dead_letters.jsonl: The artist IDs for which no data could be fetched (e.g. invalid IDs), together with the reason. Only created if there are any.
+
+    While fetching, the results are checkpointed to the checkpoints/ subdirectory after every chunk. If the script is interrupted, running it again with the same output directory resumes the fetch (checkpoints written for other input IDs are discarded).
 
     Currently this runs on a single thread. It could be sped up by using multiple threads.
     However, this is still fast enough for our purposes (and MUCH faster than the web scraping approach used for downloading the Spotify Chart data).
@@ -33,10 +38,24 @@ def main(input_paths: list, output_dir: str):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    spotify = create_spotipy_client()
+    spotify = get_shared_spotipy_client()
+
+    checkpoint_dir = os.path.join(output_dir, "checkpoints")
+    checkpoints = ChunkCheckpoints(checkpoint_dir)
 
-    df_dict = get_artist_metadata_from_api(artist_ids=artist_ids, spotify=spotify)
+    df_dict = get_artist_metadata_from_api(
+        artist_ids=artist_ids,
+        spotify=spotify,
+        original_responses_path=os.path.join(output_dir, "original_responses.jsonl.gz"),
+        checkpoint_dir=checkpoint_dir,
+    )
     write_dfs_in_dict_to_parquet_files(df_dict=df_dict, output_dir=output_dir)
+    checkpoints.remove_chunks()
+    dead_letter_count = len(checkpoints.dead_letter_ids())
+    if dead_letter_count > 0:
+        print(
+            f"Could not fetch data for {dead_letter_count} artist IDs, see '{checkpoints.dead_letters_path}'"
+        )
 
 
 if __name__ == "__main__":
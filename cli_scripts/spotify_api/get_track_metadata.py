@@ -1,19 +1,26 @@
 import argparse
 import os
 import pandas as pd
-from helpers.spotify_util import create_spotipy_client
+from helpers.spotify_util import get_shared_spotipy_client
 from helpers.data import write_dfs_in_dict_to_parquet_files
 from helpers.spotify_api import get_track_metadata_from_api
+from helpers.spotify_api.checkpoints import ChunkCheckpoints
+from helpers.spotify_api.markets import MARKETS_FORMATS
 
 
-def main(input_path: str, output_dir: str):
+def main(input_path: str, output_dir: str, markets_format: str = "long"):
     """
     Fetches track metadata for tracks on Spotify from the Spotify API (/tracks endpoint) using spotipy.
 
-    Three output files are generated in the specified output directory:
+    The following output files are generated in the specified output directory:
     - metadata.parquet: Contains the metadata for each track.
     - artists.parquet: Contains the artist IDs for each track (together with the 'position' of the artist, i.e. primary artist, secondary artist etc.).
     - markets.parquet: Contains the available markets for each track.
+      If markets_format is 'bitmap', market_bitmaps.parquet and market_codes.parquet are created instead (see `helpers.spotify_api.markets`).
+    - original_responses.jsonl.gz: The original API responses (gzip-compressed JSONL, one line per API call, see `helpers.spotify_api.original_responses`).
+    - checkpoints/dead_letters.jsonl: The track IDs for which no data could be fetched (e.g. invalid IDs), together with the reason. Only created if there are any.
+
+    While fetching, the results are checkpointed to the checkpoints/ subdirectory after every chunk. If the script is interrupted, running it again with the same output directory resumes the fetch (checkpoints written for other input IDs or another markets format are discarded).
 
     Currently this script runs on a single thread. It could be sped up by using multiple threads.
     However, this is still fast enough for our purposes (and MUCH faster than the web scraping approach used for downloading the Spotify Chart data).
@@ -29,10 +36,25 @@ def main(input_path: str, output_dir: str):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    spotify = create_spotipy_client()
+    spotify = get_shared_spotipy_client()
+
+    checkpoint_dir = os.path.join(output_dir, "checkpoints")
+    checkpoints = ChunkCheckpoints(checkpoint_dir)
 
-    df_dict = get_track_metadata_from_api(track_ids=track_ids, spotify=spotify)
+    df_dict = get_track_metadata_from_api(
+        track_ids=track_ids,
+        spotify=spotify,
+        markets_format=markets_format,
+        original_responses_path=os.path.join(output_dir, "original_responses.jsonl.gz"),
+        checkpoint_dir=checkpoint_dir,
+    )
     write_dfs_in_dict_to_parquet_files(df_dict=df_dict, output_dir=output_dir)
+    checkpoints.remove_chunks()
+    dead_letter_count = len(checkpoints.dead_letter_ids())
+    if dead_letter_count > 0:
+        print(
+            f"Could not fetch data for {dead_letter_count} track IDs, see '{checkpoints.dead_letters_path}'"
+        )
 
 
 if __name__ == "__main__":
@@ -51,10 +73,22 @@ if __name__ == "__main__":
         help="Path to folder where output files with track metadata will be stored.",
         required=True,
     )
+    parser.add_argument(
+        "-m",
+        "--markets_format",
+        type=str,
+        choices=MARKETS_FORMATS,
+        default="long",
+        help="How to store the available markets of each track. 'long' creates markets.parquet (one row per track and market), 'bitmap' creates market_bitmaps.parquet (one bitmap per track) and market_codes.parquet (the markets the bits refer to).",
+    )
 
     args = parser.parse_args()
 
     input_path = args.input_path
     output_dir = args.output_dir
 
-    main(input_path=input_path, output_dir=output_dir)
+    main(
+        input_path=input_path,
+        output_dir=output_dir,
+        markets_format=args.markets_format,
+    )
@@ -0,0 +1,84 @@
+# ranks all tracks in the combined charts by their importance (streams, best chart position and freshness)
+# expected to be used after running combine.py, the ranking can be passed to internal_spotify_apis/get.py (--priority_path)
+# so that the most important tracks are fetched first
+# usage: python rank_tracks.py -i <charts_file> -o <output_file> -b <streams|position|freshness>
+
+import argparse
+import os
+import pandas as pd
+
+# sort keys (column, ascending) for every ranking criterion, the later keys break ties
+RANKING_SORT_KEYS = {
+    "streams": [("total_streams", False), ("best_pos", True), ("last_date", False)],
+    "position": [("best_pos", True), ("total_streams", False), ("last_date", False)],
+    "freshness": [("last_date", False), ("total_streams", False), ("best_pos", True)],
+}
+
+
+def create_track_ranking(charts: pd.DataFrame, by: str = "streams") -> pd.DataFrame:
+    """
+    Aggregates the chart entries of every track and ranks the tracks by the given criterion (see `RANKING_SORT_KEYS`).
+
+    Returns a DataFrame with one row per track, sorted by rank (starting at 1), with the columns track_id, rank,
+    total_streams, best_pos, first_date, last_date and chart_entries.
+    """
+    if by not in RANKING_SORT_KEYS:
+        raise ValueError(
+            f"Invalid ranking criterion '{by}'. Must be one of {list(RANKING_SORT_KEYS.keys())}."
+        )
+    ranking = (
+        charts.groupby("track_id", observed=True)
+        .agg(
+            total_streams=("streams", "sum"),
+            best_pos=("pos", "min"),
+            first_date=("date", "min"),
+            last_date=("date", "max"),
+            chart_entries=("pos", "size"),
+        )
+        .reset_index()
+    )
+    columns, ascending = zip(*RANKING_SORT_KEYS[by])
+    # sorting by track ID last makes the ranking deterministic
+    ranking = ranking.sort_values(
+        list(columns) + ["track_id"], ascending=list(ascending) + [True]
+    ).reset_index(drop=True)
+    ranking.insert(1, "rank", range(1, len(ranking) + 1))
+    return ranking
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rank the tracks in the combined Spotify Charts data, e.g. for prioritizing which tracks data is fetched for first."
+    )
+    parser.add_argument(
+        "-i",
+        "--input_file",
+        type=str,
+        help="the combined charts .parquet file (created with combine.py)",
+        required=True,
+    )
+    parser.add_argument(
+        "-o",
+        "--output_file",
+        type=str,
+        help="the path of the ranking .parquet file (defaults to track_ranking.parquet in the directory of the input file)",
+    )
+    parser.add_argument(
+        "-b",
+        "--by",
+        type=str,
+        choices=list(RANKING_SORT_KEYS.keys()),
+        default="streams",
+        help="the ranking criterion: total streams, best chart position or the last date the track was in the charts (the other criteria break ties)",
+    )
+    args = parser.parse_args()
+
+    charts = pd.read_parquet(
+        args.input_file, columns=["date", "track_id", "pos", "streams"]
+    )
+    ranking = create_track_ranking(charts, by=args.by)
+    out_path = args.output_file or os.path.join(
+        os.path.dirname(args.input_file), "track_ranking.parquet"
+    )
+    ranking.to_parquet(out_path, index=False)
+    print(f"Stored ranking of {len(ranking)} tracks in '{out_path}'")
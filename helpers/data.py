@@ -2,7 +2,13 @@ import os
 import json
 from contextlib import redirect_stdout
 import re
-import pandas as pd
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Iterable, List
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def create_data_path(filename):
@@ -19,37 +25,238 @@ def write_dfs_in_dict_to_parquet_files(df_dict: dict, output_dir: str):
         print(f"Saved {df_name} to '{df_path}'")
 
 
-def load_parquet_files_in_dir(dir_path: str, index_col=None, new_index_name=None):
+def load_parquet_files_in_dir(
+    dir_path: str,
+    index_col=None,
+    new_index_name=None,
+    columns: Dict[str, List[str]] = None,
+    filters: Dict[str, list] = None,
+    max_workers: int = None,
+    cache: bool = False,
+) -> "ParquetTables":
     """
     Load all .parquet files in a directory into a dictionary of DataFrames.
 
+    The files are not read right away: the returned mapping reads every table when it is accessed for the first time
+    (and keeps it afterwards), so only the tables that are actually used are read. Use `ParquetTables.load` to read
+    several tables concurrently.
+
     Args:
-        dir_path (str): Path to directory containing .parquet files.
+        dir_path (str): Path to directory containing .parquet files (or directories of .parquet files).
         index_col (str, optional): Column to use as index for all DataFrames. Defaults to None.
         new_index_name (str, optional): Rename the index column in all DataFrames to this value. Defaults to None.
+        columns (dict, optional): The columns to read per table (table name -> list of column names). Tables that are not in the dictionary are read in full. Defaults to None.
+        filters (dict, optional): Row filters per table (table name -> filters in the format of `pd.read_parquet`, e.g. [("market", "==", "AT")]). Defaults to None.
+        max_workers (int, optional): The maximum number of threads for reading tables concurrently. Defaults to the default of `ThreadPoolExecutor`.
+        cache (bool, optional): Read the tables with `read_parquet_cached`, i.e. from memory-mapped Arrow IPC files that are created on first use. Defaults to False.
 
     Returns:
-        dict: Dictionary of DataFrames, where the keys are the file names (without the .parquet extension).
+        ParquetTables: Dictionary of DataFrames, where the keys are the file names (without the .parquet extension).
+
+    """
+    return ParquetTables(
+        dir_path,
+        index_col=index_col,
+        new_index_name=new_index_name,
+        columns=columns,
+        filters=filters,
+        max_workers=max_workers,
+        cache=cache,
+    )
 
+
+class ParquetTables(Mapping):
+    """
+    Read-only dictionary of the DataFrames stored in the .parquet files of a directory, reading every table on first
+    access (see `load_parquet_files_in_dir`).
     """
 
-    df_dict = {}
-    files = [
-        f
-        for f in os.listdir(dir_path)
-        if os.path.isfile(os.path.join(dir_path, f)) and f.endswith(".parquet")
+    def __init__(
+        self,
+        dir_path: str,
+        index_col=None,
+        new_index_name=None,
+        columns: Dict[str, List[str]] = None,
+        filters: Dict[str, list] = None,
+        max_workers: int = None,
+        cache: bool = False,
+    ):
+        self.dir_path = dir_path
+        self.index_col = index_col
+        self.new_index_name = new_index_name
+        self.columns = columns or {}
+        self.filters = filters or {}
+        self.max_workers = max_workers
+        self.cache = cache
+        # only the directory listing is read when opening the tables
+        self._paths = {
+            f.split(".")[0]: os.path.join(dir_path, f)
+            for f in sorted(os.listdir(dir_path))
+            if f.endswith(".parquet")
+        }
+        self._dfs = {}
+        self._locks = {name: threading.Lock() for name in self._paths}
+
+    def __getitem__(self, name: str) -> "pd.DataFrame":
+        if name not in self._paths:
+            raise KeyError(name)
+        with self._locks[name]:
+            if name not in self._dfs:
+                self._dfs[name] = self._read(name)
+        return self._dfs[name]
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __repr__(self):
+        tables = ", ".join(
+            f"'{name}'" + ("" if name in self._dfs else " (not loaded)")
+            for name in self._paths
+        )
+        return f"{type(self).__name__}({tables})"
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._dfs
+
+    def load(self, names: Iterable[str] = None) -> Dict[str, "pd.DataFrame"]:
+        """
+        Reads several tables (all tables if `names` is not provided) concurrently in a thread pool.
+
+        Returns:
+            dict: Dictionary of the requested DataFrames.
+        """
+        names = list(self._paths if names is None else names)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            dfs = list(executor.map(self.__getitem__, names))
+        return dict(zip(names, dfs))
+
+    def _read(self, name: str) -> "pd.DataFrame":
+        import pandas as pd
+
+        read = read_parquet_cached if self.cache else pd.read_parquet
+        df = read(
+            self._paths[name],
+            columns=self.columns.get(name),
+            filters=self.filters.get(name),
+        )
+        if self.index_col:
+            df = df.set_index(self.index_col)
+        if self.new_index_name:
+            df = df.rename_axis(self.new_index_name)
+        return df
+
+
+def read_parquet_cached(
+    path: str,
+    columns: List[str] = None,
+    filters: list = None,
+    as_arrow: bool = False,
+):
+    """
+    Reads a .parquet file (or directory of .parquet files) via a cache of the decoded table: on first use, the table is
+    written uncompressed to an Arrow IPC file in the .arrow_cache directory next to it. Later reads (also from other
+    processes or notebook kernels) memory-map that file instead of decompressing and decoding the Parquet data again,
+    the operating system shares the mapped pages between all of them.
+
+    The cache file is rebuilt if the size or modification time of the source has changed (they are stored in the cache
+    file's schema metadata). Cache files are written to a temporary file and renamed, so concurrent readers never see
+    incomplete files.
+
+    Args:
+        path (str): Path to the .parquet file or directory.
+        columns (list, optional): The columns to read (all columns if not provided). Only these columns are mapped.
+        filters (list, optional): Row filters in the format of `pd.read_parquet`, e.g. [("market", "==", "AT")].
+        as_arrow (bool, optional): Return the (zero-copy, memory-mapped) pyarrow Table instead of converting it to a DataFrame. Defaults to False.
+
+    Returns:
+        pd.DataFrame or pyarrow.Table: The table.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    cache_path = get_cache_path(path)
+    source_stats = _get_source_stats(path)
+    table = _read_arrow_cache(cache_path, source_stats)
+    if table is None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        table = pq.read_table(path)
+        metadata = {**(table.schema.metadata or {}), **source_stats}
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema.with_metadata(metadata)) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, cache_path)
+        table = _read_arrow_cache(cache_path, source_stats)
+
+    if filters:
+        table = table.filter(pq.filters_to_expression(filters))
+    if columns is not None:
+        table = table.select(columns + _get_pandas_index_columns(table, columns))
+    return table if as_arrow else table.to_pandas()
+
+
+def get_cache_path(path: str) -> str:
+    """
+    Returns the path of the Arrow IPC cache file of a .parquet file or directory (see `read_parquet_cached`).
+    """
+    path = os.path.abspath(path)
+    name = os.path.basename(path.rstrip(os.sep))
+    return os.path.join(
+        os.path.dirname(path.rstrip(os.sep)), ".arrow_cache", f"{name}.arrow"
+    )
+
+
+def _get_pandas_index_columns(table, columns: List[str]) -> List[str]:
+    # like `pd.read_parquet`, the index columns stored by pandas are always read (RangeIndexes are stored as metadata only)
+    metadata = (table.schema.metadata or {}).get(b"pandas")
+    if metadata is None:
+        return []
+    return [
+        name
+        for name in json.loads(metadata).get("index_columns", [])
+        if isinstance(name, str) and name not in columns
     ]
 
-    for file in files:
-        file_path = os.path.join(dir_path, file)
-        df = pd.read_parquet(file_path)
-        if index_col:
-            df = df.set_index(index_col)
-        if new_index_name:
-            df = df.rename_axis(new_index_name)
-        df_dict[file.split(".")[0]] = df
 
-    return df_dict
+def _get_source_stats(path: str) -> Dict[bytes, bytes]:
+    if os.path.isdir(path):
+        stats = [
+            os.stat(os.path.join(root, f))
+            for root, _, files in os.walk(path)
+            for f in files
+            if f.endswith(".parquet")
+        ]
+    else:
+        stats = [os.stat(path)]
+    return {
+        b"source_size": str(sum(s.st_size for s in stats)).encode(),
+        b"source_mtime_ns": str(
+            max((s.st_mtime_ns for s in stats), default=0)
+        ).encode(),
+        b"source_file_count": str(len(stats)).encode(),
+    }
+
+
+def _read_arrow_cache(cache_path: str, source_stats: Dict[bytes, bytes]):
+    import pyarrow as pa
+
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        reader = pa.ipc.open_file(pa.memory_map(cache_path, "r"))
+    except pa.ArrowInvalid:
+        return None
+    metadata = reader.schema.metadata or {}
+    if any(metadata.get(key) != value for key, value in source_stats.items()):
+        return None
+    table = reader.read_all()
+    # the cache metadata is not part of the table
+    return table.replace_schema_metadata(
+        {k: v for k, v in metadata.items() if k not in source_stats}
+    )
 
 
 def write_dict_to_file_as_prettified_json(
@@ -61,13 +268,13 @@ def write_dict_to_file_as_prettified_json(
 
 
 def write_series_to_file_as_prettified_json(
-    series: pd.Series, file_path=create_data_path("pretty_out.json")
+    series: "pd.Series", file_path=create_data_path("pretty_out.json")
 ):
     with open(file_path, "w") as f:
         with redirect_stdout(f):
             print(series.to_json(indent=4))
 
 
-def convert_columns_to_snake_case(df: pd.DataFrame):
+def convert_columns_to_snake_case(df: "pd.DataFrame"):
     df = df.rename(columns=lambda x: re.sub(r"(?<!^)(?=[A-Z])", "_", x).lower())
     return df
@@ -1,10 +1,9 @@
-from typing import Callable, Set
+from typing import Callable, Collection, Dict, List, Optional, Set, TYPE_CHECKING
+import threading
 import time
-from selenium import webdriver
 from helpers.spotify_util import get_spotify_track_link
 import json
 import random
-from selenium.webdriver.common.by import By
 from helpers.scraping import (
     get_spotify_credentials,
     get_element_with_att_and_val,
@@ -12,8 +11,20 @@ from helpers.scraping import (
     accept_cookies,
     login_and_accept_cookies,
 )
+from .headers import THROTTLED_STATUS_CODE, UNAUTHORIZED_STATUS_CODE
 
-from .credits import process_credits
+if TYPE_CHECKING:
+    from selenium import webdriver
+    from .headers import HeadersPool
+
+
+def __getattr__(name: str):
+    # credits processing needs pandas, so only import it when it is actually used
+    if name == "process_credits":
+        from .credits import process_credits
+
+        return process_credits
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
 
 INTERNAL_API_BASE_URL = "https://spclient.wg.spotify.com/"
@@ -29,16 +40,57 @@ def get_lyrics_api_url(track_id: str):
     return f"{INTERNAL_API_BASE_URL}color-lyrics/v2/track/{track_id}"
 
 
-internal_api_endpoints = {
-    "credits": {
-        "url_getter": get_credits_api_url,
-        "requires_login": False,
-    },
-    "lyrics": {
-        "url_getter": get_lyrics_api_url,
-        "requires_login": True,
-    },
-}
+# registry of internal API endpoints (name -> endpoint descriptor), see `register_internal_api_endpoint`
+# credits and lyrics are registered at the end of this module (after their request trigger functions)
+internal_api_endpoints = {}
+
+
+def is_valid_response(result: dict) -> bool:
+    """
+    Default response validator: responses are usable if they are successful and don't contain an error.
+    """
+    return result["status_code"] == 200 and "error" not in result["content"]
+
+
+def register_internal_api_endpoint(
+    name: str,
+    url_getter: Callable[[str], str],
+    request_trigger: Callable[["webdriver.Chrome"], None],
+    requires_login: bool = False,
+    parallel_requests: int = 1,
+    requests_per_second: float = 0,
+    retry_status_codes: Collection[int] = frozenset(
+        [UNAUTHORIZED_STATUS_CODE, THROTTLED_STATUS_CODE]
+    ),
+    validator: Callable[[dict], bool] = is_valid_response,
+    post_processor: Optional[Callable[[dict], dict]] = None,
+):
+    """
+    Registers an internal API endpoint, so data can be fetched from it with `cli_scripts/internal_spotify_apis/get.py`
+    (the fetch loop only uses the endpoint descriptor, no further changes are needed).
+
+    Args:
+        name: name of the endpoint (used as resource name on the command line and in the default output file names).
+        url_getter: function returning the URL of the endpoint for a track ID.
+        request_trigger: function triggering a request to the endpoint on a track page opened in the webdriver (e.g. by clicking a button), used for getting the request headers.
+        requires_login: whether the endpoint can only be used by logged in users.
+        parallel_requests: default number of requests in flight (per session).
+        requests_per_second: default rate limit (per session, 0 for no limit).
+        retry_status_codes: status codes for which requests are retried.
+        validator: function deciding whether a response (as created by `create_response_dict` in `get.py`) contains usable data (otherwise it is written to the error log).
+        post_processor: function applied to usable responses before they are written (e.g. for removing unneeded fields).
+    """
+    internal_api_endpoints[name] = {
+        "name": name,
+        "url_getter": url_getter,
+        "request_trigger": request_trigger,
+        "requires_login": requires_login,
+        "parallel_requests": parallel_requests,
+        "requests_per_second": requests_per_second,
+        "retry_status_codes": frozenset(retry_status_codes),
+        "validator": validator,
+        "post_processor": post_processor,
+    }
 
 
 class InternalRequestHeadersGetter:
@@ -54,12 +106,20 @@ class InternalRequestHeadersGetter:
     """
 
     def __init__(
-        self, resource_name: str, track_ids: Set[str], cookies_path: str = None
+        self,
+        resource_name: str,
+        track_ids: Set[str],
+        cookies_path: str = None,
+        driver: "webdriver.Chrome" = None,
+        driver_lock: threading.Lock = None,
     ):
         """
         Args:
             resource_name: name of the internal API endpoint to get the request headers for.
             track_ids: list of Spotify track IDs to try when attemtping to get API request headers.
+            cookies_path: path to a cookies file (created with `save_cookies.py`) that is loaded into the webdriver.
+            driver: an existing webdriver to use (e.g. shared by the headers getters of several endpoints). If not provided, a new one is started (and quit when the headers getter is deleted).
+            driver_lock: lock for using a shared webdriver (headers may be fetched from several threads at the same time).
         """
 
         self.url_getter = internal_api_endpoints[resource_name]["url_getter"]
@@ -72,13 +132,17 @@ class InternalRequestHeadersGetter:
                 print("Make sure provided cookies are for a logged-in Spotify account")
             print()
 
-        self.driver = InternalRequestHeadersGetter.setup_webdriver(
-            credentials_required=credentials_required,
-            cookies_path=cookies_path,
-        )
-        self.request_trigger = (
-            InternalRequestHeadersGetter._internal_request_trigger_fns[resource_name]
+        self._owns_driver = driver is None
+        self.driver = (
+            driver
+            if driver is not None
+            else InternalRequestHeadersGetter.setup_webdriver(
+                credentials_required=credentials_required,
+                cookies_path=cookies_path,
+            )
         )
+        self.driver_lock = driver_lock if driver_lock is not None else threading.Lock()
+        self.request_trigger = internal_api_endpoints[resource_name]["request_trigger"]
         self.track_ids = track_ids
 
     @staticmethod
@@ -87,6 +151,8 @@ class InternalRequestHeadersGetter:
         credentials_required: tuple = None,
         cookies_path: str = None,
     ):
+        from selenium import webdriver
+
         while True:
             try:
                 options = webdriver.ChromeOptions()
@@ -128,6 +194,10 @@ class InternalRequestHeadersGetter:
         Gets the headers for making requests to the internal Spotify API for the resource which the RequestHeaderGetter was initialized with.
         """
 
+        with self.driver_lock:
+            return self._get_headers()
+
+    def _get_headers(self):
         headers = None
         while headers is None:
             # This may sometimes fail, not entirely sure why, but it seems to always work if we just retry once or twice with different track IDs.
@@ -156,17 +226,71 @@ class InternalRequestHeadersGetter:
 
         return headers
 
-    _internal_request_trigger_fns = {
-        "credits": lambda driver: _open_credits_popup(driver),
-        "lyrics": lambda driver: _open_lyrics_view(driver),
-    }
-
     def __del__(self):
-        if hasattr(self, "driver") and self.driver is not None:
+        if getattr(self, "_owns_driver", False) and self.driver is not None:
             self.driver.quit()
 
 
-def _open_credits_popup(driver: webdriver.Chrome):
+def create_headers_pool(
+    resource_name: str, track_ids: Set[str], cookies_paths: List[str] = None
+) -> "HeadersPool":
+    """
+    Creates a pool of request headers for the given internal API endpoint, with one browser session per cookies file
+    (e.g. for different Spotify accounts), so that requests can be spread over several sessions (see `helpers.internal_spotify_apis.headers`).
+
+    Args:
+        resource_name: name of the internal API endpoint to get the request headers for.
+        track_ids: list of Spotify track IDs to try when attempting to get API request headers.
+        cookies_paths: paths to cookies files (created with `save_cookies.py`). If not provided, a single session without cookies is used.
+    """
+    return create_headers_pools([resource_name], track_ids, cookies_paths)[
+        resource_name
+    ]
+
+
+def create_headers_pools(
+    resource_names: List[str], track_ids: Set[str], cookies_paths: List[str] = None
+) -> Dict[str, "HeadersPool"]:
+    """
+    Creates a headers pool (see `create_headers_pool`) for each of the given internal API endpoints.
+    The endpoints share the browser sessions (one webdriver per cookies file), so only one browser is started per session
+    (it is logged in if any of the endpoints requires a login).
+
+    Returns:
+        A dictionary mapping every resource name to its headers pool.
+    """
+    from .headers import HeadersLease, HeadersPool
+
+    # the webdriver is started by the first headers getter, so endpoints requiring a login have to come first
+    ordered_resource_names = sorted(
+        resource_names,
+        key=lambda name: not internal_api_endpoints[name]["requires_login"],
+    )
+    leases = {name: [] for name in resource_names}
+    for cookies_path in cookies_paths or [None]:
+        driver = None
+        driver_lock = threading.Lock()
+        for resource_name in ordered_resource_names:
+            headers_getter = InternalRequestHeadersGetter(
+                resource_name=resource_name,
+                track_ids=track_ids,
+                cookies_path=cookies_path,
+                driver=driver,
+                driver_lock=driver_lock,
+            )
+            driver = headers_getter.driver
+            leases[resource_name].append(
+                HeadersLease(
+                    get_headers=headers_getter.get_headers,
+                    initial_headers=headers_getter.get_headers(),
+                )
+            )
+    return {name: HeadersPool(leases[name]) for name in resource_names}
+
+
+def _open_credits_popup(driver: "webdriver.Chrome"):
+    from selenium.webdriver.common.by import By
+
     more_button = get_element_with_att_and_val(driver, "data-testid", "more-button")
     more_button.click()
     credits_button = driver.find_element(
@@ -176,7 +300,7 @@ def _open_credits_popup(driver: webdriver.Chrome):
     credits_button.click()
 
 
-def _open_lyrics_view(driver: webdriver.Chrome):
+def _open_lyrics_view(driver: "webdriver.Chrome"):
     try:
         lyrics_button = get_element_with_att_and_val(
             driver, "data-testid", "lyrics-button"
@@ -205,3 +329,23 @@ def _is_internal_api_request(
             "documentURL"
         ].startswith("https://open.spotify.com/track/")
     )
+
+
+register_internal_api_endpoint(
+    name="credits",
+    url_getter=get_credits_api_url,
+    request_trigger=_open_credits_popup,
+    requires_login=False,
+    parallel_requests=100,
+    # the old chunk-based implementation started ~13 requests per second (by staggering the requests of every chunk)
+    requests_per_second=50,
+)
+register_internal_api_endpoint(
+    name="lyrics",
+    url_getter=get_lyrics_api_url,
+    request_trigger=_open_lyrics_view,
+    requires_login=True,
+    # we surely cannot send too much at once, as we will get 429 errors
+    parallel_requests=50,
+    requests_per_second=20,
+)
@@ -1,6 +1,82 @@
+"""
+Processing of the responses of the internal Spotify credits API.
+
+The role credits of all tracks (lists of roles, each with a list of credited artists) are flattened into one row per
+credited artist with Arrow list operations (instead of building a dict for every artist in Python):
+- `list_flatten`/`list_parent_indices` explode the roles of every track and the artists of every role, the positions
+  of the artists within their role are derived from the list offsets with NumPy
+- duplicated subroles are removed by flattening the subroles as well and dropping duplicated (artist, subrole) pairs
+- the artist URIs are validated and the artist IDs extracted with vectorized string functions
+
+`process_credits_file` processes a whole file of credits responses (as written by `cli_scripts/internal_spotify_apis/get.py`)
+in a streaming fashion: the responses are read in batches, only the roleCredits subtree of every response is parsed
+(with `pyarrow.json` and an explicit schema, all other fields are skipped), and the rows of every batch are appended
+to the writers/producers/performers Parquet files, so the memory usage does not depend on the size of the file.
+It is incremental, i.e. only responses that were added to the file since the last run are processed. Credited persons are
+stored once in a persons table and referenced by key (see `helpers.internal_spotify_apis.persons`).
+"""
+
+import json
+import os
+import shutil
 import pandas as pd
-from typing import Dict
+from typing import Dict, Iterator, List, Tuple
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .storage import parse_json_lines
+from .persons import (
+    PERSONS_FILE_NAME,
+    PersonDimension,
+    load_persons,
+    save_persons,
+)
+
+ARTIST_URI_PREFIX = "spotify:artist:"
+
+# schema of the relevant part of the credits API responses (fields that are not in the schema are skipped when parsing)
+CREDITED_ARTIST_TYPE = pa.struct(
+    [
+        ("uri", pa.string()),
+        ("name", pa.string()),
+        ("imageUri", pa.string()),
+        ("subroles", pa.list_(pa.string())),
+        ("weight", pa.float64()),
+        ("externalUrl", pa.string()),
+        ("creatorUri", pa.string()),
+    ]
+)
+ROLE_CREDITS_TYPE = pa.list_(
+    pa.struct([("roleTitle", pa.string()), ("artists", pa.list_(CREDITED_ARTIST_TYPE))])
+)
+CREDITS_CONTENT_TYPE = pa.struct([("roleCredits", ROLE_CREDITS_TYPE)])
+CREDITS_RESPONSE_SCHEMA = pa.schema(
+    [
+        ("track_id", pa.string()),
+        ("status_code", pa.int64()),
+        ("content", CREDITS_CONTENT_TYPE),
+    ]
+)
+CREDITS_TABLE_NAMES = ["writers", "producers", "performers"]
+CREDITS_STATE_FILE_NAME = "state.json"
+# columns of the flattened credits (in the order of `_create_credits_df`)
+CREDITS_COLUMNS = [
+    "artist_id",
+    "name",
+    "pos",
+    "uri",
+    "imageUri",
+    "subroles",
+    "weight",
+    "roleTitle",
+    "track_id",
+    "externalUrl",
+    "creatorUri",
+]
+# columns of the flattened credits that are replaced by the person_key column in the output of `process_credits_file`
+PERSON_COLUMNS = ["artist_id", "name", "uri"]
 
 
 def process_credits(credits_resp_content: pd.DataFrame) -> Dict[str, pd.DataFrame]:
@@ -47,44 +123,411 @@ def process_credits(credits_resp_content: pd.DataFrame) -> Dict[str, pd.DataFram
 
 
 def _create_credits_df(role_credits: pd.Series):
-    rows = []
+    table = flatten_role_credits(
+        track_ids=pa.array(role_credits.index, pa.string()),
+        role_credits=pa.array(role_credits.tolist()),
+    )
+    # the subroles are lists (not NumPy arrays, which `to_pandas` would create)
+    roles_df = table.drop_columns(["subroles"]).to_pandas()
+    roles_df.insert(
+        table.column_names.index("subroles"),
+        "subroles",
+        table.column("subroles").to_pylist(),
+    )
+    return roles_df
 
-    for track_id, track_role_credits in role_credits.items():
-        rows.extend(_create_credits_rows(track_id, track_role_credits))
 
-    roles_df = pd.DataFrame(rows)
+def flatten_role_credits(track_ids: pa.Array, role_credits: pa.Array) -> pa.Table:
+    """
+    Flattens the role credits of tracks into a table with one row per credited artist.
 
-    # remove duplicates in every subroles array - nonsenical values like ['producer', 'producer'] can occur
-    roles_df.subroles = roles_df.subroles.apply(lambda x: list(set(x)))
+    Args:
+        track_ids: The track IDs.
+        role_credits: The roleCredits of every track (list<struct<roleTitle: string, artists: list<struct<...>>>>), e.g. parsed with `pyarrow.json`.
+
+    Returns:
+        A table with the columns artist_id, name and pos (the position of the artist within the role, starting at 1), followed by
+        the other fields of the artists (in the order of their first occurrence), the role title (singular, e.g. 'Writer') and the track ID.
+    """
+    if isinstance(role_credits, pa.ChunkedArray):
+        role_credits = role_credits.combine_chunks()
+    roles = pc.list_flatten(role_credits)
+    role_track_indices = pc.list_parent_indices(role_credits)
+    role_artists = pc.struct_field(roles, "artists")
+    artists = pc.list_flatten(role_artists)
+    artist_role_indices = pc.list_parent_indices(role_artists).to_numpy()
+
+    # position of every artist within its role, derived from the list offsets
+    artist_counts = pc.fill_null(pc.list_value_length(role_artists), 0).to_numpy()
+    role_starts = np.cumsum(artist_counts) - artist_counts
+    pos = np.arange(len(artists)) - role_starts[artist_role_indices] + 1
+
+    columns = {
+        field.name: pc.struct_field(artists, field.name) for field in artists.type
+    }
+    if "subroles" in columns:
+        # remove duplicates in every subroles array - nonsenical values like ['producer', 'producer'] can occur
+        columns["subroles"] = _remove_duplicate_list_values(columns["subroles"])
 
     # verify that all non-empty uri values are indeed Spotify artist URIs
-    assert roles_df.uri.apply(
-        lambda uri: uri.startswith("spotify:artist:") if type(uri) == str else True
-    ).all(), "At least one non-empty uri value is not a Spotify artist URI"
-    roles_df["artist_id"] = roles_df.uri.apply(
-        lambda uri: uri.split("spotify:artist:")[1] if type(uri) == str else np.nan
+    is_artist_uri = pc.fill_null(
+        pc.starts_with(columns["uri"], ARTIST_URI_PREFIX), True
     )
+    assert pc.all(
+        is_artist_uri, min_count=0
+    ).as_py(), "At least one non-empty uri value is not a Spotify artist URI"
+    artist_id = pc.utf8_slice_codeunits(columns["uri"], len(ARTIST_URI_PREFIX))
+
+    role_titles = pc.struct_field(roles, "roleTitle").take(artist_role_indices)
+    columns["roleTitle"] = pc.utf8_slice_codeunits(role_titles, 0, -1)
+    columns["pos"] = pa.array(pos, pa.int64())
+    columns["track_id"] = track_ids.take(role_track_indices.take(artist_role_indices))
 
+    # same column order as when creating a DataFrame from one dict per artist: the fields of the first artist,
+    # the added fields, then the fields that only occur in later artists
+    first_fields = (
+        [name for name in artists.type.names if columns[name][0].is_valid]
+        if len(artists) > 0
+        else []
+    )
+    names = list(
+        dict.fromkeys(
+            first_fields + ["roleTitle", "pos", "track_id"] + artists.type.names
+        )
+    )
     # make sure artist_id, name, and pos are first three columns
-    roles_df = roles_df[
-        ["artist_id", "name", "pos"]
-        + [col for col in roles_df.columns if col not in ["artist_id", "name", "pos"]]
+    names = ["artist_id", "name", "pos"] + [
+        name for name in names if name not in ["name", "pos"]
     ]
+    columns["artist_id"] = artist_id
+    return pa.table({name: columns[name] for name in names})
 
-    return roles_df
 
+def _remove_duplicate_list_values(lists: pa.Array) -> pa.Array:
+    """
+    Removes duplicate values from every list (keeping the first occurrence of every value).
+    """
+    values = pc.list_flatten(lists)
+    parent_indices = pc.list_parent_indices(lists).to_numpy()
+    # only lists with at least two values can contain duplicates
+    lengths = pc.fill_null(pc.list_value_length(lists), 0).to_numpy()
+    candidates = np.flatnonzero(lengths[parent_indices] >= 2)
+    is_duplicate = np.zeros(len(values), dtype=bool)
+    is_duplicate[candidates] = (
+        pd.DataFrame(
+            {
+                "parent": parent_indices[candidates],
+                "value": values.take(candidates).to_pandas(),
+            }
+        )
+        .duplicated()
+        .to_numpy()
+    )
+    if not is_duplicate.any():
+        return lists
+    keep = ~is_duplicate
+    counts = np.bincount(parent_indices[keep], minlength=len(lists))
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+    return pa.ListArray.from_arrays(
+        pa.array(offsets),
+        values.filter(pa.array(keep)),
+        mask=lists.is_null(),
+    )
+
+
+def process_credits_file(
+    input_path: str,
+    output_folder_path: str,
+    batch_size: int = 10000,
+    full: bool = False,
+) -> Dict[str, int]:
+    """
+    Processes the credits API responses in a file (in batches of `batch_size` responses) and writes the writers, producers
+    and performers to Parquet tables in the output folder.
+
+    Processing is incremental: the output folder contains a state file recording how much of the input has been processed
+    already (the byte offset in a JSONL file, or the part files of a directory of Parquet files), and only responses that
+    were added since the last run are processed. Every output table is a directory (writers.parquet, producers.parquet and
+    performers.parquet) with one part file per run that found new responses. As `get.py` only ever appends responses for
+    new track IDs, appending new rows is enough to keep the tables up to date.
+
+    The tables reference the credited persons by a person_key column (instead of the artist_id, name and uri columns), the
+    persons are written to persons.parquet (see `helpers.internal_spotify_apis.persons`, and `read_credits_table` for
+    reading a table with the names and artist IDs).
+
+    Args:
+        input_path: Path to a (optionally zstd-compressed) JSONL file with the responses, or to a directory of Parquet files (see `helpers.internal_spotify_apis.parquet_storage`).
+        output_folder_path: Path to the directory where the Parquet tables are written to.
+        batch_size: Number of responses that are processed at once.
+        full: Whether to process all responses again (replacing the existing output tables).
+
+    Returns:
+        The number of rows added to every output table.
+    """
+    from .storage import get_indexed_size, get_storage
+
+    os.makedirs(output_folder_path, exist_ok=True)
+    state_path = os.path.join(output_folder_path, CREDITS_STATE_FILE_NAME)
+    state = _load_credits_state(state_path)
+    input_storage = get_storage(input_path)
+    if input_storage == "jsonl":
+        end_offset = get_indexed_size(input_path)
+    if (
+        full
+        or state is None
+        or state["input_path"] != os.path.abspath(input_path)
+        or (input_storage == "jsonl" and state["offset"] > end_offset)
+    ):
+        if state is not None and not full:
+            print(
+                f"Input '{input_path}' does not match the processed input, processing all responses again"
+            )
+        state = _reset_credits_output(output_folder_path, input_path)
+    else:
+        _remove_uncommitted_part_files(output_folder_path, state)
+    persons = load_persons(output_folder_path)
+    person_count = len(persons)
 
-def _create_credits_rows(track_id: str, role_credits: list):
-    rows = []
-    for role in role_credits:
-        title = role["roleTitle"]
-        for i, artist in enumerate(role["artists"]):
-            rows.append(
-                {
-                    **artist,
-                    "roleTitle": title[:-1],
-                    "pos": i + 1,
-                    "track_id": track_id,
-                }
+    if input_storage == "jsonl":
+        if state["offset"] > 0:
+            print(f"Skipping the first {state['offset']} bytes (already processed)")
+        batches = _iter_jsonl_role_credits(
+            input_path, batch_size, start_offset=state["offset"], end_offset=end_offset
+        )
+    else:
+        from .parquet_storage import get_part_file_paths
+
+        part_file_names = [os.path.basename(p) for p in get_part_file_paths(input_path)]
+        new_part_file_names = [
+            name
+            for name in part_file_names
+            if name not in state["processed_part_files"]
+        ]
+        batches = _iter_parquet_role_credits(
+            [os.path.join(input_path, name) for name in new_part_file_names],
+            batch_size,
+        )
+
+    part_file_name = f"part-{state['next_part']:05d}.parquet"
+    writers = {}
+    row_counts = {name: 0 for name in CREDITS_TABLE_NAMES}
+    try:
+        for track_ids, role_credits in batches:
+            credits = _reference_persons(
+                flatten_role_credits(track_ids, role_credits).select(CREDITS_COLUMNS),
+                persons,
             )
-    return rows
+            for name, table in split_credits_by_role(credits).items():
+                if name not in writers:
+                    writers[name] = _create_part_file_writer(
+                        output_folder_path, name, part_file_name, table.schema
+                    )
+                writers[name].write_table(table)
+                row_counts[name] += table.num_rows
+        if state["next_part"] == 0:
+            # make sure every table exists (with the right schema), even if there are no rows for it
+            for name, table in _create_empty_credits_tables().items():
+                if name not in writers:
+                    writers[name] = _create_part_file_writer(
+                        output_folder_path, name, part_file_name, table.schema
+                    )
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # the part files (and persons) are moved into place before the state is updated: if the process is killed in between,
+    # the part files are removed again in the next run (as they are not recorded in the state) and the responses are
+    # processed again (the persons that were added are found again, so they keep their keys)
+    if len(persons) > person_count or state["next_part"] == 0:
+        save_persons(output_folder_path, persons)
+    for name in writers:
+        part_path = os.path.join(output_folder_path, f"{name}.parquet", part_file_name)
+        os.replace(part_path + ".tmp", part_path)
+        state["part_files"][name].append(part_file_name)
+    if len(writers) > 0:
+        state["next_part"] += 1
+    if input_storage == "jsonl":
+        state["offset"] = end_offset
+    else:
+        state["processed_part_files"] = part_file_names
+    _save_credits_state(state_path, state)
+    return row_counts
+
+
+def iter_role_credits(
+    input_path: str, batch_size: int = 10000
+) -> Iterator[Tuple[pa.Array, pa.Array]]:
+    """
+    Yields the track IDs and role credits of the successful responses in a file of credits API responses, in batches of up to `batch_size` responses.
+    Only the roleCredits of the responses are parsed.
+
+    Args:
+        input_path: Path to a (optionally zstd-compressed) JSONL file with the responses, or to a directory of Parquet files (see `helpers.internal_spotify_apis.parquet_storage`).
+        batch_size: Maximum number of responses per batch.
+    """
+    from .storage import get_storage
+
+    if get_storage(input_path) == "parquet":
+        from .parquet_storage import get_part_file_paths
+
+        return _iter_parquet_role_credits(get_part_file_paths(input_path), batch_size)
+    return _iter_jsonl_role_credits(input_path, batch_size)
+
+
+def _iter_jsonl_role_credits(
+    path: str, batch_size: int, start_offset: int = 0, end_offset: int = None
+):
+    from .storage import read_line_batches
+
+    for lines in read_line_batches(path, batch_size, start_offset, end_offset):
+        responses = parse_json_lines(lines, CREDITS_RESPONSE_SCHEMA)
+        responses = responses.filter(pc.equal(responses.column("status_code"), 200))
+        yield responses.column("track_id"), pc.struct_field(
+            responses.column("content"), "roleCredits"
+        )
+
+
+def _iter_parquet_role_credits(part_file_paths: List[str], batch_size: int):
+    from .parquet_storage import iter_parsed_contents
+
+    for track_ids, content in iter_parsed_contents(
+        part_file_paths, pa.schema(CREDITS_CONTENT_TYPE), batch_size
+    ):
+        yield track_ids, content.column("roleCredits")
+
+
+def read_credits_table(output_folder_path: str, name: str) -> pa.Table:
+    """
+    Reads a table written by `process_credits_file` (writers, producers or performers) with the artist_id, name and uri
+    columns of the referenced persons (in the same order as in the tables returned by `process_credits`), followed by the
+    person_key column.
+
+    Only credits that had an artist URI in the response get an artist_id and uri, credits without one keep null values
+    even if they are linked to an artist with the same name (see the linked_artist_key column of persons.parquet). The
+    name is the name of the person when it was first seen, i.e. differently written names (e.g. in another case) are
+    returned in the same spelling.
+    """
+    table = pq.read_table(os.path.join(output_folder_path, f"{name}.parquet"))
+    persons = pq.read_table(
+        os.path.join(output_folder_path, PERSONS_FILE_NAME),
+        columns=["person_key", "artist_id", "name"],
+    )
+    person_keys = table.column("person_key")
+    indices = pc.index_in(person_keys, persons.column("person_key"))
+    artist_ids = persons.column("artist_id").take(indices)
+    return (
+        table.drop_columns(["person_key"])
+        .add_column(0, "artist_id", artist_ids)
+        .add_column(1, "name", persons.column("name").take(indices))
+        .add_column(
+            3, "uri", pc.binary_join_element_wise(ARTIST_URI_PREFIX, artist_ids, "")
+        )
+        .append_column("person_key", person_keys)
+    )
+
+
+def _reference_persons(credits: pa.Table, persons: PersonDimension) -> pa.Table:
+    person_keys = persons.get_keys(credits.column("name"), credits.column("artist_id"))
+    return credits.drop_columns(PERSON_COLUMNS).add_column(0, "person_key", person_keys)
+
+
+def _create_empty_credits_tables() -> Dict[str, pa.Table]:
+    return split_credits_by_role(
+        _reference_persons(
+            flatten_role_credits(
+                pa.array([], pa.string()), pa.array([], ROLE_CREDITS_TYPE)
+            ).select(CREDITS_COLUMNS),
+            PersonDimension(),
+        )
+    )
+
+
+def _create_part_file_writer(
+    output_folder_path: str, table_name: str, part_file_name: str, schema: pa.Schema
+):
+    table_path = os.path.join(output_folder_path, f"{table_name}.parquet")
+    os.makedirs(table_path, exist_ok=True)
+    return pq.ParquetWriter(os.path.join(table_path, part_file_name + ".tmp"), schema)
+
+
+def _load_credits_state(state_path: str):
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, "r") as f:
+        return json.load(f)
+
+
+def _save_credits_state(state_path: str, state: dict):
+    with open(state_path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_path + ".tmp", state_path)
+
+
+def _reset_credits_output(output_folder_path: str, input_path: str) -> dict:
+    """
+    Removes existing output tables (also single files written by earlier versions of this module) and returns a new state.
+    """
+    if os.path.exists(os.path.join(output_folder_path, PERSONS_FILE_NAME)):
+        os.remove(os.path.join(output_folder_path, PERSONS_FILE_NAME))
+    for name in CREDITS_TABLE_NAMES:
+        table_path = os.path.join(output_folder_path, f"{name}.parquet")
+        if os.path.isdir(table_path):
+            shutil.rmtree(table_path)
+        elif os.path.exists(table_path):
+            os.remove(table_path)
+    return {
+        "input_path": os.path.abspath(input_path),
+        "offset": 0,
+        "processed_part_files": [],
+        "part_files": {name: [] for name in CREDITS_TABLE_NAMES},
+        "next_part": 0,
+    }
+
+
+def _remove_uncommitted_part_files(output_folder_path: str, state: dict):
+    """
+    Removes part files that are not recorded in the state (left behind by a run that was killed).
+    """
+    for name in CREDITS_TABLE_NAMES:
+        table_path = os.path.join(output_folder_path, f"{name}.parquet")
+        if not os.path.isdir(table_path):
+            continue
+        for file_name in os.listdir(table_path):
+            if file_name not in state["part_files"][name]:
+                os.remove(os.path.join(table_path, file_name))
+
+
+def split_credits_by_role(credits: pa.Table) -> Dict[str, pa.Table]:
+    """
+    Splits flattened credits (see `flatten_role_credits`) into writers, producers, and performers (like `process_credits`, but with Arrow tables).
+    """
+    role_titles = credits.column("roleTitle")
+    writers = credits.filter(pc.equal(role_titles, "Writer")).drop_columns(
+        ["roleTitle"]
+    )
+
+    producers = credits.filter(pc.equal(role_titles, "Producer")).drop_columns(
+        ["roleTitle"]
+    )
+    # data exploration showed that all producers have exactly one subrole, which is always "producer"
+    # verify this assumption
+    producer_subroles = producers.column("subroles")
+    assert pc.all(
+        pc.equal(pc.list_value_length(producer_subroles), 1), min_count=0
+    ).as_py(), "At least one producer has multiple subroles"
+    assert pc.all(
+        pc.equal(pc.list_flatten(producer_subroles), "producer"), min_count=0
+    ).as_py(), "At least one producer has subroles != ['producer']"
+    # verify that all externalUrl and creatorUri values are indeed null (as in data exploration)
+    for column in ["externalUrl", "creatorUri"]:
+        assert producers.column(column).null_count == producers.num_rows
+    producers = producers.drop_columns(["subroles", "externalUrl", "creatorUri"])
+
+    performers = credits.filter(pc.equal(role_titles, "Performer")).drop_columns(
+        ["roleTitle"]
+    )
+    for column in ["externalUrl", "creatorUri"]:
+        assert performers.column(column).null_count == performers.num_rows
+    performers = performers.drop_columns(["externalUrl", "creatorUri"])
+
+    return {"writers": writers, "producers": producers, "performers": performers}
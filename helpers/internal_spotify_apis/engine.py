@@ -0,0 +1,297 @@
+"""
+Async request engine for the internal Spotify APIs.
+
+Instead of sending requests in fixed-size chunks (and waiting for the slowest request of every chunk), a pool of workers
+keeps requests continuously in flight:
+- the number of requests in flight is limited by an adaptive concurrency controller (AIMD: the limit grows slowly
+  while requests succeed and is halved when the API starts throttling, i.e. responds with 429)
+- requests are paced by a token bucket that is shared by all workers (so that bursts are avoided)
+- track IDs for which a request should be retried (401 or 429, or a transport error such as a connection reset or a
+  timeout) are put back into the queue after a random delay (exponential backoff with jitter) - without blocking any
+  worker in the meantime
+- the status code of every request is reported to the `HeadersLease` (or `HeadersPool`) providing the request headers,
+  which refreshes them in the background if they are unauthorized (401) or quarantines throttled sessions (429)
+- the status code and latency of every request are reported to a `RequestTelemetry` (if provided, see
+  `helpers.internal_spotify_apis.telemetry`), together with the concurrency and the age of the request headers
+"""
+
+import asyncio
+import random
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Collection, Dict, Optional, Tuple, Type, Union
+from tqdm import tqdm
+from .headers import (
+    HeadersLease,
+    HeadersPool,
+    THROTTLED_STATUS_CODE,
+    UNAUTHORIZED_STATUS_CODE,
+)
+from .telemetry import RequestTelemetry
+
+DEFAULT_RETRY_STATUS_CODES = frozenset(
+    [UNAUTHORIZED_STATUS_CODE, THROTTLED_STATUS_CODE]
+)
+# exceptions of `make_request` that count as failed attempts (e.g. connection errors and timeouts)
+DEFAULT_RETRY_EXCEPTIONS = (OSError, asyncio.TimeoutError)
+
+
+class TokenBucket:
+    """
+    Limits the rate of requests to `rate` requests per second on average, allowing bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate / 10)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Waits until a token is available and takes it.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._last_refill) * self.rate
+                )
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AIMDConcurrencyController:
+    """
+    Adaptive limit for the number of requests in flight (additive increase, multiplicative decrease).
+
+    Every successful response increases the limit by 1/limit (i.e. by roughly 1 per "window" of requests),
+    every throttled response multiplies it with `decrease_factor`. As all requests that are in flight when the API starts
+    throttling are likely to be throttled as well, only throttled requests that were sent after the last decrease
+    decrease the limit again (i.e. the limit is decreased at most once per "round trip").
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int = 1,
+        max_limit: int = None,
+        decrease_factor: float = 0.5,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit if max_limit is not None else initial_limit
+        self.decrease_factor = decrease_factor
+        self._limit = float(max(min_limit, min(initial_limit, self.max_limit)))
+        self._in_flight = 0
+        self._last_decrease = float("-inf")
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self):
+        """
+        Waits until the number of requests in flight is below the current limit and reserves a slot.
+
+        Returns:
+            The time the slot was acquired at (has to be passed to `release`).
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+            return time.monotonic()
+
+    async def release(self, acquired_at: float, throttled: bool = False):
+        """
+        Releases a slot and adapts the limit depending on whether the request was throttled.
+        """
+        async with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                if acquired_at >= self._last_decrease:
+                    self._limit = max(
+                        self.min_limit, self._limit * self.decrease_factor
+                    )
+                    self._last_decrease = time.monotonic()
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+
+async def run_requests(
+    track_ids: Collection[str],
+    make_request: Callable[[str, Optional[dict]], Awaitable[dict]],
+    on_response: Callable[[dict], None],
+    max_concurrency: int,
+    requests_per_second: float = None,
+    headers_source: Optional[Union[HeadersLease, HeadersPool]] = None,
+    retry_status_codes: Collection[int] = DEFAULT_RETRY_STATUS_CODES,
+    retry_exceptions: Tuple[Type[BaseException], ...] = DEFAULT_RETRY_EXCEPTIONS,
+    max_attempts: int = 10,
+    base_backoff: float = 1.0,
+    max_backoff: float = 60.0,
+    show_progress: bool = True,
+    description: str = None,
+    telemetry: RequestTelemetry = None,
+) -> Dict[int, int]:
+    """
+    Requests data for all track IDs, keeping up to `max_concurrency` requests in flight.
+
+    Args:
+        track_ids: The track IDs to request data for, in the order of their priority (requests are started in the given order, and retries keep the priority of their track ID, so they are sent before track IDs that come later).
+        make_request: Async function sending the request for a single track ID with the given headers and returning a dictionary with (at least) a 'status_code' field (e.g. as created by `create_response_dict` in `get.py`).
+        on_response: Called with every response dictionary (including those of requests that are retried).
+        max_concurrency: The maximum number of requests in flight. The actual number is adapted depending on the 429 responses.
+        requests_per_second: If provided, requests are paced to this rate (on average).
+        headers_source: Provides the headers for every request and is notified about the status code of every request (see `helpers.internal_spotify_apis.headers`). If not provided, `make_request` is called with None as headers.
+        retry_status_codes: Status codes for which the request is retried.
+        retry_exceptions: Exceptions raised by `make_request` (e.g. `aiohttp.ClientError`) for which the request is retried, like a request with a retry status code. Other exceptions abort all requests.
+        max_attempts: The maximum number of requests per track ID. If the last attempt still fails, the track ID is given up on.
+        base_backoff: The maximum delay (in seconds) before the first retry of a track ID. The maximum delay doubles with every attempt (up to `max_backoff`), the actual delay is chosen randomly ("full jitter").
+        max_backoff: The maximum delay (in seconds) before any retry.
+        show_progress: Whether to show a progress bar.
+        description: Description of the progress bar (e.g. the endpoint name, if requests to several endpoints are run at the same time).
+        telemetry: If provided, the status code and latency of every request are recorded in it.
+
+    Returns:
+        The number of responses per status code.
+    """
+    # (position, track ID) tuples, so that retries are sent as soon as possible, before track IDs with a lower priority
+    queue = asyncio.PriorityQueue()
+    for position, track_id in enumerate(track_ids):
+        queue.put_nowait((position, track_id))
+
+    loop = asyncio.get_running_loop()
+    controller = AIMDConcurrencyController(initial_limit=max_concurrency)
+    bucket = TokenBucket(rate=requests_per_second) if requests_per_second else None
+    status_code_counts = defaultdict(int)
+    attempts = defaultdict(int)
+    given_up_count = 0
+    transport_error_count = 0
+    remaining_count = len(track_ids)
+    all_done = asyncio.Event()
+    if telemetry is not None:
+        telemetry.set_gauge("concurrency_limit", lambda: controller.limit)
+        telemetry.set_gauge("in_flight", lambda: controller.in_flight)
+        if headers_source is not None:
+            telemetry.set_gauge("headers_age", lambda: headers_source.age)
+    pbar = tqdm(total=len(track_ids), disable=not show_progress, desc=description)
+
+    def mark_done():
+        nonlocal remaining_count
+        remaining_count -= 1
+        pbar.update(1)
+        pbar.set_postfix(
+            concurrency=controller.limit,
+            **_format_counts(status_code_counts),
+            **({"errors": transport_error_count} if transport_error_count else {}),
+        )
+        if remaining_count == 0:
+            all_done.set()
+
+    async def worker():
+        nonlocal given_up_count, transport_error_count
+        while True:
+            position, track_id = await queue.get()
+            acquired_at = await controller.acquire()
+            throttled = False
+            has_headers_ticket = False
+            result = None
+            try:
+                if bucket is not None:
+                    await bucket.acquire()
+                if headers_source is not None:
+                    headers, headers_ticket = await headers_source.acquire()
+                    has_headers_ticket = True
+                else:
+                    headers = None
+                attempts[track_id] += 1
+                sent_at = time.monotonic()
+                try:
+                    result = await make_request(track_id, headers)
+                except retry_exceptions:
+                    # no response at all, counts as a failed attempt
+                    transport_error_count += 1
+                else:
+                    if telemetry is not None:
+                        telemetry.record(
+                            result["status_code"], time.monotonic() - sent_at
+                        )
+                    throttled = result["status_code"] == THROTTLED_STATUS_CODE
+            finally:
+                await controller.release(acquired_at, throttled=throttled)
+                if has_headers_ticket:
+                    headers_source.release(
+                        headers_ticket,
+                        None if result is None else result["status_code"],
+                    )
+
+            if result is not None:
+                status_code_counts[result["status_code"]] += 1
+                on_response(result)
+
+            if result is not None and result["status_code"] not in retry_status_codes:
+                mark_done()
+            elif attempts[track_id] >= max_attempts:
+                given_up_count += 1
+                mark_done()
+            else:
+                # the retry is scheduled without blocking the worker, so other requests can be sent in the meantime
+                delay = _get_backoff_delay(
+                    attempt=attempts[track_id],
+                    base_backoff=base_backoff,
+                    max_backoff=max_backoff,
+                )
+                loop.call_later(delay, queue.put_nowait, (position, track_id))
+
+    if remaining_count == 0:
+        all_done.set()
+    workers = [asyncio.create_task(worker()) for _ in range(max_concurrency)]
+    all_done_task = asyncio.create_task(all_done.wait())
+    try:
+        await asyncio.wait(
+            [all_done_task, *workers], return_when=asyncio.FIRST_COMPLETED
+        )
+        for w in workers:
+            if w.done() and w.exception() is not None:
+                raise w.exception()
+    finally:
+        all_done_task.cancel()
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(all_done_task, *workers, return_exceptions=True)
+        pbar.close()
+
+    if transport_error_count > 0:
+        print(
+            f"{transport_error_count} requests failed without a response (e.g. connection errors or timeouts)"
+        )
+    if given_up_count > 0:
+        print(
+            f"Gave up on {given_up_count} track IDs after {max_attempts} unsuccessful attempts"
+        )
+    return dict(status_code_counts)
+
+
+def _get_backoff_delay(attempt: int, base_backoff: float, max_backoff: float):
+    """
+    Exponential backoff with "full jitter": a random delay between 0 and base_backoff * 2^(attempt - 1) (capped at max_backoff).
+    """
+    return random.uniform(0, min(max_backoff, base_backoff * 2 ** (attempt - 1)))
+
+
+def _format_counts(status_code_counts: Dict[int, int]):
+    return {
+        str(status_code): count for status_code, count in status_code_counts.items()
+    }
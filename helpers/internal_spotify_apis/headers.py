@@ -0,0 +1,288 @@
+"""
+Request headers for the internal Spotify APIs, treated as a leased credential.
+
+Getting new headers is expensive (a browser has to open a track page, trigger a request to the internal API and
+extract its headers from the performance log), so it should neither block the requests that are in flight nor
+happen more often than necessary. A `HeadersLease`
+- refreshes the headers in the background (in a separate thread) before they expire,
+- swaps in the new headers atomically (every request uses a consistent set of headers),
+- refreshes the headers early if a request with the current headers was unauthorized (401), coalescing concurrent
+  refreshes into one and holding back new requests until the new headers are available.
+
+A `HeadersPool` spreads requests over the headers of several leases (e.g. from browser sessions of different accounts),
+so the throughput is not capped by the rate limit of a single account. Sessions that are throttled (429) are quarantined
+for a while (with exponentially increasing durations if they keep getting throttled).
+
+The access tokens in the headers are opaque (their expiry can't be read from them), so the lifetime of the headers
+is observed instead: it is assumed to be `lifetime` seconds initially (access tokens of the Spotify web player are
+valid for an hour), and shortened whenever headers turn out to be invalid earlier than that.
+"""
+
+import asyncio
+import time
+from typing import Callable, List
+
+UNAUTHORIZED_STATUS_CODE = 401
+THROTTLED_STATUS_CODE = 429
+
+
+class HeadersLease:
+    """
+    Holds the current request headers and refreshes them before they expire.
+
+    Usage:
+    ```
+    async with HeadersLease(get_headers=headers_getter.get_headers) as lease:
+        headers, generation = await lease.acquire()
+        # ... send request with headers
+        lease.release(generation, status_code)
+    ```
+    """
+
+    def __init__(
+        self,
+        get_headers: Callable[[], dict],
+        initial_headers: dict = None,
+        lifetime: float = 3600,
+        refresh_at: float = 0.8,
+        min_lifetime: float = 60,
+    ):
+        """
+        Args:
+            get_headers: Function returning new headers (blocking, is called in a separate thread).
+            initial_headers: Headers to start with (if not provided, they are fetched with `get_headers` when the lease is started).
+            lifetime: The assumed lifetime of headers (in seconds) until shorter lifetimes are observed.
+            refresh_at: The fraction of the lifetime after which the headers are refreshed in the background.
+            min_lifetime: Lower bound for observed lifetimes (401 responses shortly after a refresh are unlikely to be caused by expired headers).
+        """
+        self.get_headers = get_headers
+        self.lifetime = lifetime
+        self.refresh_at = refresh_at
+        self.min_lifetime = min_lifetime
+        self._headers = initial_headers
+        self._generation = 0
+        self._refreshed_at = time.monotonic()
+        self._valid = None
+        self._refresh_task = None
+        self._background_task = None
+
+    @property
+    def headers(self) -> dict:
+        return self._headers
+
+    @property
+    def generation(self) -> int:
+        """
+        Incremented with every refresh, used for detecting whether a 401 response was caused by the current headers.
+        """
+        return self._generation
+
+    @property
+    def is_valid(self) -> bool:
+        """
+        False while the headers are being refreshed because they were invalidated.
+        """
+        return self._valid is not None and self._valid.is_set()
+
+    @property
+    def age(self) -> float:
+        """
+        Seconds since the current headers were obtained.
+        """
+        return time.monotonic() - self._refreshed_at
+
+    async def start(self):
+        self._valid = asyncio.Event()
+        if self._headers is None:
+            await self._refresh()
+        self._valid.set()
+        self._background_task = asyncio.create_task(self._refresh_before_expiry())
+
+    async def close(self):
+        for task in [self._background_task, self._refresh_task]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(
+            *[t for t in [self._background_task, self._refresh_task] if t is not None],
+            return_exceptions=True,
+        )
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def acquire(self):
+        """
+        Returns the current headers together with their generation.
+        If the current headers are known to be invalid, waits until new headers are available.
+        """
+        await self._valid.wait()
+        return self._headers, self._generation
+
+    def release(self, generation: int, status_code: int):
+        """
+        Reports the status code of a request that was sent with the headers of the given generation.
+        """
+        if status_code == UNAUTHORIZED_STATUS_CODE:
+            self.invalidate(generation)
+
+    def invalidate(self, generation: int):
+        """
+        Reports that a request with the headers of the given generation was unauthorized (401).
+
+        If these are still the current headers, they are refreshed right away (once, no matter how many requests report them as invalid)
+        and the observed lifetime is taken into account for future refreshes.
+        """
+        if generation != self._generation or not self._valid.is_set():
+            # already refreshed (or refreshing) since the request was sent
+            return
+        observed_lifetime = self.age
+        if observed_lifetime < self.lifetime:
+            self.lifetime = max(self.min_lifetime, observed_lifetime)
+            print(
+                f"Request headers expired after {observed_lifetime:.0f} seconds, will refresh them after {self.lifetime * self.refresh_at:.0f} seconds from now on"
+            )
+        self._valid.clear()
+        self._refresh_in_background()
+
+    def _refresh_in_background(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+
+    async def _refresh(self):
+        try:
+            headers = await asyncio.to_thread(self.get_headers)
+        except Exception as e:
+            print(f"Error refreshing request headers: {e}")
+            # keep the old headers, they will be invalidated again if they don't work anymore
+            self._refreshed_at = time.monotonic()
+            if self._valid is not None:
+                self._valid.set()
+            return
+        # swap both at once, so requests never see new headers with an old generation (or vice versa)
+        self._headers, self._generation = headers, self._generation + 1
+        self._refreshed_at = time.monotonic()
+        if self._valid is not None:
+            self._valid.set()
+
+    async def _refresh_before_expiry(self):
+        while True:
+            refresh_in = self.lifetime * self.refresh_at - self.age
+            if refresh_in > 0:
+                await asyncio.sleep(refresh_in)
+                continue  # the headers may have been refreshed (or the lifetime changed) in the meantime
+            self._refresh_in_background()
+            await self._refresh_task
+
+
+class HeadersPool:
+    """
+    Load-balances requests over several `HeadersLease`s.
+
+    Every request gets the headers of the lease with the fewest requests in flight (ties are broken round-robin),
+    skipping leases that are quarantined because they were throttled recently (if there is more than one lease - a single
+    lease is never quarantined, throttling is then only handled by the request engine). Has the same interface as `HeadersLease`
+    (`acquire`/`release`), so it can be used in its place.
+    """
+
+    def __init__(
+        self,
+        leases: List[HeadersLease],
+        base_quarantine: float = 5.0,
+        max_quarantine: float = 300.0,
+    ):
+        """
+        Args:
+            leases: The leases to spread requests over.
+            base_quarantine: How long (in seconds) a lease is quarantined after its first throttled request.
+            max_quarantine: Maximum quarantine duration (it doubles every time a lease is throttled again right after a quarantine).
+        """
+        if len(leases) == 0:
+            raise ValueError("A headers pool needs at least one lease")
+        self.leases = leases
+        self.base_quarantine = base_quarantine
+        self.max_quarantine = max_quarantine
+        self._in_flight = [0] * len(leases)
+        self._quarantined_until = [float("-inf")] * len(leases)
+        self._quarantine_count = [0] * len(leases)
+        self._next = 0
+
+    async def start(self):
+        await asyncio.gather(*[lease.start() for lease in self.leases])
+
+    async def close(self):
+        await asyncio.gather(*[lease.close() for lease in self.leases])
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def age(self) -> float:
+        """
+        Seconds since the oldest headers in the pool were obtained.
+        """
+        return max(lease.age for lease in self.leases)
+
+    def is_quarantined(self, index: int) -> bool:
+        return self._quarantined_until[index] > time.monotonic()
+
+    async def acquire(self):
+        """
+        Returns the headers of the least loaded available lease, together with a ticket that has to be passed to `release`.
+        Waits if all leases are quarantined.
+        """
+        while True:
+            available = [
+                i for i in range(len(self.leases)) if not self.is_quarantined(i)
+            ]
+            if len(available) > 0:
+                break
+            await asyncio.sleep(min(self._quarantined_until) - time.monotonic())
+
+        # prefer leases whose headers are not being refreshed right now
+        valid = [i for i in available if self.leases[i].is_valid] or available
+        # round-robin among the least loaded leases
+        min_in_flight = min(self._in_flight[i] for i in valid)
+        candidates = [i for i in valid if self._in_flight[i] == min_in_flight]
+        index = min(candidates, key=lambda i: (i - self._next) % len(self.leases))
+        self._next = (index + 1) % len(self.leases)
+
+        self._in_flight[index] += 1
+        try:
+            headers, generation = await self.leases[index].acquire()
+        except BaseException:
+            self._in_flight[index] -= 1
+            raise
+        return headers, (index, generation, time.monotonic())
+
+    def release(self, ticket: tuple, status_code: int):
+        """
+        Reports the status code of a request that was sent with the headers returned by `acquire` together with the given ticket.
+        """
+        index, generation, acquired_at = ticket
+        self._in_flight[index] -= 1
+        self.leases[index].release(generation, status_code)
+        if status_code == THROTTLED_STATUS_CODE and len(self.leases) > 1:
+            # requests sent before the last quarantine ended were probably throttled for the same reason
+            if acquired_at >= self._quarantined_until[index]:
+                self._quarantine(index)
+        elif acquired_at >= self._quarantined_until[index]:
+            self._quarantine_count[index] = 0
+
+    def _quarantine(self, index: int):
+        self._quarantine_count[index] += 1
+        duration = min(
+            self.max_quarantine,
+            self.base_quarantine * 2 ** (self._quarantine_count[index] - 1),
+        )
+        self._quarantined_until[index] = time.monotonic() + duration
+        print(
+            f"Headers {index + 1}/{len(self.leases)} were throttled, not using them for {duration:.0f} seconds"
+        )
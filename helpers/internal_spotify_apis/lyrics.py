@@ -0,0 +1,270 @@
+"""
+Processing of the responses of the internal Spotify lyrics API.
+
+`process_lyrics_file` converts a file of lyrics responses (as written by `cli_scripts/internal_spotify_apis/get.py`)
+into two Parquet tables, so that analyses never have to parse the nested JSON responses again:
+- lyrics.parquet: one row per track with the track_id, sync_type ('LINE_SYNCED' or 'UNSYNCED'), language, provider,
+  provider_lyrics_id, is_rtl_language, is_dense_typeface and line_count columns
+- lyrics_lines.parquet: one row per line of the lyrics with the track_id, line_number (starting at 1), start_time_ms
+  (null if the lyrics are not synced) and words columns
+
+Columns with few distinct values (sync_type, language, provider, and the track_id of the lines) are dictionary-encoded,
+i.e. read as categoricals by pandas. Fields that always have the same value (see notebooks/analysis/lyrics.ipynb) are
+skipped, as are the colors.
+
+The responses file is split into chunks (aligned to the blocks of its index, or the part files of a directory of Parquet
+files) that are processed in parallel, every chunk is streamed in batches and only the relevant fields are parsed (with
+`pyarrow.json` and an explicit schema). Every chunk is written to a part file of both tables.
+"""
+
+import multiprocessing
+import os
+import shutil
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .storage import parse_json_lines
+
+UNSYNCED_SYNC_TYPE = "UNSYNCED"
+LYRICS_TABLE_NAMES = ["lyrics", "lyrics_lines"]
+
+# schema of the relevant part of the lyrics API responses (fields that are not in the schema are skipped when parsing)
+LYRICS_LINE_TYPE = pa.struct([("startTimeMs", pa.string()), ("words", pa.string())])
+LYRICS_TYPE = pa.struct(
+    [
+        ("syncType", pa.string()),
+        ("lines", pa.list_(LYRICS_LINE_TYPE)),
+        ("provider", pa.string()),
+        ("providerLyricsId", pa.string()),
+        ("language", pa.string()),
+        ("isRtlLanguage", pa.bool_()),
+        ("isDenseTypeface", pa.bool_()),
+    ]
+)
+LYRICS_CONTENT_TYPE = pa.struct([("lyrics", LYRICS_TYPE)])
+LYRICS_RESPONSE_SCHEMA = pa.schema(
+    [
+        ("track_id", pa.string()),
+        ("status_code", pa.int64()),
+        ("content", LYRICS_CONTENT_TYPE),
+    ]
+)
+
+# schemas of the output tables
+DICTIONARY_STRING_TYPE = pa.dictionary(pa.int32(), pa.string())
+LYRICS_SCHEMA = pa.schema(
+    [
+        ("track_id", pa.string()),
+        ("sync_type", DICTIONARY_STRING_TYPE),
+        ("language", DICTIONARY_STRING_TYPE),
+        ("provider", DICTIONARY_STRING_TYPE),
+        ("provider_lyrics_id", pa.string()),
+        ("is_rtl_language", pa.bool_()),
+        ("is_dense_typeface", pa.bool_()),
+        ("line_count", pa.int32()),
+    ]
+)
+LYRICS_LINES_SCHEMA = pa.schema(
+    [
+        ("track_id", DICTIONARY_STRING_TYPE),
+        ("line_number", pa.int32()),
+        ("start_time_ms", pa.int32()),
+        ("words", pa.string()),
+    ]
+)
+
+
+def process_lyrics_file(
+    input_path: str,
+    output_folder_path: str,
+    batch_size: int = 10000,
+    processes: int = None,
+) -> Dict[str, int]:
+    """
+    Processes the lyrics API responses in a file and writes the lyrics.parquet and lyrics_lines.parquet tables (directories
+    with one part file per chunk) to the output folder, replacing existing ones.
+
+    Args:
+        input_path: Path to a (optionally zstd-compressed) JSONL file with the responses, or to a directory of Parquet files (see `helpers.internal_spotify_apis.parquet_storage`).
+        output_folder_path: Path to the directory where the Parquet tables are written to.
+        batch_size: Number of responses that are processed at once (per process).
+        processes: Number of processes (the number of CPUs if not provided). With a single process, no worker processes are started.
+
+    Returns:
+        The number of rows in every output table.
+    """
+    from .storage import get_chunk_offsets, get_storage
+
+    processes = processes or multiprocessing.cpu_count()
+    if get_storage(input_path) == "parquet":
+        from .parquet_storage import get_part_file_paths
+
+        chunks = [(path, None, None) for path in get_part_file_paths(input_path)]
+    else:
+        # more chunks than processes, so that processes that finish early can take over work
+        chunks = [
+            (input_path, start_offset, end_offset)
+            for start_offset, end_offset in get_chunk_offsets(input_path, processes * 4)
+        ]
+
+    os.makedirs(output_folder_path, exist_ok=True)
+    for name in LYRICS_TABLE_NAMES:
+        table_path = os.path.join(output_folder_path, f"{name}.parquet")
+        if os.path.exists(table_path):
+            shutil.rmtree(table_path)
+        os.makedirs(table_path)
+    tasks = [
+        (chunk, output_folder_path, f"part-{i:05d}.parquet", batch_size)
+        for i, chunk in enumerate(chunks)
+    ]
+    if len(tasks) == 0:
+        # no responses, still write empty tables
+        tasks = [((None, None, None), output_folder_path, "part-00000.parquet", 0)]
+
+    if processes == 1 or len(tasks) == 1:
+        return _sum_row_counts(map(_process_lyrics_chunk, tasks))
+    # Arrow's thread pools don't survive forking, so the worker processes are spawned
+    with multiprocessing.get_context("spawn").Pool(min(processes, len(tasks))) as pool:
+        return _sum_row_counts(pool.imap_unordered(_process_lyrics_chunk, tasks))
+
+
+def flatten_lyrics(track_ids: pa.Array, lyrics: pa.Array) -> Tuple[pa.Table, pa.Table]:
+    """
+    Converts the lyrics of tracks to the rows of the lyrics and lyrics_lines tables.
+
+    Args:
+        track_ids: The track IDs.
+        lyrics: The lyrics of every track (struct with the fields of `LYRICS_TYPE`), e.g. parsed with `pyarrow.json`.
+
+    Returns:
+        The lyrics table (one row per track, with `LYRICS_SCHEMA`) and the lyrics_lines table (one row per line, with `LYRICS_LINES_SCHEMA`).
+    """
+    if isinstance(track_ids, pa.ChunkedArray):
+        track_ids = track_ids.combine_chunks()
+    if isinstance(lyrics, pa.ChunkedArray):
+        lyrics = lyrics.combine_chunks()
+    sync_types = pc.struct_field(lyrics, "syncType")
+    lines = pc.struct_field(lyrics, "lines")
+    line_counts = pc.fill_null(pc.list_value_length(lines), 0)
+
+    flat_lines = pc.list_flatten(lines)
+    line_track_indices = pc.list_parent_indices(lines)
+    # number of every line within its track, derived from the list offsets
+    counts = line_counts.to_numpy()
+    track_starts = np.cumsum(counts) - counts
+    line_numbers = (
+        np.arange(len(flat_lines)) - track_starts[line_track_indices.to_numpy()] + 1
+    )
+    is_synced = pc.fill_null(
+        pc.not_equal(sync_types.take(line_track_indices), UNSYNCED_SYNC_TYPE), False
+    )
+    start_times = pc.if_else(
+        is_synced,
+        pc.cast(pc.struct_field(flat_lines, "startTimeMs"), pa.int32()),
+        pa.scalar(None, pa.int32()),
+    )
+
+    lyrics_table = pa.table(
+        {
+            "track_id": track_ids,
+            "sync_type": pc.dictionary_encode(sync_types),
+            "language": pc.dictionary_encode(pc.struct_field(lyrics, "language")),
+            "provider": pc.dictionary_encode(pc.struct_field(lyrics, "provider")),
+            "provider_lyrics_id": pc.struct_field(lyrics, "providerLyricsId"),
+            "is_rtl_language": pc.struct_field(lyrics, "isRtlLanguage"),
+            "is_dense_typeface": pc.struct_field(lyrics, "isDenseTypeface"),
+            "line_count": pc.cast(line_counts, pa.int32()),
+        },
+        schema=LYRICS_SCHEMA,
+    )
+    lines_table = pa.table(
+        {
+            "track_id": pc.dictionary_encode(track_ids.take(line_track_indices)),
+            "line_number": pa.array(line_numbers, pa.int32()),
+            "start_time_ms": start_times,
+            "words": pc.struct_field(flat_lines, "words"),
+        },
+        schema=LYRICS_LINES_SCHEMA,
+    )
+    return lyrics_table, lines_table
+
+
+def iter_lyrics(
+    path: str, batch_size: int, start_offset: int = None, end_offset: int = None
+) -> Iterator[Tuple[pa.Array, pa.Array]]:
+    """
+    Yields the track IDs and lyrics of the successful responses in (a byte range of) a JSONL file, or in a Parquet part
+    file, in batches of up to `batch_size` responses. Only the fields in `LYRICS_TYPE` are parsed.
+    """
+    from .storage import get_storage, read_line_batches
+
+    if get_storage(path) == "parquet":
+        from .parquet_storage import iter_parsed_contents
+
+        for track_ids, content in iter_parsed_contents(
+            [path], pa.schema(LYRICS_CONTENT_TYPE), batch_size
+        ):
+            yield _get_valid_lyrics(track_ids, content.column("lyrics"))
+        return
+
+    for lines in read_line_batches(path, batch_size, start_offset or 0, end_offset):
+        responses = parse_json_lines(lines, LYRICS_RESPONSE_SCHEMA)
+        responses = responses.filter(pc.equal(responses.column("status_code"), 200))
+        yield _get_valid_lyrics(
+            responses.column("track_id"),
+            pc.struct_field(responses.column("content"), "lyrics"),
+        )
+
+
+def _get_valid_lyrics(track_ids: pa.Array, lyrics: pa.Array):
+    is_valid = pc.is_valid(lyrics)
+    return track_ids.filter(is_valid), lyrics.filter(is_valid)
+
+
+def _process_lyrics_chunk(task) -> Dict[str, int]:
+    (path, start_offset, end_offset), output_folder_path, part_file_name, batch_size = (
+        task
+    )
+    writers = {
+        name: pq.ParquetWriter(
+            os.path.join(
+                output_folder_path, f"{name}.parquet", part_file_name + ".tmp"
+            ),
+            schema,
+        )
+        for name, schema in zip(
+            LYRICS_TABLE_NAMES, [LYRICS_SCHEMA, LYRICS_LINES_SCHEMA]
+        )
+    }
+    row_counts = {name: 0 for name in LYRICS_TABLE_NAMES}
+    try:
+        batches = (
+            iter_lyrics(path, batch_size, start_offset, end_offset)
+            if path is not None
+            else []
+        )
+        for track_ids, lyrics in batches:
+            for name, table in zip(
+                LYRICS_TABLE_NAMES, flatten_lyrics(track_ids, lyrics)
+            ):
+                writers[name].write_table(table)
+                row_counts[name] += table.num_rows
+    finally:
+        for writer in writers.values():
+            writer.close()
+    for name in LYRICS_TABLE_NAMES:
+        part_path = os.path.join(output_folder_path, f"{name}.parquet", part_file_name)
+        os.replace(part_path + ".tmp", part_path)
+    return row_counts
+
+
+def _sum_row_counts(chunk_row_counts: Iterator[Dict[str, int]]) -> Dict[str, int]:
+    row_counts = {name: 0 for name in LYRICS_TABLE_NAMES}
+    for counts in chunk_row_counts:
+        for name, count in counts.items():
+            row_counts[name] += count
+    return row_counts
@@ -0,0 +1,230 @@
+"""
+Columnar (Parquet) storage for the responses of the internal Spotify APIs, an alternative to the JSONL files of
+`helpers.internal_spotify_apis.storage`.
+
+Responses are stored in a directory of Parquet files (one "part" file per batch of responses) with typed columns:
+- track_id: string
+- status_code: int32
+- timestamp: timestamp (UTC, microseconds)
+- url: string
+- content_type: string ('json' or 'text')
+- content: string (the JSON-serialized response content, or the response text if it is not JSON)
+
+The rows of every part file are sorted by track ID, so the min/max statistics of the row groups can be used for
+skipping data when filtering by track ID (predicate pushdown, see `read_parquet_responses`). Only the columns that are
+needed are read, e.g. resuming only reads the track_id and status_code columns.
+
+Part files are written to a temporary file first and then renamed, so a process that is killed while writing never
+leaves an incomplete part file behind (only the responses of the current batch are lost and fetched again).
+"""
+
+import json
+import os
+import time
+from typing import Iterable, Iterator, List, Tuple
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+RESPONSE_SCHEMA = pa.schema(
+    [
+        ("track_id", pa.string()),
+        ("status_code", pa.int32()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("url", pa.string()),
+        ("content_type", pa.string()),
+        ("content", pa.string()),
+    ]
+)
+PART_FILE_NAME_FORMAT = "part-{:05d}.parquet"
+
+
+class ParquetResponseWriter:
+    """
+    Writes responses to a directory of Parquet files in batches. Has the same interface as `storage.ResponseWriter`.
+    Can be used as a context manager.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_every: int = 10000,
+        flush_interval: float = 60.0,
+        compression: str = "zstd",
+    ):
+        """
+        Args:
+            path: Path to the directory containing the part files (created if it doesn't exist, new part files are added to existing ones).
+            flush_every: Number of responses after which a part file is written.
+            flush_interval: Maximum number of seconds responses are kept in memory (checked when writing or flushing).
+            compression: The compression codec of the Parquet files.
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.compression = compression
+        os.makedirs(path, exist_ok=True)
+        for file_name in os.listdir(path):
+            if file_name.endswith(".tmp"):
+                # left behind by a process that was killed while writing
+                os.remove(os.path.join(path, file_name))
+        self._part_number = len(get_part_file_paths(path))
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def write(self, record: dict):
+        """
+        Writes a response (a dictionary as returned by `create_response_dict` in cli_scripts/internal_spotify_apis/get.py).
+        """
+        self._buffer.append(record)
+        if len(self._buffer) >= self.flush_every:
+            self.flush(force=True)
+        else:
+            self.flush()
+
+    def flush(self, force: bool = False):
+        """
+        Writes the buffered responses to a new part file if `flush_interval` seconds have passed since the last one was written (or if `force` is True).
+        Flushing less often than the JSONL writer avoids creating many tiny part files.
+        """
+        if not force and time.monotonic() - self._last_flush < self.flush_interval:
+            return
+        if len(self._buffer) > 0:
+            table = create_response_table(self._buffer).sort_by("track_id")
+            part_path = os.path.join(
+                self.path, PART_FILE_NAME_FORMAT.format(self._part_number)
+            )
+            pq.write_table(table, part_path + ".tmp", compression=self.compression)
+            os.replace(part_path + ".tmp", part_path)
+            self._part_number += 1
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def checkpoint(self):
+        self.flush(force=True)
+
+    def close(self):
+        self.checkpoint()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def create_response_table(records: Iterable[dict]) -> pa.Table:
+    """
+    Converts response dictionaries to a table with the schema of the Parquet files (`RESPONSE_SCHEMA`).
+    """
+    columns = {name: [] for name in RESPONSE_SCHEMA.names}
+    for record in records:
+        for name in ["track_id", "status_code", "timestamp", "url", "content_type"]:
+            columns[name].append(record[name])
+        content = record["content"]
+        columns["content"].append(
+            content
+            if record["content_type"] == "text" and isinstance(content, str)
+            else json.dumps(content)
+        )
+    # the timestamps are ISO strings ending with 'Z' (UTC), which Arrow can parse directly
+    columns["timestamp"] = pa.array(columns["timestamp"], pa.string()).cast(
+        RESPONSE_SCHEMA.field("timestamp").type
+    )
+    return pa.table(columns, schema=RESPONSE_SCHEMA)
+
+
+def get_part_file_paths(path: str) -> List[str]:
+    """
+    Returns the paths of the part files in a responses directory (in the order they were written).
+    """
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        os.path.join(path, file_name)
+        for file_name in os.listdir(path)
+        if file_name.startswith("part-") and file_name.endswith(".parquet")
+    )
+
+
+def read_parquet_responses(
+    path: str,
+    columns: List[str] = None,
+    track_ids: Iterable[str] = None,
+    status_codes: Iterable[int] = None,
+) -> pa.Table:
+    """
+    Reads responses from a directory of Parquet files.
+
+    Args:
+        path: Path to the directory containing the part files.
+        columns: The columns to read (all columns if not provided).
+        track_ids: If provided, only responses for these track IDs are read.
+        status_codes: If provided, only responses with these status codes are read.
+
+    Returns:
+        A pyarrow Table (use `.to_pandas()` to get a DataFrame). The content column contains JSON strings (see `content_type`).
+    """
+    part_file_paths = get_part_file_paths(path)
+    if len(part_file_paths) == 0:
+        return RESPONSE_SCHEMA.empty_table().select(columns or RESPONSE_SCHEMA.names)
+    dataset = ds.dataset(part_file_paths, schema=RESPONSE_SCHEMA, format="parquet")
+    filters = []
+    if track_ids is not None:
+        filters.append(ds.field("track_id").isin(list(track_ids)))
+    if status_codes is not None:
+        filters.append(ds.field("status_code").isin(list(status_codes)))
+    expression = None
+    for f in filters:
+        expression = f if expression is None else expression & f
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+def iter_parsed_contents(
+    part_file_paths: List[str], content_schema: pa.Schema, batch_size: int
+) -> Iterator[Tuple[pa.Array, pa.Table]]:
+    """
+    Yields the track IDs and the parsed contents of the successful responses (status code 200) in Parquet part files, in
+    batches of up to `batch_size` responses. Only the fields in `content_schema` are parsed from the JSON strings in the
+    content column (with `helpers.internal_spotify_apis.storage.parse_json_lines`).
+    """
+    from .storage import parse_json_lines
+
+    if len(part_file_paths) == 0:
+        return
+    dataset = ds.dataset(part_file_paths, schema=RESPONSE_SCHEMA, format="parquet")
+    for batch in dataset.to_batches(
+        columns=["track_id", "content"],
+        filter=ds.field("status_code") == 200,
+        batch_size=batch_size,
+    ):
+        if batch.num_rows == 0:
+            continue
+        content = parse_json_lines(
+            "\n".join(batch.column("content").to_pylist()).encode("utf-8") + b"\n",
+            content_schema,
+        )
+        yield batch.column("track_id"), content
+
+
+def convert_jsonl_to_parquet(
+    jsonl_path: str, parquet_path: str, batch_size: int = 100000
+) -> int:
+    """
+    Converts a (optionally zstd-compressed) JSONL responses file to a directory of Parquet files.
+    The JSONL file is read line by line, so at most `batch_size` responses are held in memory.
+
+    Returns:
+        The number of converted responses.
+    """
+    from .storage import read_responses
+
+    count = 0
+    with ParquetResponseWriter(
+        parquet_path, flush_every=batch_size, flush_interval=float("inf")
+    ) as writer:
+        for record in read_responses(jsonl_path):
+            writer.write(record)
+            count += 1
+    return count
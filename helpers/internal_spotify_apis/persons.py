@@ -0,0 +1,192 @@
+"""
+Dimension table of the persons credited in the responses of the internal Spotify credits API.
+
+The writers, producers and performers tables written by `helpers.internal_spotify_apis.credits.process_credits_file`
+reference credited persons by an integer key instead of repeating their names (and artist IDs) in every row. The persons
+table (persons.parquet) has the columns
+- person_key: int64, assigned in the order in which the persons are first seen
+- name: string, the name of the person when it was first seen
+- normalized_name: string, the name in Unicode normalization form NFKC, lowercased and with collapsed whitespace
+- artist_id: string, the ID of the Spotify artist (null for persons without an artist profile)
+- linked_artist_key: int64, for persons without artist ID the person_key of the artist with the same normalized name
+  (null if there is no or more than one such artist, and for artists)
+
+A person is identified by its artist ID if it has one, credits without an artist ID (e.g. most producers and performers)
+are identified by their normalized name. Name-only credits are never merged into an artist: whether an artist with the
+same name exists depends on which credits have been seen so far, so the links are only resolved when the table is
+written (`to_table`), from all persons known at that point. Keys are assigned in the order in which the persons first
+occur in the credits and persons are only ever added, so the keys (and links) don't depend on how the credits are split
+into batches or runs when they are processed incrementally.
+"""
+
+import os
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+PERSONS_FILE_NAME = "persons.parquet"
+PERSON_SCHEMA = pa.schema(
+    [
+        ("person_key", pa.int64()),
+        ("name", pa.string()),
+        ("normalized_name", pa.string()),
+        ("artist_id", pa.string()),
+        ("linked_artist_key", pa.int64()),
+    ]
+)
+
+
+def normalize_person_names(names: pa.Array) -> pa.Array:
+    """
+    Normalizes names for matching: Unicode normalization form NFKC (e.g. full-width to regular characters), lowercase,
+    whitespace trimmed and collapsed to single spaces.
+    """
+    normalized = pc.utf8_lower(pc.utf8_normalize(names, "NFKC"))
+    normalized = pc.replace_substring_regex(normalized, r"\s+", " ")
+    return pc.utf8_trim_whitespace(normalized)
+
+
+class PersonDimension:
+    """
+    Assigns stable integer keys to credited persons (see the module docstring for how persons are matched).
+    """
+
+    def __init__(self, persons: pa.Table = None):
+        """
+        Args:
+            persons: Existing persons (with `PERSON_SCHEMA`), e.g. read with `load_persons`. Their keys are kept.
+        """
+        self._names = []
+        self._normalized_names = []
+        self._artist_ids = []
+        self._keys_by_artist_id: Dict[str, int] = {}
+        self._keys_by_name: Dict[str, int] = {}  # persons without artist ID
+        if persons is not None:
+            for name, normalized_name, artist_id in zip(
+                persons.column("name").to_pylist(),
+                persons.column("normalized_name").to_pylist(),
+                persons.column("artist_id").to_pylist(),
+            ):
+                self._add(name, normalized_name, artist_id)
+
+    def __len__(self):
+        return len(self._names)
+
+    def get_keys(self, names: pa.Array, artist_ids: pa.Array) -> pa.Array:
+        """
+        Returns the person key of every credited artist, adding persons that were not seen before.
+
+        Args:
+            names: The names of the credited artists.
+            artist_ids: The artist IDs of the credited artists (null if they don't have one).
+
+        Returns:
+            An int64 array with the person keys.
+        """
+        if isinstance(names, pa.ChunkedArray):
+            names = names.combine_chunks()
+        if isinstance(artist_ids, pa.ChunkedArray):
+            artist_ids = artist_ids.combine_chunks()
+        normalized_names = normalize_person_names(names)
+        # a person is identified by its artist ID, or by its normalized name if it doesn't have one
+        identities = pc.if_else(
+            pc.is_valid(artist_ids),
+            pc.binary_join_element_wise("artist:", artist_ids, ""),
+            pc.binary_join_element_wise("name:", normalized_names, ""),
+        )
+
+        # persons are looked up once per distinct identity (in order of appearance, so new persons get their keys in
+        # the order in which they occur), and the keys are mapped back to the rows with `index_in`
+        distinct_identities = pc.unique(identities)
+        first_rows = pc.index_in(distinct_identities, identities)
+        keys = [
+            self._get_key(name, normalized_name, artist_id)
+            for name, normalized_name, artist_id in zip(
+                names.take(first_rows).to_pylist(),
+                normalized_names.take(first_rows).to_pylist(),
+                artist_ids.take(first_rows).to_pylist(),
+            )
+        ]
+        return pa.array(keys, pa.int64()).take(
+            pc.index_in(identities, distinct_identities)
+        )
+
+    def to_table(self) -> pa.Table:
+        """
+        Returns all persons as a table with `PERSON_SCHEMA`.
+        """
+        return pa.table(
+            {
+                "person_key": pa.array(range(len(self)), pa.int64()),
+                "name": pa.array(self._names, pa.string()),
+                "normalized_name": pa.array(self._normalized_names, pa.string()),
+                "artist_id": pa.array(self._artist_ids, pa.string()),
+                "linked_artist_key": pa.array(
+                    self._get_linked_artist_keys(), pa.int64()
+                ),
+            },
+            schema=PERSON_SCHEMA,
+        )
+
+    def _get_key(
+        self, name: str, normalized_name: str, artist_id: Optional[str]
+    ) -> int:
+        if artist_id is None:
+            key = self._keys_by_name.get(normalized_name)
+        else:
+            key = self._keys_by_artist_id.get(artist_id)
+        if key is None:
+            key = self._add(name, normalized_name, artist_id)
+        return key
+
+    def _get_linked_artist_keys(self) -> List[Optional[int]]:
+        # artists by normalized name (None if several artists have the same normalized name)
+        artist_keys_by_name: Dict[str, Optional[int]] = {}
+        for key, (normalized_name, artist_id) in enumerate(
+            zip(self._normalized_names, self._artist_ids)
+        ):
+            if artist_id is not None:
+                artist_keys_by_name[normalized_name] = (
+                    None if normalized_name in artist_keys_by_name else key
+                )
+        return [
+            artist_keys_by_name.get(normalized_name) if artist_id is None else None
+            for normalized_name, artist_id in zip(
+                self._normalized_names, self._artist_ids
+            )
+        ]
+
+    def _add(self, name: str, normalized_name: str, artist_id: Optional[str]) -> int:
+        key = len(self._names)
+        self._names.append(name)
+        self._normalized_names.append(normalized_name)
+        self._artist_ids.append(artist_id)
+        if artist_id is None:
+            self._keys_by_name[normalized_name] = key
+        else:
+            self._keys_by_artist_id[artist_id] = key
+        return key
+
+
+def load_persons(output_folder_path: str) -> PersonDimension:
+    """
+    Loads the persons table from the output folder of `process_credits_file` (an empty dimension if it doesn't exist).
+    """
+    path = os.path.join(output_folder_path, PERSONS_FILE_NAME)
+    if not os.path.exists(path):
+        return PersonDimension()
+    # the links to artists are derived from the other columns
+    return PersonDimension(
+        pq.read_table(path, columns=["name", "normalized_name", "artist_id"])
+    )
+
+
+def save_persons(output_folder_path: str, persons: PersonDimension):
+    """
+    Writes the persons table to the output folder of `process_credits_file` (replacing it atomically).
+    """
+    path = os.path.join(output_folder_path, PERSONS_FILE_NAME)
+    pq.write_table(persons.to_table(), path + ".tmp")
+    os.replace(path + ".tmp", path)
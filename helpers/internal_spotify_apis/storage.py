@@ -0,0 +1,574 @@
+"""
+Storage for the responses of the internal Spotify APIs.
+
+Responses are appended to JSONL files (one JSON object per line), optionally compressed with zstd.
+Instead of opening and closing the file for every response, a `ResponseWriter` keeps the file open and buffers the
+lines in memory. The buffer is written to the file
+- after every `flush_every` lines ("chunk boundary") or if the last write happened more than `flush_interval` seconds ago,
+- when `flush` or `checkpoint` is called (the latter also makes sure the data is written to disk with fsync),
+- when the writer is closed (also if the process is stopped with an exception or Ctrl+C).
+
+If compression is enabled, every flush writes a separate zstd frame, so everything that has been flushed can be
+decompressed even if the process is killed later on.
+
+Next to every responses file, a sidecar index (<file name>.idx) is written. It contains one tab-separated line per response:
+- track_id
+- status_code
+- block_offset, block_length: position of the "block" containing the response in the responses file
+  (the zstd frame if compression is enabled, otherwise the line itself)
+- line_offset, line_length: position of the response's line within the (decompressed) block
+This allows resuming (which only needs the track IDs and status codes) without parsing the responses themselves,
+and reading the response for a specific track ID without reading the whole file (see `read_response`).
+
+The index is always written after the data it refers to. If the process is killed while writing, the responses file may
+end with incomplete (or unindexed) data; it is truncated to the end of the last indexed block when the file is opened
+for writing the next time (see `repair_tail`). Responses files without an index (e.g. from older versions of this
+module) are indexed once by reading the whole file.
+
+Alternatively, responses can be stored in Parquet files (see `helpers.internal_spotify_apis.parquet_storage`);
+`create_response_writer` and `read_status_codes` work with both storages.
+"""
+
+import bisect
+import io
+import json
+import os
+import time
+from collections import namedtuple
+from typing import Dict, Iterator, List, Tuple
+
+STORAGES = ["jsonl", "parquet"]
+STORAGE_FILE_EXTENSIONS = {"jsonl": ".jsonl", "parquet": ".parquet"}
+COMPRESSIONS = ["none", "zstd"]
+COMPRESSION_FILE_EXTENSIONS = {"none": "", "zstd": ".zst"}
+INDEX_FILE_EXTENSION = ".idx"
+
+IndexEntry = namedtuple(
+    "IndexEntry",
+    [
+        "track_id",
+        "status_code",
+        "block_offset",
+        "block_length",
+        "line_offset",
+        "line_length",
+    ],
+)
+
+
+def get_storage(path: str) -> str:
+    """
+    Returns the storage of responses (based on the file extension, Parquet files are stored in a directory ending with '.parquet').
+    """
+    return "parquet" if path.rstrip("/").endswith(".parquet") else "jsonl"
+
+
+def create_response_writer(path: str, **kwargs):
+    """
+    Returns a writer for the storage of the given path (a `ResponseWriter` or `ParquetResponseWriter`).
+    The keyword arguments are passed on to the writer.
+    """
+    if get_storage(path) == "parquet":
+        from .parquet_storage import ParquetResponseWriter
+
+        return ParquetResponseWriter(path, **kwargs)
+    return ResponseWriter(path, **kwargs)
+
+
+def read_status_codes(path: str) -> List[Tuple[str, int]]:
+    """
+    Returns the track ID and status code of every response in a responses file (or directory of Parquet files) without reading the responses themselves.
+    """
+    if get_storage(path) == "parquet":
+        from .parquet_storage import read_parquet_responses
+
+        table = read_parquet_responses(path, columns=["track_id", "status_code"])
+        return list(
+            zip(
+                table.column("track_id").to_pylist(),
+                table.column("status_code").to_pylist(),
+            )
+        )
+    return [(entry.track_id, entry.status_code) for entry in read_index(path)]
+
+
+def get_compression(path: str) -> str:
+    """
+    Returns the compression of a responses file (based on its file extension).
+    """
+    return "zstd" if path.endswith(".zst") else "none"
+
+
+def get_index_path(path: str) -> str:
+    return path + INDEX_FILE_EXTENSION
+
+
+class ResponseWriter:
+    """
+    Appends JSON lines to a (optionally zstd-compressed) file with buffering and maintains its index.
+    Can be used as a context manager.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_every: int = 100,
+        flush_interval: float = 5.0,
+        fsync_interval: float = 60.0,
+    ):
+        """
+        Args:
+            path: Path to the file (the compression is inferred from the file extension, '.zst' for zstd).
+            flush_every: Number of lines after which the buffer is written to the file.
+            flush_interval: Maximum number of seconds lines are kept in the buffer (checked when writing).
+            fsync_interval: Maximum number of seconds between checkpoints (i.e. fsync calls, checked when flushing).
+        """
+        self.path = path
+        self.compression = get_compression(path)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+
+        repair_tail(path)
+        self._compressor = (
+            _create_zstd_compressor() if self.compression == "zstd" else None
+        )
+        self._file = open(path, "ab")
+        self._index_file = open(get_index_path(path), "ab")
+        self._offset = os.path.getsize(path)
+        self._buffer = []  # list of (track_id, status_code, line) tuples
+        self._last_flush = time.monotonic()
+        self._last_fsync = time.monotonic()
+
+    def write(self, record: dict):
+        """
+        Writes a response (a dictionary with at least 'track_id' and 'status_code' fields).
+        """
+        line = json.dumps(record).encode("utf-8") + b"\n"
+        self._buffer.append((record["track_id"], record["status_code"], line))
+        if (
+            len(self._buffer) >= self.flush_every
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered lines to the file (as a single zstd frame if compression is enabled), followed by their index entries.
+        """
+        if len(self._buffer) > 0:
+            data = b"".join(line for _, _, line in self._buffer)
+            if self._compressor is not None:
+                data = self._compressor.compress(data)
+
+            entries = []
+            line_offset = 0
+            for track_id, status_code, line in self._buffer:
+                if self._compressor is None:
+                    # every line is a block of its own
+                    position = (self._offset + line_offset, len(line), 0, len(line))
+                else:
+                    # all lines are in the same frame
+                    position = (self._offset, len(data), line_offset, len(line))
+                entries.append(IndexEntry(track_id, status_code, *position))
+                line_offset += len(line)
+
+            self._file.write(data)
+            self._file.flush()
+            self._index_file.write(
+                "".join(_format_index_entry(e) for e in entries).encode("utf-8")
+            )
+            self._index_file.flush()
+            self._offset += len(data)
+            self._buffer = []
+        self._last_flush = time.monotonic()
+        if time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Flushes the buffer and makes sure everything is written to disk.
+        """
+        self._last_fsync = time.monotonic()
+        self.flush()
+        os.fsync(self._file.fileno())
+        os.fsync(self._index_file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.checkpoint()
+            self._file.close()
+            self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_responses(path: str) -> Iterator[dict]:
+    """
+    Yields the responses stored in a (optionally zstd-compressed) JSONL file one by one.
+    Incomplete lines (or zstd frames) at the end of the file are ignored.
+    """
+    for line in _iter_lines(path):
+        yield json.loads(line)
+
+
+def read_line_batches(
+    path: str, batch_size: int = 10000, start_offset: int = 0, end_offset: int = None
+) -> Iterator[bytes]:
+    """
+    Yields the (raw) lines of a (optionally zstd-compressed) JSONL file in batches of up to `batch_size` lines
+    (concatenated, e.g. for parsing them with `pyarrow.json`). Incomplete data at the end of the file is ignored.
+
+    Args:
+        path: Path to the file.
+        batch_size: Maximum number of lines per batch.
+        start_offset: Position in the file to start reading at (has to be the start of a line, or of a zstd frame if compression is enabled, e.g. the end of a block in the index).
+        end_offset: Position in the file to stop reading at (same requirements as for `start_offset`). If not provided, the file is read until the end.
+    """
+    batch = []
+    for line in _iter_lines(path, start_offset, end_offset):
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield b"".join(batch)
+            batch = []
+    if len(batch) > 0:
+        yield b"".join(batch)
+
+
+def parse_json_lines(lines: bytes, schema):
+    """
+    Parses concatenated JSON lines (e.g. a batch from `read_line_batches`) with `pyarrow.json` into a pyarrow Table.
+    Only the fields in `schema` (a pyarrow Schema) are parsed, all other fields are skipped.
+    """
+    import pyarrow.json as pj
+
+    return pj.read_json(
+        io.BytesIO(lines),
+        read_options=pj.ReadOptions(use_threads=False, block_size=max(len(lines), 1)),
+        parse_options=pj.ParseOptions(
+            explicit_schema=schema, unexpected_field_behavior="ignore"
+        ),
+    )
+
+
+def get_chunk_offsets(path: str, chunk_count: int) -> List[Tuple[int, int]]:
+    """
+    Splits a responses file into up to `chunk_count` byte ranges of about the same size that can be read independently
+    (e.g. in parallel with `read_line_batches`). The ranges are aligned to the blocks in the index (lines, or zstd frames
+    if compression is enabled), so fewer ranges are returned if there are fewer blocks.
+
+    Returns:
+        A list of (start_offset, end_offset) tuples.
+    """
+    block_ends = sorted(set(e.block_offset + e.block_length for e in read_index(path)))
+    if len(block_ends) == 0:
+        return []
+    chunks = []
+    start_offset = 0
+    for i in range(1, chunk_count + 1):
+        target = block_ends[-1] * i // chunk_count
+        end_offset = block_ends[bisect.bisect_left(block_ends, target)]
+        if end_offset > start_offset:
+            chunks.append((start_offset, end_offset))
+            start_offset = end_offset
+    return chunks
+
+
+def read_index(path: str) -> List[IndexEntry]:
+    """
+    Returns the index entries of a responses file (in the order the responses were written).
+    If the responses file has no index yet, it is created first.
+    """
+    index_path = get_index_path(path)
+    if not os.path.exists(index_path):
+        repair_tail(path)
+    entries = []
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.endswith("\n"):
+                entries.append(_parse_index_entry(line))
+    return entries
+
+
+def load_index(path: str) -> Dict[str, IndexEntry]:
+    """
+    Returns a dictionary mapping every track ID in a responses file to the index entry of its (last) response.
+    """
+    return {entry.track_id: entry for entry in read_index(path)}
+
+
+def read_response(path: str, track_id: str, index: Dict[str, IndexEntry] = None):
+    """
+    Reads the response for a single track ID from a responses file (without reading the rest of the file).
+
+    Args:
+        path: Path to the responses file.
+        track_id: The track ID.
+        index: The index of the file as returned by `load_index` (pass it when reading many responses from the same file, otherwise it is loaded on every call).
+
+    Returns:
+        The response dictionary, or None if there is no response for the track ID.
+    """
+    if index is None:
+        index = load_index(path)
+    entry = index.get(track_id)
+    if entry is None:
+        return None
+    with open(path, "rb") as f:
+        f.seek(entry.block_offset)
+        block = f.read(entry.block_length)
+    if get_compression(path) == "zstd":
+        import zstandard
+
+        block = zstandard.ZstdDecompressor().decompress(block)
+    return json.loads(block[entry.line_offset : entry.line_offset + entry.line_length])
+
+
+def repair_tail(path: str) -> int:
+    """
+    Makes sure a responses file and its index are consistent, in case the process writing them was killed in the middle of a write:
+    - an incomplete line at the end of the index is removed
+    - the responses file is truncated to the end of the last indexed block
+
+    If there is no index, the responses file is truncated to the end of the last complete line (or zstd frame ending with a complete line) and the index is created.
+
+    Returns:
+        The number of bytes that were removed from the responses file.
+    """
+    if not os.path.exists(path):
+        return 0
+    size = os.path.getsize(path)
+    index_path = get_index_path(path)
+
+    valid_size = None
+    if os.path.exists(index_path):
+        _truncate(index_path, _get_valid_lines_size(index_path))
+        last_entry = _read_last_index_entry(index_path)
+        indexed_size = (
+            last_entry.block_offset + last_entry.block_length
+            if last_entry is not None
+            else 0
+        )
+        if indexed_size <= size:
+            valid_size = indexed_size
+        else:
+            print(
+                f"Warning: index '{index_path}' refers to data missing in '{path}', recreating it"
+            )
+    if valid_size is None:
+        valid_size = _build_index(path)
+
+    if valid_size < size:
+        print(
+            f"Warning: removing {size - valid_size} bytes of incomplete data at the end of '{path}'"
+        )
+        _truncate(path, valid_size)
+    return size - valid_size
+
+
+def _build_index(path: str) -> int:
+    """
+    Creates the index for a responses file by reading the whole file.
+
+    Returns:
+        The size of the valid part of the responses file (i.e. up to the end of the last complete line/frame).
+    """
+    if os.path.getsize(path) > 0:
+        print(f"Creating index for '{path}'")
+    entries = []
+    valid_size = 0
+    if get_compression(path) == "zstd":
+        for frame_offset, frame_length, data in _iter_zstd_frames(path):
+            if not data.endswith(b"\n"):
+                break
+            line_offset = 0
+            for line in data.splitlines(keepends=True):
+                entries.append(
+                    _create_index_entry(
+                        line, frame_offset, frame_length, line_offset, len(line)
+                    )
+                )
+                line_offset += len(line)
+            valid_size = frame_offset + frame_length
+    else:
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                entries.append(
+                    _create_index_entry(line, valid_size, len(line), 0, len(line))
+                )
+                valid_size += len(line)
+
+    index_path = get_index_path(path)
+    with open(index_path + ".tmp", "wb") as f:
+        f.write("".join(_format_index_entry(e) for e in entries).encode("utf-8"))
+    os.replace(index_path + ".tmp", index_path)
+    return valid_size
+
+
+def _create_index_entry(
+    line: bytes, block_offset: int, block_length: int, line_offset, line_length
+):
+    record = json.loads(line)
+    return IndexEntry(
+        record["track_id"],
+        record["status_code"],
+        block_offset,
+        block_length,
+        line_offset,
+        line_length,
+    )
+
+
+def _format_index_entry(entry: IndexEntry) -> str:
+    return "\t".join(str(v) for v in entry) + "\n"
+
+
+def _parse_index_entry(line: str) -> IndexEntry:
+    track_id, *numbers = line.rstrip("\n").split("\t")
+    return IndexEntry(track_id, *(int(n) for n in numbers))
+
+
+def _read_last_index_entry(index_path: str, block_size: int = 1 << 12):
+    size = os.path.getsize(index_path)
+    if size == 0:
+        return None
+    with open(index_path, "rb") as f:
+        f.seek(max(0, size - block_size))
+        last_line = f.read().splitlines()[-1]
+    return _parse_index_entry(last_line.decode("utf-8"))
+
+
+def _truncate(path: str, size: int):
+    if os.path.getsize(path) > size:
+        with open(path, "r+b") as f:
+            f.truncate(size)
+
+
+def _get_valid_lines_size(path: str, block_size: int = 1 << 16):
+    # search backwards for the last newline
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        end = size
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            block = f.read(end - start)
+            index = block.rfind(b"\n")
+            if index != -1:
+                return start + index + 1
+            end = start
+    return 0
+
+
+def _iter_zstd_frames(path: str, block_size: int = 1 << 20):
+    """
+    Yields (offset, length, decompressed data) for every complete zstd frame in the file.
+    """
+    import zstandard
+
+    dctx = zstandard.ZstdDecompressor()
+    decompressor = dctx.decompressobj()
+    offset = 0
+    frame_offset = 0
+    output = []
+    with open(path, "rb") as f:
+        pending = b""
+        while True:
+            data = pending or f.read(block_size)
+            pending = b""
+            if not data:
+                break
+            try:
+                output.append(decompressor.decompress(data))
+            except zstandard.ZstdError:
+                break
+            if decompressor.eof:
+                # a frame ended within this block, continue with the next frame
+                unused = decompressor.unused_data
+                offset += len(data) - len(unused)
+                yield frame_offset, offset - frame_offset, b"".join(output)
+                decompressor = dctx.decompressobj()
+                frame_offset = offset
+                output = []
+                pending = unused
+            else:
+                offset += len(data)
+
+
+def get_indexed_size(path: str) -> int:
+    """
+    Returns the size of the part of a responses file that is covered by its index (i.e. the end of the last indexed block).
+    Unlike the size of the file, this is always the end of a complete line (or zstd frame), even if the file is being written to.
+    """
+    if not os.path.exists(get_index_path(path)):
+        read_index(path)
+    last_entry = _read_last_index_entry(get_index_path(path))
+    return last_entry.block_offset + last_entry.block_length if last_entry else 0
+
+
+def _iter_lines(
+    path: str, start_offset: int = 0, end_offset: int = None
+) -> Iterator[bytes]:
+    with _open_for_reading(path, start_offset, end_offset) as f:
+        try:
+            for line in f:
+                if line.endswith(b"\n"):
+                    yield line
+        except Exception as e:
+            if get_compression(path) != "zstd":
+                raise
+            print(f"Warning: ignoring incomplete data at the end of '{path}' ({e})")
+
+
+def _open_for_reading(path: str, start_offset: int = 0, end_offset: int = None):
+    f = open(path, "rb")
+    if start_offset > 0:
+        f.seek(start_offset)
+    if end_offset is not None:
+        f = _LimitedReader(f, end_offset - start_offset)
+    if get_compression(path) == "zstd":
+        import zstandard
+
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        )
+    return io.BufferedReader(f) if end_offset is not None else f
+
+
+class _LimitedReader(io.RawIOBase):
+    """
+    Reads at most `length` bytes from a file (from its current position).
+    """
+
+    def __init__(self, f, length: int):
+        self._file = f
+        self._remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._file.read(min(len(buffer), self._remaining))
+        buffer[: len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def _create_zstd_compressor():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "zstd compression requires the 'zstandard' package (pip install zstandard)"
+        )
+    return zstandard.ZstdCompressor()
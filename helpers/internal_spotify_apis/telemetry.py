@@ -0,0 +1,225 @@
+"""
+Telemetry for requests to the internal Spotify APIs.
+
+A `RequestTelemetry` (one per endpoint) is fed by the request engine (see `helpers.internal_spotify_apis.engine`) with
+the status code and latency of every request. Over a rolling window (the last `window` seconds), it computes
+- the number of requests per second,
+- the p50/p95/p99 latencies,
+- the share of throttled (429) and unauthorized (401) responses,
+and it reports gauges registered by the engine (e.g. the current concurrency limit, the number of requests in flight
+and the age of the request headers), as well as the total number of responses per status code.
+
+A `TelemetryExporter` periodically appends snapshots of all telemetries to a JSONL file and/or serves them in the
+Prometheus text format (on http://localhost:<port>/metrics), so that e.g. the number of parallel requests can be tuned
+based on data instead of the progress bar.
+"""
+
+import asyncio
+import datetime
+import json
+import math
+import time
+from collections import defaultdict, deque
+from typing import Callable, List
+
+from .headers import THROTTLED_STATUS_CODE, UNAUTHORIZED_STATUS_CODE
+
+LATENCY_QUANTILES = [0.5, 0.95, 0.99]
+
+
+class RequestTelemetry:
+    """
+    Rolling request statistics for a single endpoint.
+    """
+
+    def __init__(self, name: str, window: float = 60.0):
+        """
+        Args:
+            name: Name of the endpoint (used as label in the snapshots).
+            window: Length (in seconds) of the rolling window for rates and latency percentiles.
+        """
+        self.name = name
+        self.window = window
+        self.status_code_counts = defaultdict(int)
+        self._started_at = time.monotonic()
+        self._requests = deque()  # (finished_at, status_code, latency)
+        self._gauges = {}
+
+    def record(self, status_code: int, latency: float):
+        """
+        Records a finished request.
+
+        Args:
+            status_code: The status code of the response.
+            latency: The time (in seconds) between sending the request and receiving the response.
+        """
+        now = time.monotonic()
+        self.status_code_counts[status_code] += 1
+        self._requests.append((now, status_code, latency))
+        self._trim(now)
+
+    def set_gauge(self, name: str, get_value: Callable[[], float]):
+        """
+        Registers a value that is included in every snapshot (e.g. the current concurrency), read when the snapshot is taken.
+        """
+        self._gauges[name] = get_value
+
+    def snapshot(self) -> dict:
+        """
+        Returns the current statistics as a (JSON-serializable) dictionary.
+        """
+        now = time.monotonic()
+        self._trim(now)
+        window = min(self.window, now - self._started_at) or self.window
+        request_count = len(self._requests)
+        latencies = sorted(latency for _, _, latency in self._requests)
+        status_codes = [status_code for _, status_code, _ in self._requests]
+        return {
+            "timestamp": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "endpoint": self.name,
+            "window": self.window,
+            "requests_per_second": request_count / window,
+            "latency": {
+                f"p{round(q * 100)}": _get_quantile(latencies, q)
+                for q in LATENCY_QUANTILES
+            },
+            "throttled_rate": _get_share(status_codes, THROTTLED_STATUS_CODE),
+            "unauthorized_rate": _get_share(status_codes, UNAUTHORIZED_STATUS_CODE),
+            **{name: get_value() for name, get_value in self._gauges.items()},
+            "status_code_counts": {
+                str(status_code): count
+                for status_code, count in sorted(self.status_code_counts.items())
+            },
+        }
+
+    def _trim(self, now: float):
+        while len(self._requests) > 0 and self._requests[0][0] < now - self.window:
+            self._requests.popleft()
+
+
+class TelemetryExporter:
+    """
+    Periodically writes snapshots of several `RequestTelemetry`s to a JSONL file and/or serves them for Prometheus.
+    Can be used as an async context manager (the last snapshot is written when exiting).
+    """
+
+    def __init__(
+        self,
+        telemetries: List[RequestTelemetry],
+        snapshot_path: str = None,
+        interval: float = 10.0,
+        prometheus_port: int = None,
+    ):
+        """
+        Args:
+            telemetries: The telemetries to export.
+            snapshot_path: Path to a JSONL file the snapshots are appended to (one line per telemetry and interval). If not provided, no snapshots are written.
+            interval: Number of seconds between snapshots.
+            prometheus_port: If provided, the metrics are served on http://localhost:<port>/metrics in the Prometheus text format.
+        """
+        self.telemetries = telemetries
+        self.snapshot_path = snapshot_path
+        self.interval = interval
+        self.prometheus_port = prometheus_port
+        self._task = None
+        self._runner = None
+
+    async def start(self):
+        if self.prometheus_port is not None:
+            from aiohttp import web
+
+            async def handle_metrics(request: web.Request):
+                return web.Response(
+                    text=format_prometheus_metrics(
+                        [t.snapshot() for t in self.telemetries]
+                    ),
+                    content_type="text/plain",
+                )
+
+            app = web.Application()
+            app.router.add_get("/metrics", handle_metrics)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, "localhost", self.prometheus_port).start()
+            print(f"Serving metrics on http://localhost:{self.prometheus_port}/metrics")
+        if self.snapshot_path is not None:
+            self._task = asyncio.create_task(self._write_periodically())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self.write_snapshots()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def write_snapshots(self):
+        with open(self.snapshot_path, "a", encoding="utf-8") as f:
+            for telemetry in self.telemetries:
+                f.write(json.dumps(telemetry.snapshot()) + "\n")
+
+    async def _write_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.write_snapshots()
+
+
+def format_prometheus_metrics(snapshots: List[dict]) -> str:
+    """
+    Formats telemetry snapshots in the Prometheus text exposition format.
+    """
+    metrics = defaultdict(list)  # name -> [(labels, value)]
+    types = {}
+    for snapshot in snapshots:
+        labels = {"endpoint": snapshot["endpoint"]}
+        for name, value in snapshot.items():
+            if name in ["timestamp", "endpoint", "window"]:
+                continue
+            if name == "latency":
+                types["latency_seconds"] = "summary"
+                for quantile in LATENCY_QUANTILES:
+                    metrics["latency_seconds"].append(
+                        (
+                            {**labels, "quantile": str(quantile)},
+                            value[f"p{round(quantile * 100)}"],
+                        )
+                    )
+            elif name == "status_code_counts":
+                types["responses_total"] = "counter"
+                for status_code, count in value.items():
+                    metrics["responses_total"].append(
+                        ({**labels, "status_code": status_code}, count)
+                    )
+            else:
+                types[name] = "gauge"
+                metrics[name].append((labels, value))
+
+    lines = []
+    for name, samples in metrics.items():
+        full_name = f"internal_api_{name}"
+        lines.append(f"# TYPE {full_name} {types[name]}")
+        for labels, value in samples:
+            formatted_labels = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            formatted_value = "NaN" if value is None else repr(float(value))
+            lines.append(f"{full_name}{{{formatted_labels}}} {formatted_value}")
+    return "\n".join(lines) + "\n"
+
+
+def _get_quantile(sorted_values: List[float], quantile: float):
+    # nearest-rank method
+    if len(sorted_values) == 0:
+        return None
+    return sorted_values[max(0, math.ceil(quantile * len(sorted_values)) - 1)]
+
+
+def _get_share(status_codes: List[int], status_code: int):
+    if len(status_codes) == 0:
+        return 0.0
+    return sum(1 for s in status_codes if s == status_code) / len(status_codes)
@@ -1,28 +1,27 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
 import os
-from dotenv import load_dotenv
-from selenium.webdriver.support.ui import WebDriverWait
-import selenium.webdriver.support.expected_conditions as EC
 import time
 from urllib.parse import quote
-import inquirer
 from datetime import datetime
-import json
-import random
-from helpers.spotify_util import get_spotify_track_link
-from typing import Callable, Set
 import pickle
+from typing import List, TYPE_CHECKING
+
+# selenium, dotenv and inquirer are imported inside the functions that need them to keep importing this module cheap
+
+if TYPE_CHECKING:
+    from selenium import webdriver
 
 login_page_url = "https://accounts.spotify.com/en/login"
 
 
 def login_and_accept_cookies(
-    driver: webdriver,
+    driver: "webdriver",
     username,
     password,
     after_login_url="https://charts.spotify.com/charts/overview/global",
 ):
+    from selenium.webdriver.support.ui import WebDriverWait
+    import selenium.webdriver.support.expected_conditions as EC
+
     fill_and_submit_login_form(driver, username, password, after_login_url)
 
     wait = WebDriverWait(driver, 5)
@@ -31,7 +30,11 @@ def login_and_accept_cookies(
     accept_cookies(driver)
 
 
-def accept_cookies(driver: webdriver):
+def accept_cookies(driver: "webdriver"):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    import selenium.webdriver.support.expected_conditions as EC
+
     wait = WebDriverWait(driver, 15)
     cookie_button = wait.until(
         EC.element_to_be_clickable((By.CSS_SELECTOR, "#onetrust-accept-btn-handler"))
@@ -43,11 +46,13 @@ def accept_cookies(driver: webdriver):
 
 
 def fill_and_submit_login_form(
-    driver: webdriver,
+    driver: "webdriver",
     username,
     password,
     after_login_url,
 ):
+    from selenium.webdriver.common.by import By
+
     driver.get(login_page_url + f"?continue={quote(after_login_url)}")
 
     # enter credentials on login page
@@ -65,6 +70,9 @@ def fill_and_submit_login_form(
 
 
 def get_spotify_credentials():
+    import inquirer
+    from dotenv import load_dotenv
+
     env_path = os.path.join(os.path.dirname(__file__), ".env")
     load_dotenv(env_path)
     username = os.environ.get("SPOTIFY_USERNAME")
@@ -92,7 +100,7 @@ def get_spotify_credentials():
     return username, password
 
 
-def save_debug_screenshot(driver: webdriver, dirpath: str, worker_id: str, desc: str):
+def save_debug_screenshot(driver: "webdriver", dirpath: str, worker_id: str, desc: str):
     driver.save_screenshot(
         os.path.join(
             dirpath,
@@ -102,6 +110,10 @@ def save_debug_screenshot(driver: webdriver, dirpath: str, worker_id: str, desc:
 
 
 def get_element_with_att_and_val(driver, att, val):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    import selenium.webdriver.support.expected_conditions as EC
+
     wait = WebDriverWait(driver, 5)
     element = wait.until(
         EC.presence_of_element_located((By.CSS_SELECTOR, f'[{att}="{val}"]'))
@@ -109,9 +121,29 @@ def get_element_with_att_and_val(driver, att, val):
     return element
 
 
-def load_cookies(driver: webdriver, cookies_path: str):
+def load_cookies(driver: "webdriver", cookies_path: str):
     with open(cookies_path, "rb") as f:
         cookies = pickle.load(f)
 
     for cookie in cookies:
         driver.add_cookie(cookie)
+
+
+def find_cookies_files(paths: List[str]):
+    """
+    Returns the paths of all cookies files (created with `save_cookies.py`) in the given list of paths.
+    Paths of directories are replaced with the paths of the .pkl files they contain.
+    """
+    cookies_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            cookies_paths.extend(
+                sorted(
+                    os.path.join(path, f)
+                    for f in os.listdir(path)
+                    if f.endswith(".pkl")
+                )
+            )
+        else:
+            cookies_paths.append(path)
+    return cookies_paths
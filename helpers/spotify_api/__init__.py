@@ -1,11 +1,25 @@
-from typing import List
-import spotipy
-from .albums import get_album_metadata_from_api
-from .artists import get_artist_metadata_from_api
-from .tracks import get_track_metadata_from_api
+from typing import List, TYPE_CHECKING
 
+if TYPE_CHECKING:
+    import spotipy
 
-def get_metadata_from_spotify_api(track_ids: List[str], spotify: spotipy.Spotify):
+# the submodules (which import pandas etc.) are only loaded when one of their functions is accessed, see __getattr__ below
+_lazy_attrs = {
+    "get_album_metadata_from_api": ".albums",
+    "get_artist_metadata_from_api": ".artists",
+    "get_track_metadata_from_api": ".tracks",
+}
+
+
+def __getattr__(name: str):
+    if name in _lazy_attrs:
+        from importlib import import_module
+
+        return getattr(import_module(_lazy_attrs[name], __name__), name)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def get_metadata_from_spotify_api(track_ids: List[str], spotify: "spotipy.Spotify"):
     """
     Gets track, album, and artist metadata for a list of tracks from the Spotify API.
 
@@ -16,6 +30,10 @@ def get_metadata_from_spotify_api(track_ids: List[str], spotify: spotipy.Spotify
     Returns:
         A dictionary of dictionaries of DataFrames with the following keys: "tracks", "albums", "artists".
     """
+    from .albums import get_album_metadata_from_api
+    from .artists import get_artist_metadata_from_api
+    from .tracks import get_track_metadata_from_api
+
     track_metadata = get_track_metadata_from_api(track_ids=track_ids, spotify=spotify)
 
     album_ids = track_metadata["metadata"]["album_id"].unique().tolist()
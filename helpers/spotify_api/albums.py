@@ -1,38 +1,111 @@
 import pandas as pd
 from tqdm import tqdm
-import spotipy
-from typing import List
+from typing import List, TYPE_CHECKING
 from helpers.util import split_into_chunks_of_size
 from helpers.spotify_util import create_spotipy_data_provenance_info_dict
+from .original_responses import open_original_responses_log
+from .checkpoints import ChunkCheckpoints, fetch_isolating_rejected_ids
+from .markets import create_market_bitmaps, validate_markets_format
 
+if TYPE_CHECKING:
+    import spotipy
 
-def get_album_metadata_from_api(album_ids: list, spotify: spotipy.Spotify):
-    chunk_size = 20
-    album_ids_chunks = split_into_chunks_of_size(album_ids, chunk_size)
-    print(f"Fetching data in {len(album_ids_chunks)} chunks of size {chunk_size}...")
+
+def get_album_metadata_from_api(
+    album_ids: list,
+    spotify: "spotipy.Spotify",
+    markets_format: str = "long",
+    original_responses_path: str = None,
+    checkpoint_dir: str = None,
+):
+    """
+    Fetches album metadata from the Spotify API.
+
+    Args:
+        album_ids: A list of album IDs.
+        spotify: A spotipy Spotify client.
+        markets_format: How to store the available markets of each album. Either "long" (one row per album and market in the "markets" DataFrame) or "bitmap" (one bitmap per album in the "market_bitmaps" DataFrame, together with the "market_codes" DataFrame, see `helpers.spotify_api.markets`).
+        original_responses_path: If provided, the original API responses are streamed to a gzip-compressed JSONL file at this path as they arrive (replacing an existing file, unless a fetch is resumed from checkpoints, see `helpers.spotify_api.original_responses`) instead of being returned in the "original_responses" DataFrame.
+        checkpoint_dir: If provided, fetching runs in fault-isolation mode: IDs for which no data can be fetched are written to a dead letter file instead of raising an error, the results of every chunk are checkpointed and a previously interrupted fetch is resumed from the last checkpoint (see `helpers.spotify_api.checkpoints`). Should be combined with `original_responses_path`, as original responses kept in memory are not checkpointed.
+
+    Returns:
+        A dictionary of DataFrames.
+    """
+    validate_markets_format(markets_format)
 
     imgs = []  # tuples of shape ('album_id', 'url', 'width', 'height')
     artists = []  # tuples of shape ('album_id', 'artist_id', 'pos')
-    markets = []  # tuples of shape ('album_id', 'market')
+    markets = (
+        []
+    )  # tuples of shape ('album_id', 'market') or ('album_id', [markets]), depending on markets_format
     copyrights = []  # tuples of shape ('album_id', 'text', 'type')
     metadata = []  # list of dictionaries for all remaining album metadata
     original_responses = (
         []
     )  # list of original API responses, with added 'timestamp' and 'source' fields
 
-    with tqdm(total=len(album_ids_chunks)) as pbar:
+    rows = {
+        "images": imgs,
+        "artists": artists,
+        "markets": markets,
+        "copyrights": copyrights,
+        "metadata": metadata,
+    }  # all results that are checkpointed after every chunk
+
+    checkpoints = None
+    resumed_ids = None  # the original responses log is only continued when resuming
+    if checkpoint_dir is not None:
+        checkpoints = ChunkCheckpoints(checkpoint_dir)
+        checkpointed_rows, processed_ids = checkpoints.load(
+            album_ids, {"markets_format": markets_format}
+        )
+        if len(processed_ids) > 0:
+            print(
+                f"Resuming from checkpoint in '{checkpoint_dir}' ({len(processed_ids)} album IDs already processed)"
+            )
+            resumed_ids = processed_ids
+        for name, chunk_rows in checkpointed_rows.items():
+            rows[name].extend(chunk_rows)
+        album_ids = [id for id in album_ids if id not in processed_ids]
+
+    chunk_size = 20
+    album_ids_chunks = split_into_chunks_of_size(album_ids, chunk_size)
+    print(f"Fetching data in {len(album_ids_chunks)} chunks of size {chunk_size}...")
+
+    with open_original_responses_log(
+        original_responses_path, resumed_ids
+    ) as responses_log, tqdm(total=len(album_ids_chunks)) as pbar:
         for album_ids in album_ids_chunks:
-            api_resp = spotify.albums(album_ids)["albums"]
-            original_responses.append(
-                create_spotipy_data_provenance_info_dict(
-                    response=api_resp, client_method_name="albums"
+            if checkpoints is not None:
+                api_resp, errors = fetch_isolating_rejected_ids(
+                    lambda ids: spotify.albums(ids)["albums"], album_ids
                 )
-            )
-            for album_data in api_resp:
+                row_counts = {name: len(r) for name, r in rows.items()}
+            else:
+                api_resp = spotify.albums(album_ids)["albums"]
+            if responses_log is not None:
+                responses_log.append(
+                    response=api_resp,
+                    client_method_name="albums",
+                    requested_ids=album_ids,
+                )
+            else:
+                original_responses.append(
+                    create_spotipy_data_provenance_info_dict(
+                        response=api_resp, client_method_name="albums"
+                    )
+                )
+            for requested_id, album_data in zip(album_ids, api_resp):
                 if album_data is None:
-                    raise ValueError(
-                        'Received "None" as response from spotipy. You probably provided one or more invalid album IDs.'
+                    if checkpoints is None:
+                        raise ValueError(
+                            'Received "None" as response from spotipy. You probably provided one or more invalid album IDs.'
+                        )
+                    checkpoints.add_dead_letter(
+                        requested_id,
+                        errors.get(requested_id, "No data returned by the API"),
                     )
+                    continue
                 album_id = album_data["id"]
                 imgs.extend(
                     _process_img_data(album_id=album_id, images=album_data["images"])
@@ -40,22 +113,33 @@ def get_album_metadata_from_api(album_ids: list, spotify: spotipy.Spotify):
                 artists.extend(
                     _process_artists(album_id=album_id, artists=album_data["artists"])
                 )
-                markets.extend(
-                    _process_markets(
-                        album_id=album_id, markets=album_data["available_markets"]
+                if markets_format == "bitmap":
+                    markets.append((album_id, album_data["available_markets"]))
+                else:
+                    markets.extend(
+                        _process_markets(
+                            album_id=album_id, markets=album_data["available_markets"]
+                        )
                     )
-                )
                 copyrights.extend(
                     _process_copyrights(
                         album_id=album_id, copyrights=album_data["copyrights"]
                     )
                 )
                 metadata.append(_process_remaining_data(data=album_data))
+            if checkpoints is not None:
+                checkpoints.save_chunk(
+                    album_ids,
+                    {name: r[row_counts[name] :] for name, r in rows.items()},
+                )
             pbar.update(1)
 
     df_dict = {}
 
-    df_dict["metadata"] = pd.DataFrame(metadata)
+    # the ID column is needed for the index, even if no data could be fetched for any ID (all IDs are dead letters)
+    df_dict["metadata"] = pd.DataFrame(
+        metadata, columns=None if metadata else ["album_id"]
+    )
     df_dict["metadata"].set_index("album_id", inplace=True)
 
     df_dict["images"] = pd.DataFrame(
@@ -66,15 +150,25 @@ def get_album_metadata_from_api(album_ids: list, spotify: spotipy.Spotify):
     df_dict["artists"] = pd.DataFrame(artists, columns=["album_id", "artist_id", "pos"])
     df_dict["artists"].set_index("album_id", inplace=True)
 
-    df_dict["markets"] = pd.DataFrame(markets, columns=["album_id", "market"])
-    df_dict["markets"].set_index("album_id", inplace=True)
+    if markets_format == "bitmap":
+        df_dict.update(
+            create_market_bitmaps(
+                ids=[t[0] for t in markets],
+                market_lists=[t[1] for t in markets],
+                id_col="album_id",
+            )
+        )
+    else:
+        df_dict["markets"] = pd.DataFrame(markets, columns=["album_id", "market"])
+        df_dict["markets"].set_index("album_id", inplace=True)
     df_dict["copyrights"] = pd.DataFrame(
         copyrights,
         columns=["album_id", "text", "type"],
     )
     df_dict["copyrights"].set_index("album_id", inplace=True)
 
-    df_dict["original_responses"] = pd.DataFrame(original_responses)
+    if responses_log is None:
+        df_dict["original_responses"] = pd.DataFrame(original_responses)
 
     return df_dict
 
@@ -1,12 +1,33 @@
 import pandas as pd
 from tqdm import tqdm
-import spotipy
-from typing import List
+from typing import List, TYPE_CHECKING
 from helpers.util import split_into_chunks_of_size
 from helpers.spotify_util import create_spotipy_data_provenance_info_dict
+from .original_responses import open_original_responses_log
+from .checkpoints import ChunkCheckpoints, fetch_isolating_rejected_ids
 
+if TYPE_CHECKING:
+    import spotipy
 
-def get_artist_metadata_from_api(artist_ids: list, spotify: spotipy.Spotify):
+
+def get_artist_metadata_from_api(
+    artist_ids: list,
+    spotify: "spotipy.Spotify",
+    original_responses_path: str = None,
+    checkpoint_dir: str = None,
+):
+    """
+    Fetches artist metadata from the Spotify API.
+
+    Args:
+        artist_ids: A list of artist IDs.
+        spotify: A spotipy Spotify client.
+        original_responses_path: If provided, the original API responses are streamed to a gzip-compressed JSONL file at this path as they arrive (replacing an existing file, unless a fetch is resumed from checkpoints, see `helpers.spotify_api.original_responses`) instead of being returned in the "original_responses" DataFrame.
+        checkpoint_dir: If provided, fetching runs in fault-isolation mode: IDs for which no data can be fetched are written to a dead letter file instead of raising an error, the results of every chunk are checkpointed and a previously interrupted fetch is resumed from the last checkpoint (see `helpers.spotify_api.checkpoints`). Should be combined with `original_responses_path`, as original responses kept in memory are not checkpointed.
+
+    Returns:
+        A dictionary of DataFrames.
+    """
     artist_genres = []  # tuples of shape ('artist_id', 'genre')
     artist_images = []  # tuples of shape ('artist_id', 'url', 'width', 'height')
     metadata = []  # list of dictionaries for all remaining artist metadata
@@ -14,36 +35,85 @@ def get_artist_metadata_from_api(artist_ids: list, spotify: spotipy.Spotify):
         []
     )  # list of original API responses, with added 'timestamp' and 'source' fields
 
+    rows = {
+        "genres": artist_genres,
+        "images": artist_images,
+        "metadata": metadata,
+    }  # all results that are checkpointed after every chunk
+
+    checkpoints = None
+    resumed_ids = None  # the original responses log is only continued when resuming
+    if checkpoint_dir is not None:
+        checkpoints = ChunkCheckpoints(checkpoint_dir)
+        checkpointed_rows, processed_ids = checkpoints.load(artist_ids)
+        if len(processed_ids) > 0:
+            print(
+                f"Resuming from checkpoint in '{checkpoint_dir}' ({len(processed_ids)} artist IDs already processed)"
+            )
+            resumed_ids = processed_ids
+        for name, chunk_rows in checkpointed_rows.items():
+            rows[name].extend(chunk_rows)
+        artist_ids = [id for id in artist_ids if id not in processed_ids]
+
     chunk_size = (
         50  # maximum number of artist IDs that can be fetched in a single API call
     )
     artist_ids_chunks = split_into_chunks_of_size(artist_ids, chunk_size)
     print(f"Fetching data in {len(artist_ids_chunks)} chunks of size {chunk_size}...")
 
-    with tqdm(total=len(artist_ids_chunks)) as pbar:
+    with open_original_responses_log(
+        original_responses_path, resumed_ids
+    ) as responses_log, tqdm(total=len(artist_ids_chunks)) as pbar:
         for artist_ids in artist_ids_chunks:
-            api_resp = spotify.artists(artist_ids)["artists"]
-            original_responses.append(
-                create_spotipy_data_provenance_info_dict(
-                    response=api_resp, client_method_name="artists"
+            if checkpoints is not None:
+                api_resp, errors = fetch_isolating_rejected_ids(
+                    lambda ids: spotify.artists(ids)["artists"], artist_ids
                 )
-            )
-            for artist_data in api_resp:
+                row_counts = {name: len(r) for name, r in rows.items()}
+            else:
+                api_resp = spotify.artists(artist_ids)["artists"]
+            if responses_log is not None:
+                responses_log.append(
+                    response=api_resp,
+                    client_method_name="artists",
+                    requested_ids=artist_ids,
+                )
+            else:
+                original_responses.append(
+                    create_spotipy_data_provenance_info_dict(
+                        response=api_resp, client_method_name="artists"
+                    )
+                )
+            for requested_id, artist_data in zip(artist_ids, api_resp):
                 if artist_data is None:
-                    raise ValueError(
-                        'Received "None" as response from spotipy. You probably provided one or more invalid artist IDs.'
+                    if checkpoints is None:
+                        raise ValueError(
+                            'Received "None" as response from spotipy. You probably provided one or more invalid artist IDs.'
+                        )
+                    checkpoints.add_dead_letter(
+                        requested_id,
+                        errors.get(requested_id, "No data returned by the API"),
                     )
+                    continue
                 artist_id = artist_data["id"]
                 artist_genres.extend(_process_genres(artist_id, artist_data["genres"]))
                 artist_images.extend(
                     _process_img_data(artist_id, artist_data["images"])
                 )
                 metadata.append(_process_remaining_data(artist_data))
+            if checkpoints is not None:
+                checkpoints.save_chunk(
+                    artist_ids,
+                    {name: r[row_counts[name] :] for name, r in rows.items()},
+                )
             pbar.update(1)
 
     df_dict = {}
 
-    df_dict["metadata"] = pd.DataFrame(metadata)
+    # the ID column is needed for the index, even if no data could be fetched for any ID (all IDs are dead letters)
+    df_dict["metadata"] = pd.DataFrame(
+        metadata, columns=None if metadata else ["artist_id"]
+    )
     df_dict["metadata"].set_index("artist_id", inplace=True)
 
     df_dict["genres"] = pd.DataFrame(artist_genres, columns=["artist_id", "genre"])
@@ -54,7 +124,8 @@ def get_artist_metadata_from_api(artist_ids: list, spotify: spotipy.Spotify):
     )
     df_dict["images"].set_index("artist_id", inplace=True)
 
-    df_dict["original_responses"] = pd.DataFrame(original_responses)
+    if responses_log is None:
+        df_dict["original_responses"] = pd.DataFrame(original_responses)
 
     return df_dict
 
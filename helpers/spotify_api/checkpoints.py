@@ -0,0 +1,176 @@
+"""
+Fault isolation and checkpointing for (long-running) metadata fetches from the Spotify API.
+
+If a checkpoint directory is passed to one of the `get_*_metadata_from_api` functions,
+- the processed results of every chunk are appended to a checkpoint file, so an interrupted fetch can be resumed from the last completed chunk
+- IDs for which no data could be fetched are written to a dead letter file instead of aborting the whole fetch
+
+The checkpoint directory contains the following files:
+- chunks.pkl: one pickled record per processed chunk ({"ids": [...], "results": {<result name>: [<rows>]}})
+- dead_letters.jsonl: one JSON object per ID that could not be fetched ({"id": ..., "reason": ..., "timestamp": ...})
+- run.json: the run the checkpoints belong to ({"ids_hash": ..., "id_count": ..., "params": {...}}), i.e. a hash of the
+  requested IDs and the parameters that affect the checkpointed rows (e.g. the markets format). If a fetch with other IDs
+  or parameters (or after the run was completed with `remove_chunks`) is started in the same directory, the checkpointed
+  chunks and dead letters are removed instead of being resumed.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+class ChunkCheckpoints:
+    def __init__(self, checkpoint_dir: str):
+        self.checkpoint_dir = checkpoint_dir
+        self.chunks_path = os.path.join(checkpoint_dir, "chunks.pkl")
+        self.dead_letters_path = os.path.join(checkpoint_dir, "dead_letters.jsonl")
+        self.run_path = os.path.join(checkpoint_dir, "run.json")
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def load(
+        self, ids: Iterable[str] = None, params: dict = None
+    ) -> Tuple[Dict[str, list], set]:
+        """
+        Loads the results of all previously checkpointed chunks.
+
+        If the checkpoint file ends with an incomplete record (e.g. because the process was killed while writing it), it is truncated to the last complete record.
+
+        Args:
+            ids: The IDs requested in the current run. If provided, the checkpoints are reset if they were written for other IDs or `params` (see the module docstring), and chunks with IDs that are not requested are skipped.
+            params: The parameters of the current run that affect the checkpointed rows (JSON-serializable), e.g. {"markets_format": "bitmap"}.
+
+        Returns:
+            A tuple of the combined results (dictionary of lists of rows) and the set of IDs that have been processed already (including dead letters).
+        """
+        if ids is not None:
+            ids = set(ids)
+            self._start_run(ids, params or {})
+        results = defaultdict(list)
+        processed_ids = self.dead_letter_ids()
+        if ids is not None:
+            processed_ids &= ids
+        if not os.path.exists(self.chunks_path):
+            return results, processed_ids
+
+        valid_size = 0
+        with open(self.chunks_path, "rb") as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception:
+                    print(
+                        f"Warning: ignoring incomplete chunk at the end of '{self.chunks_path}'"
+                    )
+                    break
+                valid_size = f.tell()
+                if ids is not None and not ids.issuperset(record["ids"]):
+                    continue
+                processed_ids.update(record["ids"])
+                for name, rows in record["results"].items():
+                    results[name].extend(rows)
+
+        if os.path.getsize(self.chunks_path) != valid_size:
+            with open(self.chunks_path, "r+b") as f:
+                f.truncate(valid_size)
+
+        return results, processed_ids
+
+    def save_chunk(self, ids: List[str], results: Dict[str, list]):
+        """
+        Appends the results of a processed chunk to the checkpoint file (and makes sure they are written to disk).
+        """
+        with open(self.chunks_path, "ab") as f:
+            pickle.dump({"ids": list(ids), "results": results}, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add_dead_letter(self, id: str, reason: str):
+        with open(self.dead_letters_path, "a") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "id": id,
+                        "reason": reason,
+                        "timestamp": datetime.utcnow().isoformat() + "Z",
+                    }
+                )
+                + "\n"
+            )
+
+    def dead_letter_ids(self) -> set:
+        if not os.path.exists(self.dead_letters_path):
+            return set()
+        with open(self.dead_letters_path, "r") as f:
+            return set(json.loads(line)["id"] for line in f if line.endswith("\n"))
+
+    def remove_chunks(self):
+        """
+        Removes the checkpointed chunks and the run they belong to (e.g. after all results have been written to their
+        final destination), so that running the fetch again starts from scratch instead of resuming a completed run.
+        The dead letters are kept (until the next run starts).
+        """
+        for path in [self.chunks_path, self.run_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _start_run(self, ids: set, params: dict):
+        run = {
+            "ids_hash": hashlib.sha256("\n".join(sorted(ids)).encode()).hexdigest(),
+            "id_count": len(ids),
+            "params": params,
+        }
+        previous_run = None
+        if os.path.exists(self.run_path):
+            with open(self.run_path, "r") as f:
+                previous_run = json.load(f)
+        if previous_run == run:
+            return
+        has_checkpoints = os.path.exists(self.chunks_path) or os.path.exists(
+            self.dead_letters_path
+        )
+        if has_checkpoints:
+            print(
+                f"Checkpoints in '{self.checkpoint_dir}' belong to another (or a completed) run, starting from scratch"
+            )
+            for path in [self.chunks_path, self.dead_letters_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+        with open(self.run_path + ".tmp", "w") as f:
+            json.dump(run, f)
+        os.replace(self.run_path + ".tmp", self.run_path)
+
+
+def fetch_isolating_rejected_ids(
+    fetch: Callable[[List[str]], list], ids: List[str]
+) -> Tuple[list, Dict[str, str]]:
+    """
+    Fetches data for a chunk of IDs with the given function (e.g. `lambda ids: spotify.albums(ids)["albums"]`).
+
+    The Spotify API rejects a whole request if it contains a single malformed ID (HTTP 400). In that case, every ID is fetched
+    individually, so that only the malformed IDs are lost.
+
+    Returns:
+        A tuple of the results (aligned with `ids`, None for every ID that could not be fetched) and a dictionary with the error messages for rejected IDs.
+    """
+    from spotipy import SpotifyException
+
+    try:
+        return fetch(ids), {}
+    except SpotifyException as e:
+        if e.http_status not in [400, 404]:
+            raise
+        if len(ids) == 1:
+            return [None], {ids[0]: f"Request rejected (HTTP {e.http_status}): {e.msg}"}
+
+    results, errors = [], {}
+    for id in ids:
+        id_results, id_errors = fetch_isolating_rejected_ids(fetch, [id])
+        results.extend(id_results)
+        errors.update(id_errors)
+    return results, errors
@@ -0,0 +1,314 @@
+"""
+Compact representation of the markets tracks or albums are available in.
+
+Instead of storing one ('<id>', 'market') row per available market (which results in tens of millions of rows
+for the charts dataset), the availability of each track/album is stored as a fixed-size bitmap over a dictionary of
+market codes. Bit `i` of a bitmap is set if the track/album is available in the market at position `i` of the dictionary.
+
+On disk, this results in two tables:
+- market_bitmaps.parquet: one row per track/album (ID as index), the bitmap is stored as bytes in the 'markets' column
+- market_codes.parquet: the market dictionary (bit position as index, market code in the 'market' column)
+
+For filtering by a single market (e.g. before fetching lyrics, which are only available for tracks available in the
+market of the requesting IP address), the bitmaps can be inverted into a market index (market_index.parquet): one row per
+market with the sorted list of IDs available in it. Every market is stored in a row group of its own, so the IDs of a
+single market can be read without reading the rest of the file (see `read_market_index`).
+"""
+
+import os
+from itertools import chain
+from typing import Dict, Iterable, List, Tuple, Union
+import numpy as np
+import pandas as pd
+
+MARKETS_FORMATS = ["long", "bitmap"]
+
+
+def validate_markets_format(markets_format: str):
+    if markets_format not in MARKETS_FORMATS:
+        raise ValueError(
+            f"Invalid markets format '{markets_format}'. Must be one of {MARKETS_FORMATS}."
+        )
+
+
+def create_market_bitmaps(
+    ids: List[str],
+    market_lists: List[List[str]],
+    id_col: str,
+    market_codes: List[str] = None,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Creates market bitmaps from the lists of available markets of several tracks or albums.
+
+    Args:
+        ids: The IDs of the tracks/albums.
+        market_lists: For every ID, the list of markets the track/album is available in.
+        id_col: The name of the ID column (e.g. 'track_id' or 'album_id'), used as index name.
+        market_codes: The market dictionary. If not provided, all market codes in `market_lists` are used (sorted alphabetically).
+
+    Returns:
+        A dictionary of DataFrames with the keys 'market_bitmaps' and 'market_codes'.
+    """
+    lengths = np.fromiter((len(m) for m in market_lists), dtype=np.int64)
+    flat_markets = list(chain.from_iterable(market_lists))
+    if market_codes is None:
+        market_codes = sorted(set(flat_markets))
+
+    market_positions = pd.Categorical(flat_markets, categories=market_codes).codes
+    if (market_positions == -1).any():
+        raise ValueError("At least one market is not contained in the market codes")
+
+    available = np.zeros((len(ids), len(market_codes)), dtype=bool)
+    available[np.repeat(np.arange(len(ids)), lengths), market_positions] = True
+
+    return {
+        "market_bitmaps": _create_bitmaps_df(ids, available, id_col),
+        "market_codes": _create_market_codes_df(market_codes),
+    }
+
+
+def market_bitmaps_from_long(
+    markets: pd.DataFrame, ids: Iterable[str] = None, market_codes: List[str] = None
+) -> Dict[str, pd.DataFrame]:
+    """
+    Converts market data in long format (ID as index, 'market' column; i.e. the content of 'markets.parquet') to market bitmaps.
+
+    Args:
+        markets: The market data in long format.
+        ids: All IDs that should be included in the bitmaps. Needed to include tracks/albums without any available market (they don't appear in the long format). Defaults to the unique IDs in `markets`.
+        market_codes: The market dictionary. If not provided, all market codes in `markets` are used (sorted alphabetically).
+
+    Returns:
+        A dictionary of DataFrames with the keys 'market_bitmaps' and 'market_codes'.
+    """
+    id_col = markets.index.name
+    if market_codes is None:
+        market_codes = sorted(markets.market.unique())
+    if ids is None:
+        ids = markets.index.unique()
+    ids = pd.Index(ids, name=id_col)
+
+    id_positions = ids.get_indexer(markets.index)
+    market_positions = pd.Categorical(markets.market, categories=market_codes).codes
+    if (id_positions == -1).any():
+        raise ValueError("At least one ID in the market data is not contained in ids")
+    if (market_positions == -1).any():
+        raise ValueError("At least one market is not contained in the market codes")
+
+    available = np.zeros((len(ids), len(market_codes)), dtype=bool)
+    available[id_positions, market_positions] = True
+
+    return {
+        "market_bitmaps": _create_bitmaps_df(ids, available, id_col),
+        "market_codes": _create_market_codes_df(market_codes),
+    }
+
+
+def market_bitmaps_to_long(
+    market_bitmaps: pd.DataFrame, market_codes: Union[pd.DataFrame, List[str]]
+) -> pd.DataFrame:
+    """
+    Derives the long format (ID as index, one row per available market in the 'market' column) from market bitmaps.
+    """
+    market_codes = _get_market_list(market_codes)
+    available = get_availability_matrix(market_bitmaps, market_codes)
+    id_positions, market_positions = np.nonzero(available)
+    return pd.DataFrame(
+        {"market": np.asarray(market_codes, dtype=object)[market_positions]},
+        index=market_bitmaps.index[id_positions],
+    )
+
+
+def get_availability_matrix(
+    market_bitmaps: pd.DataFrame, market_codes: Union[pd.DataFrame, List[str]]
+) -> np.ndarray:
+    """
+    Unpacks market bitmaps into a boolean matrix of shape (number of IDs, number of markets).
+    """
+    market_count = len(_get_market_list(market_codes))
+    return np.unpackbits(
+        _get_bitmap_matrix(market_bitmaps, market_count),
+        axis=1,
+        count=market_count,
+        bitorder="little",
+    ).astype(bool)
+
+
+def is_available_in_market(
+    market_bitmaps: pd.DataFrame,
+    market_codes: Union[pd.DataFrame, List[str]],
+    market: str,
+) -> pd.Series:
+    """
+    Returns a boolean Series (indexed like `market_bitmaps`) that is True for every track/album available in the given market.
+    """
+    market_codes = _get_market_list(market_codes)
+    if market not in market_codes:
+        return pd.Series(False, index=market_bitmaps.index)
+    pos = market_codes.index(market)
+    bitmaps = _get_bitmap_matrix(market_bitmaps, len(market_codes))
+    available = (bitmaps[:, pos // 8] >> (pos % 8)) & 1
+    return pd.Series(available.astype(bool), index=market_bitmaps.index)
+
+
+def filter_by_markets(
+    market_bitmaps: pd.DataFrame,
+    market_codes: Union[pd.DataFrame, List[str]],
+    markets: List[str],
+    require_all: bool = False,
+) -> pd.Index:
+    """
+    Returns the IDs of all tracks/albums available in any (or all, if `require_all` is True) of the given markets.
+    """
+    market_codes = _get_market_list(market_codes)
+    mask = np.zeros(len(market_codes), dtype=bool)
+    for market in markets:
+        if market in market_codes:
+            mask[market_codes.index(market)] = True
+        elif require_all:
+            return market_bitmaps.index[:0]
+    query = np.packbits(mask, bitorder="little")
+
+    matches = _get_bitmap_matrix(market_bitmaps, len(market_codes)) & query
+    if require_all:
+        selected = (matches == query).all(axis=1)
+    else:
+        selected = matches.any(axis=1)
+    return market_bitmaps.index[selected]
+
+
+def count_available_markets(
+    market_bitmaps: pd.DataFrame, market_codes: Union[pd.DataFrame, List[str]]
+) -> pd.Series:
+    """
+    Returns the number of markets every track/album is available in.
+    """
+    counts = get_availability_matrix(market_bitmaps, market_codes).sum(axis=1)
+    return pd.Series(counts, index=market_bitmaps.index, name="market_count")
+
+
+def create_market_index(
+    market_bitmaps: pd.DataFrame, market_codes: Union[pd.DataFrame, List[str]]
+) -> pd.DataFrame:
+    """
+    Inverts market bitmaps into a market index: one row per market (market code as index) with the sorted IDs of all
+    tracks/albums available in it (as a list in the 'ids' column).
+    """
+    market_codes = _get_market_list(market_codes)
+    available = get_availability_matrix(market_bitmaps, market_codes)
+    ids = market_bitmaps.index.to_numpy(dtype=object)
+    order = np.argsort(ids, kind="stable")
+    sorted_ids, sorted_available = ids[order], available[order]
+    return pd.DataFrame(
+        {
+            "ids": [
+                sorted_ids[sorted_available[:, i]].tolist()
+                for i in range(len(market_codes))
+            ]
+        },
+        index=pd.Index(market_codes, name="market"),
+    )
+
+
+def write_market_index(market_index: pd.DataFrame, path: str):
+    """
+    Writes a market index (see `create_market_index`) to a Parquet file, with one row group per market.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(market_index.sort_index(), preserve_index=True)
+    pq.write_table(table, path, row_group_size=1)
+
+
+def read_market_index(path: str, market: str) -> List[str]:
+    """
+    Returns the (sorted) IDs of all tracks/albums available in the given market from a market index file (see `write_market_index`).
+    Only the row group of the market is read (the others are skipped based on their statistics).
+    """
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, columns=["ids"], filters=[("market", "==", market)])
+    if table.num_rows == 0:
+        return []
+    return table.column("ids")[0].as_py()
+
+
+def get_markets_file_format(path: str) -> str:
+    """
+    Detects the format of a Parquet file with market data from its schema (independent of the file name):
+    - "index": a market index (see `write_market_index`), with a list column 'ids'
+    - "bitmap": market bitmaps (market_bitmaps.parquet), with a binary column 'markets'
+    - "long": the long format (markets.parquet), with a 'market' column
+
+    Raises:
+        ValueError: If the file is not a Parquet file or has none of these formats.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    try:
+        schema = pq.read_schema(path)
+    except pa.ArrowInvalid:
+        raise ValueError(f"Markets file '{path}' is not a .parquet file")
+    if "ids" in schema.names and pa.types.is_list(schema.field("ids").type):
+        return "index"
+    if "markets" in schema.names and pa.types.is_binary(schema.field("markets").type):
+        return "bitmap"
+    if "market" in schema.names:
+        return "long"
+    raise ValueError(
+        f"Markets file '{path}' has none of the known formats: a list column 'ids' (market index), a binary column 'markets' (market bitmaps) or a 'market' column (long format)"
+    )
+
+
+def read_market_bitmaps(path: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Reads market bitmaps (e.g. market_bitmaps.parquet) together with the market codes the bits refer to, which are read
+    from market_codes.parquet in the same directory.
+
+    Returns:
+        A tuple of the market bitmaps and the market codes.
+    """
+    market_codes_path = os.path.join(os.path.dirname(path), "market_codes.parquet")
+    if not os.path.exists(market_codes_path):
+        raise ValueError(
+            f"Market bitmaps '{path}' require the market codes in '{market_codes_path}'"
+        )
+    return pd.read_parquet(path), pd.read_parquet(market_codes_path)
+
+
+def _create_bitmaps_df(ids: Iterable[str], available: np.ndarray, id_col: str):
+    packed = np.packbits(available, axis=1, bitorder="little")
+    df = pd.DataFrame(
+        {"markets": [row.tobytes() for row in packed]},
+        index=pd.Index(ids, name=id_col),
+    )
+    return df
+
+
+def _create_market_codes_df(market_codes: List[str]):
+    return pd.DataFrame(
+        {"market": list(market_codes)},
+        index=pd.RangeIndex(len(market_codes), name="bit"),
+    )
+
+
+def _get_market_list(market_codes: Union[pd.DataFrame, List[str]]) -> List[str]:
+    if isinstance(market_codes, pd.DataFrame):
+        return market_codes.sort_index()["market"].tolist()
+    return list(market_codes)
+
+
+def _get_bitmap_matrix(market_bitmaps: pd.DataFrame, market_count: int) -> np.ndarray:
+    """
+    Returns the bitmaps as a uint8 matrix of shape (number of IDs, number of bytes per bitmap).
+    """
+    bitmaps = market_bitmaps["markets"].values
+    width = (market_count + 7) // 8
+    if len(bitmaps) == 0:
+        return np.zeros((0, width), dtype=np.uint8)
+    buffer = b"".join(bitmaps)
+    if len(buffer) != width * len(bitmaps):
+        raise ValueError("All market bitmaps must have the same size")
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(len(bitmaps), width)
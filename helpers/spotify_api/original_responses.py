@@ -0,0 +1,126 @@
+"""
+Append-only log for the original (raw) responses of the Spotify API.
+
+The original responses are written to a gzip-compressed JSONL file as soon as they arrive, so they never have to be
+held in memory. Every line contains the response of a single API call together with some provenance information:
+- source: the data source (including spotipy version and client method name)
+- client_method_name: the spotipy client method that was called
+- requested_ids: the IDs that were passed to the client method
+- timestamp: when the response was received (ISO format, UTC)
+- content: the original API response
+
+Every fetch starts a new log. When an interrupted fetch is resumed from its checkpoints (see
+`helpers.spotify_api.checkpoints`), the log is rewritten first: only the complete entries for chunks that were
+checkpointed are kept. This drops the unfinished gzip member left by a killed process (appending after it would make
+everything written later unreadable), and the responses of the interrupted chunk, which are fetched again.
+"""
+
+import gzip
+import json
+import os
+import zlib
+from contextlib import nullcontext
+from typing import Iterable, Iterator, List
+import pandas as pd
+from helpers.spotify_util import create_spotipy_data_provenance_info_dict
+
+
+class OriginalResponsesLog:
+    """
+    Appends original API responses (with provenance information) to a gzip-compressed JSONL file.
+
+    Can be used as a context manager.
+    """
+
+    def __init__(self, path: str, resumed_ids: Iterable[str] = None):
+        """
+        Args:
+            path: Path to the log file (usually ending with '.jsonl.gz'). An existing file is replaced, unless `resumed_ids` is provided.
+            resumed_ids: The IDs that have been processed already when resuming an interrupted fetch. The entries of an existing log whose requested IDs are all in `resumed_ids` are kept and new responses are appended after them.
+        """
+        self.path = path
+        if resumed_ids is not None and os.path.exists(path):
+            _rewrite_resumed_entries(path, set(resumed_ids))
+            self.file = gzip.open(path, "at", encoding="utf-8")
+        else:
+            self.file = gzip.open(path, "wt", encoding="utf-8")
+
+    def append(self, response, client_method_name: str, requested_ids: List[str]):
+        """
+        Writes a single API response to the log.
+        """
+        entry = create_spotipy_data_provenance_info_dict(
+            response=response, client_method_name=client_method_name
+        )
+        entry["client_method_name"] = client_method_name
+        entry["requested_ids"] = list(requested_ids)
+        entry["timestamp"] = entry["timestamp"].isoformat() + "Z"
+        self.file.write(json.dumps(entry) + "\n")
+        # make sure everything written so far can be decompressed, even if the process is killed
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_original_responses(path: str) -> Iterator[dict]:
+    """
+    Yields the entries of an original responses log one by one.
+
+    If the log file is truncated (e.g. because the process writing it was killed), reading stops at the last complete entry.
+    """
+    for line in _read_complete_lines(path):
+        yield json.loads(line)
+
+
+def _read_complete_lines(path: str) -> Iterator[str]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                yield line
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            print(
+                f"Warning: '{path}' is truncated, ignoring everything after the last complete entry"
+            )
+
+
+def _rewrite_resumed_entries(path: str, resumed_ids: set):
+    """
+    Rewrites a log with its complete entries for the given IDs (into a single, complete gzip member).
+    """
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for line in _read_complete_lines(path):
+            if resumed_ids.issuperset(json.loads(line)["requested_ids"]):
+                f.write(line)
+    os.replace(tmp_path, path)
+
+
+def load_original_responses(path: str) -> pd.DataFrame:
+    """
+    Loads an original responses log into a DataFrame (one row per API call).
+
+    Note that this loads all responses into memory - use `read_original_responses` to iterate over large logs.
+    """
+    df = pd.DataFrame(read_original_responses(path))
+    if not df.empty:
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df
+
+
+def open_original_responses_log(path: str = None, resumed_ids: Iterable[str] = None):
+    """
+    Returns an `OriginalResponsesLog` writing to the given path (see `OriginalResponsesLog` for `resumed_ids`).
+    If no path is provided, a context manager yielding None is returned instead (i.e. responses are not logged to disk).
+    """
+    if path is None:
+        return nullcontext()
+    return OriginalResponsesLog(path, resumed_ids=resumed_ids)
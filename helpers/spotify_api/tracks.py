@@ -1,14 +1,41 @@
 import pandas as pd
 from tqdm import tqdm
-import spotipy
-from typing import List
+from typing import List, TYPE_CHECKING
 from helpers.util import split_into_chunks_of_size
 from helpers.spotify_util import create_spotipy_data_provenance_info_dict
+from .original_responses import open_original_responses_log
+from .checkpoints import ChunkCheckpoints, fetch_isolating_rejected_ids
+from .markets import create_market_bitmaps, validate_markets_format
 
+if TYPE_CHECKING:
+    import spotipy
 
-def get_track_metadata_from_api(track_ids: List[str], spotify: spotipy.Spotify):
+
+def get_track_metadata_from_api(
+    track_ids: List[str],
+    spotify: "spotipy.Spotify",
+    markets_format: str = "long",
+    original_responses_path: str = None,
+    checkpoint_dir: str = None,
+):
+    """
+    Fetches track metadata from the Spotify API.
+
+    Args:
+        track_ids: A list of track IDs.
+        spotify: A spotipy Spotify client.
+        markets_format: How to store the available markets of each track. Either "long" (one row per track and market in the "markets" DataFrame) or "bitmap" (one bitmap per track in the "market_bitmaps" DataFrame, together with the "market_codes" DataFrame, see `helpers.spotify_api.markets`).
+        original_responses_path: If provided, the original API responses are streamed to a gzip-compressed JSONL file at this path as they arrive (replacing an existing file, unless a fetch is resumed from checkpoints, see `helpers.spotify_api.original_responses`) instead of being returned in the "original_responses" DataFrame.
+        checkpoint_dir: If provided, fetching runs in fault-isolation mode: IDs for which no data can be fetched are written to a dead letter file instead of raising an error, the results of every chunk are checkpointed and a previously interrupted fetch is resumed from the last checkpoint (see `helpers.spotify_api.checkpoints`). Should be combined with `original_responses_path`, as original responses kept in memory are not checkpointed.
+
+    Returns:
+        A dictionary of DataFrames.
+    """
+    validate_markets_format(markets_format)
     artists = []  # tuples of shape ('track_id', 'artist_id', 'pos')
-    markets = []  # tuples of shape ('track_id', 'market')
+    markets = (
+        []
+    )  # tuples of shape ('track_id', 'market') or ('track_id', [markets]), depending on markets_format
     metadata = (
         []
     )  # list of dictionaries for all remaining track metadata (excluding artists and markets)
@@ -16,39 +43,107 @@ def get_track_metadata_from_api(track_ids: List[str], spotify: spotipy.Spotify):
         []
     )  # list of original API responses, with added 'timestamp' and 'source' fields
 
+    rows = {
+        "artists": artists,
+        "markets": markets,
+        "metadata": metadata,
+    }  # all results that are checkpointed after every chunk
+
+    checkpoints = None
+    resumed_ids = None  # the original responses log is only continued when resuming
+    if checkpoint_dir is not None:
+        checkpoints = ChunkCheckpoints(checkpoint_dir)
+        checkpointed_rows, processed_ids = checkpoints.load(
+            track_ids, {"markets_format": markets_format}
+        )
+        if len(processed_ids) > 0:
+            print(
+                f"Resuming from checkpoint in '{checkpoint_dir}' ({len(processed_ids)} track IDs already processed)"
+            )
+            resumed_ids = processed_ids
+        for name, chunk_rows in checkpointed_rows.items():
+            rows[name].extend(chunk_rows)
+        track_ids = [id for id in track_ids if id not in processed_ids]
+
     chunk_size = 50
     track_ids_chunks = split_into_chunks_of_size(track_ids, chunk_size)
     print(f"Fetching data in {len(track_ids_chunks)} chunks of size {chunk_size}...")
 
-    with tqdm(total=len(track_ids_chunks)) as pbar:
+    with open_original_responses_log(
+        original_responses_path, resumed_ids
+    ) as responses_log, tqdm(total=len(track_ids_chunks)) as pbar:
         for track_ids in track_ids_chunks:
-            api_resp = spotify.tracks(track_ids)["tracks"]
-            original_responses.append(
-                create_spotipy_data_provenance_info_dict(
-                    response=api_resp, client_method_name="tracks"
+            if checkpoints is not None:
+                api_resp, errors = fetch_isolating_rejected_ids(
+                    lambda ids: spotify.tracks(ids)["tracks"], track_ids
                 )
-            )
-            for track_data in api_resp:
+                row_counts = {name: len(r) for name, r in rows.items()}
+            else:
+                api_resp = spotify.tracks(track_ids)["tracks"]
+            if responses_log is not None:
+                responses_log.append(
+                    response=api_resp,
+                    client_method_name="tracks",
+                    requested_ids=track_ids,
+                )
+            else:
+                original_responses.append(
+                    create_spotipy_data_provenance_info_dict(
+                        response=api_resp, client_method_name="tracks"
+                    )
+                )
+            for requested_id, track_data in zip(track_ids, api_resp):
+                if track_data is None:
+                    if checkpoints is None:
+                        raise ValueError(
+                            'Received "None" as response from spotipy. You probably provided one or more invalid track IDs.'
+                        )
+                    checkpoints.add_dead_letter(
+                        requested_id,
+                        errors.get(requested_id, "No data returned by the API"),
+                    )
+                    continue
                 track_id = track_data["id"]
                 artists.extend(_process_artists(track_id, track_data["artists"]))
-                markets.extend(
-                    _process_markets(track_id, track_data["available_markets"])
-                )
+                if markets_format == "bitmap":
+                    markets.append((track_id, track_data["available_markets"]))
+                else:
+                    markets.extend(
+                        _process_markets(track_id, track_data["available_markets"])
+                    )
                 metadata.append(_process_remaining_data(track_data))
+            if checkpoints is not None:
+                checkpoints.save_chunk(
+                    track_ids,
+                    {name: r[row_counts[name] :] for name, r in rows.items()},
+                )
             pbar.update(1)
 
     df_dict = {}
 
-    df_dict["metadata"] = pd.DataFrame(metadata)
+    # the ID column is needed for the index, even if no data could be fetched for any ID (all IDs are dead letters)
+    df_dict["metadata"] = pd.DataFrame(
+        metadata, columns=None if metadata else ["track_id"]
+    )
     df_dict["metadata"].set_index("track_id", inplace=True)
 
     df_dict["artists"] = pd.DataFrame(artists, columns=["track_id", "artist_id", "pos"])
     df_dict["artists"].set_index("track_id", inplace=True)
 
-    df_dict["markets"] = pd.DataFrame(markets, columns=["track_id", "market"])
-    df_dict["markets"].set_index("track_id", inplace=True)
+    if markets_format == "bitmap":
+        df_dict.update(
+            create_market_bitmaps(
+                ids=[t[0] for t in markets],
+                market_lists=[t[1] for t in markets],
+                id_col="track_id",
+            )
+        )
+    else:
+        df_dict["markets"] = pd.DataFrame(markets, columns=["track_id", "market"])
+        df_dict["markets"].set_index("track_id", inplace=True)
 
-    df_dict["original_responses"] = pd.DataFrame(original_responses)
+    if responses_log is None:
+        df_dict["original_responses"] = pd.DataFrame(original_responses)
 
     return df_dict
 
@@ -0,0 +1,96 @@
+"""
+Building blocks for spotipy clients that can be shared (and reused) by many threads and processes:
+- a token cache that keeps the access token in memory and shares it with other processes via a file on disk
+- a requests session with a configurable pool of keep-alive connections
+
+Use `create_spotipy_client` or `get_shared_spotipy_client` from `helpers.spotify_util` instead of using this module directly.
+"""
+
+import json
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from spotipy import Spotify
+from spotipy.cache_handler import CacheHandler
+
+# spotipy also considers tokens expiring in less than 60 seconds as expired
+TOKEN_EXPIRY_MARGIN_SECONDS = 60
+
+
+class SharedTokenCacheHandler(CacheHandler):
+    """
+    spotipy cache handler storing the access token in a JSON file that can be shared by several processes.
+
+    The token is also kept in memory, so the file is only read again once the token in memory has expired
+    (spotipy asks the cache handler for the token before every API request). Writes are atomic (temporary file + rename),
+    so other processes never read a partially written token.
+    """
+
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        self._token_info = None
+        self._lock = threading.Lock()
+
+    def get_cached_token(self):
+        with self._lock:
+            if self._token_info is None or _is_token_expired(self._token_info):
+                token_info = self._read_token_file()
+                if token_info is not None:
+                    self._token_info = token_info
+            return self._token_info
+
+    def save_token_to_cache(self, token_info: dict):
+        with self._lock:
+            self._token_info = token_info
+            tmp_path = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                # the token grants access to the API, so only the user may read it
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w") as f:
+                    json.dump(token_info, f)
+                os.replace(tmp_path, self.cache_path)
+            except OSError as e:
+                print(f"Warning: could not write Spotify token cache: {e}")
+
+    def _read_token_file(self):
+        try:
+            with open(self.cache_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def create_pooled_session(
+    pool_size: int = 10,
+    retries: int = 3,
+    backoff_factor: float = 0.3,
+):
+    """
+    Creates a requests session with a pool of (up to) `pool_size` keep-alive connections per host.
+
+    The retry behavior is the same as for the sessions created by spotipy itself (which does not allow configuring the connection pool).
+    The pool size should be at least the number of threads sharing the session, otherwise connections are discarded and reopened.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=Spotify.default_retry_codes,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _is_token_expired(token_info: dict):
+    return token_info["expires_at"] - time.time() < TOKEN_EXPIRY_MARGIN_SECONDS
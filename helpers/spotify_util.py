@@ -1,21 +1,47 @@
-from spotipy.oauth2 import SpotifyClientCredentials
-from spotipy import Spotify
 import os
-import inquirer
-from dotenv import load_dotenv
-import spotipy
+import threading
 from datetime import datetime
-import subprocess
+from functools import lru_cache
+from importlib.metadata import version
+
+# spotipy, inquirer and dotenv are imported inside the functions that need them to keep importing this module (and everything depending on it) cheap
 
 client_id, client_secret = None, None
 
+# spotipy clients shared by all threads of a process, see get_shared_spotipy_client()
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def _reset_shared_clients_lock():
+    # the lock might have been held by another thread while forking, which would result in a deadlock in the child process
+    global _shared_clients_lock
+    _shared_clients_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_shared_clients_lock)
+
 
-def create_spotipy_client():
+def create_spotipy_client(
+    pool_size: int = 10, cache_token: bool = True, token_cache_path: str = None
+):
     """
     Creates a spotipy client with the credentials provided in the .env file.
     If the credentials are not provided in the .env file, the user will be prompted to enter them manually.
+
+    Args:
+        pool_size: The maximum number of keep-alive connections the client keeps open (should be at least the number of threads using the client).
+        cache_token: Whether access tokens should be cached on disk, so that they can be reused by other clients (also in other processes or later runs) until they expire.
+        token_cache_path: Path to the token cache file. Defaults to a file in the user's cache directory (one per client ID, see `get_default_token_cache_path`).
     """
 
+    import inquirer
+    from dotenv import load_dotenv
+    from spotipy import Spotify
+    from spotipy.oauth2 import SpotifyClientCredentials
+    from helpers.spotify_client import SharedTokenCacheHandler, create_pooled_session
+
     global client_id, client_secret
     questions = []
     env_path = os.path.join(os.path.dirname(__file__), ".env")
@@ -39,31 +65,76 @@ def create_spotipy_client():
         answers = inquirer.prompt(questions)
         client_id = answers.get("client_id", client_id)
         client_secret = answers.get("client_secret", client_secret)
+        # make manually entered credentials available to (worker) processes started from this process
+        os.environ["SPOTIPY_CLIENT_ID"] = client_id
+        os.environ["SPOTIPY_CLIENT_SECRET"] = client_secret
+
+    cache_handler = None
+    if cache_token:
+        if token_cache_path is None:
+            token_cache_path = get_default_token_cache_path(client_id)
+        cache_handler = SharedTokenCacheHandler(token_cache_path)
 
     return Spotify(
-        client_credentials_manager=SpotifyClientCredentials(client_id, client_secret)
+        client_credentials_manager=SpotifyClientCredentials(
+            client_id, client_secret, cache_handler=cache_handler
+        ),
+        requests_session=create_pooled_session(pool_size=pool_size),
+    )
+
+
+def get_default_token_cache_path(client_id: str):
+    """
+    Returns the default path of the access token cache for the given client ID, in the user's cache directory
+    ($XDG_CACHE_HOME or ~/.cache). The directory is created (only accessible by the user) if it doesn't exist yet.
+    """
+    cache_dir = os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "spotify_helpers",
     )
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    return os.path.join(cache_dir, f"token_cache_{client_id}.json")
+
+
+def get_shared_spotipy_client(**kwargs):
+    """
+    Returns a spotipy client that is shared by all threads of the current process (created with `create_spotipy_client` on first use).
+
+    Safe to call from thread pools (all threads reuse the same connection pool and access token) and process pools
+    (every process gets its own client, as connections must not be shared across processes, but the access token is shared via the token cache file).
+
+    Args:
+        kwargs: passed to `create_spotipy_client` (clients created with different arguments are not shared).
+    """
+    key = (os.getpid(), tuple(sorted(kwargs.items())))
+    with _shared_clients_lock:
+        if key not in _shared_clients:
+            _shared_clients[key] = create_spotipy_client(**kwargs)
+        return _shared_clients[key]
 
 
 def create_spotipy_data_provenance_info_dict(response: dict, client_method_name: str):
     return {
-        "source": f"Spotify API (spotipy v{SPOTIFY_VERSION}, client method: '{client_method_name}')",
+        "source": f"Spotify API (spotipy v{get_spotipy_version()}, client method: '{client_method_name}')",
         "content": response,
         "timestamp": datetime.utcnow(),
     }
 
 
+@lru_cache(maxsize=None)
 def get_spotipy_version():
-    # https://stackoverflow.com/a/7353141/13727176
-    p1 = subprocess.Popen(["pip", "show", "spotipy"], stdout=subprocess.PIPE)
-    p2 = subprocess.Popen(["grep", "Version"], stdin=p1.stdout, stdout=subprocess.PIPE)
-    p1.stdout.close()  # Allow p1 to receive a SIGPIPE if p2 exits.
-    output, err = p2.communicate()
-    version_str = output.decode("utf-8").split("Version: ")[-1].strip()
-    return version_str
+    """
+    Returns the version of the installed spotipy package (read from the package metadata, without importing spotipy).
+    The result is cached, so only the first call does any work.
+    """
+    return version("spotipy")
 
 
-SPOTIFY_VERSION = get_spotipy_version()
+def __getattr__(name: str):
+    # SPOTIFY_VERSION used to be computed eagerly at import time (which took about a second); now it is only computed on first access
+    if name == "SPOTIFY_VERSION":
+        return get_spotipy_version()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
 
 def get_spotify_track_link(id: str):
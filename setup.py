@@ -19,6 +19,8 @@ setup(
         "inquirer",
         "spotipy",
         "aiohttp",
+        # for compressing the responses of internal Spotify APIs (optional)
+        "zstandard",
         "pytest",
         # for connecting to ClickHouse
         "clickhouse_connect",
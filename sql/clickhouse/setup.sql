@@ -10,6 +10,7 @@ CREATE TABLE IF NOT EXISTS top200 (
   `streams` UInt32,
   `date` Date
 ) ENGINE = MergeTree() -- The primary key is also the sorting key, so the data is sorted by date, region_code, track_id
+PARTITION BY toYYYYMM(date) -- one partition per month, replaced as a whole when (re)loading data (see cli_scripts/db/clickhouse_load.py)
 PRIMARY KEY (date, region_code, track_id);
 
 -- TODO: add other tables
\ No newline at end of file
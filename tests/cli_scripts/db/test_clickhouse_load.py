@@ -0,0 +1,110 @@
+from cli_scripts.db.clickhouse_load import (
+    TOP200_SCHEMA,
+    convert_batch,
+    get_month_filter,
+    get_months,
+    load_partition,
+)
+import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pytest
+
+
+@pytest.fixture
+def charts_path(tmp_path):
+    # same dtypes as the output of cli_scripts/spotify_charts/combine.py
+    charts = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2023-01-31", "2023-02-01", "2023-02-28"]),
+            "region_code": pd.Categorical(["AT", "WW", "AT"]),
+            "track_id": ["6mICuAdrwEjh6Y6lroV2Kg"] * 3,
+            "pos": pd.Series([1, 2, 200], dtype="uint8"),
+            "streams": pd.Series([253019, 223988, 1000], dtype="uint64"),
+            "artist_names": ["Shakira, Maluma"] * 3,
+        }
+    )
+    path = tmp_path / "charts.parquet"
+    charts.to_parquet(path)
+    return str(path)
+
+
+def test_get_months(charts_path):
+    dataset = ds.dataset(charts_path, format="parquet")
+    assert get_months(dataset) == [datetime.date(2023, 1, 1), datetime.date(2023, 2, 1)]
+
+
+def test_convert_month(charts_path):
+    dataset = ds.dataset(charts_path, format="parquet")
+    table = dataset.to_table(
+        columns=TOP200_SCHEMA.names,
+        filter=get_month_filter(
+            datetime.date(2023, 2, 1), dataset.schema.field("date").type
+        ),
+    )
+    converted = convert_batch(table.combine_chunks().to_batches()[0])
+    assert converted.schema == TOP200_SCHEMA
+    assert converted.to_pylist() == [
+        {
+            "track_id": b"6mICuAdrwEjh6Y6lroV2Kg",
+            "region_code": b"WW",
+            "pos": 2,
+            "streams": 223988,
+            "date": datetime.date(2023, 2, 1),
+        },
+        {
+            "track_id": b"6mICuAdrwEjh6Y6lroV2Kg",
+            "region_code": b"AT",
+            "pos": 200,
+            "streams": 1000,
+            "date": datetime.date(2023, 2, 28),
+        },
+    ]
+
+
+def test_convert_batch_rejects_invalid_values():
+    batch = pa.RecordBatch.from_pydict(
+        {
+            "track_id": ["tooshort"],
+            "region_code": ["AT"],
+            "pos": [1],
+            "streams": [1],
+            "date": [datetime.date(2023, 1, 1)],
+        }
+    )
+    with pytest.raises(pa.ArrowInvalid):
+        convert_batch(batch)
+
+
+class RecordingClient:
+    def __init__(self):
+        self.commands = []
+        self.inserted_row_count = 0
+
+    def command(self, command: str):
+        self.commands.append(command)
+
+    def insert_arrow(self, table: str, data: pa.Table):
+        self.inserted_row_count += data.num_rows
+
+    def close(self):
+        pass
+
+
+def test_load_partition_uses_unique_staging_tables(charts_path):
+    dataset = ds.dataset(charts_path, format="parquet")
+    clients = [RecordingClient(), RecordingClient()]
+    for client in clients:
+        row_count = load_partition(
+            lambda: client, dataset, "top200", datetime.date(2023, 2, 1), 1000
+        )
+        assert row_count == client.inserted_row_count == 2
+        assert client.commands[-2].startswith(
+            "ALTER TABLE top200 REPLACE PARTITION 202302 FROM top200_staging_202302_"
+        )
+
+    staging_tables = [client.commands[0].split()[2] for client in clients]
+    assert staging_tables[0] != staging_tables[1]
+    for client, staging_table in zip(clients, staging_tables):
+        assert client.commands[-1] == f"DROP TABLE IF EXISTS {staging_table}"
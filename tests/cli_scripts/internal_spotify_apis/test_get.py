@@ -1,5 +1,8 @@
+import asyncio
+import json
 import cli_scripts.internal_spotify_apis.get as get
 import pandas as pd
+import pytest
 
 
 def test_get_error_ids_to_skip():
@@ -11,3 +14,166 @@ def test_get_error_ids_to_skip():
     assert get.get_error_ids_to_skip(
         error_log_df=df, status_codes_to_skip=set([404, 403])
     ) == set(["a", "b"])
+
+
+def test_prioritize_track_ids(tmp_path):
+    priority_path = str(tmp_path / "track_ranking.parquet")
+    pd.DataFrame({"track_id": ["c", "x", "a", "b"], "rank": [2, 1, 3, 4]}).to_parquet(
+        priority_path
+    )
+
+    assert get.prioritize_track_ids({"a", "b", "c", "e", "d"}, priority_path) == [
+        "c",
+        "a",
+        "b",
+        # not ranked
+        "d",
+        "e",
+    ]
+
+
+def test_get_track_ids_for_market_renamed_index(tmp_path):
+    from helpers.spotify_api.markets import create_market_bitmaps, create_market_index
+    from helpers.spotify_api.markets import write_market_index
+
+    dfs = create_market_bitmaps(
+        ids=["a", "b"], market_lists=[["AT"], ["AT", "DE"]], id_col="track_id"
+    )
+    # a copied market index is detected by its columns, not by its name
+    path = str(tmp_path / "market_index_2024.parquet")
+    write_market_index(
+        create_market_index(dfs["market_bitmaps"], dfs["market_codes"]), path
+    )
+    assert get.get_track_ids_for_market(path, "DE") == {"b"}
+
+    # market bitmaps without market codes
+    dfs["market_bitmaps"].to_parquet(tmp_path / "bitmaps.parquet")
+    with pytest.raises(ValueError, match="market_codes.parquet"):
+        get.get_track_ids_for_market(str(tmp_path / "bitmaps.parquet"), "AT")
+
+
+@pytest.mark.parametrize(
+    "path, storage, compression, expected",
+    [
+        (
+            "out/lyrics",
+            "parquet",
+            "none",
+            ("out/lyrics.parquet", "out/lyrics_errors.parquet"),
+        ),
+        (
+            "out/lyrics.parquet",
+            "parquet",
+            "none",
+            ("out/lyrics.parquet", "out/lyrics_errors.parquet"),
+        ),
+        ("lyrics", "jsonl", "none", ("lyrics.jsonl", "lyrics_errors.jsonl")),
+        (
+            "lyrics.jsonl",
+            "jsonl",
+            "zstd",
+            ("lyrics.jsonl.zst", "lyrics_errors.jsonl.zst"),
+        ),
+        (
+            "lyrics.jsonl.zst",
+            "jsonl",
+            "none",
+            ("lyrics.jsonl.zst", "lyrics_errors.jsonl.zst"),
+        ),
+        # only the extension at the end is replaced
+        (
+            "a.jsonl/lyrics.jsonl",
+            "jsonl",
+            "none",
+            ("a.jsonl/lyrics.jsonl", "a.jsonl/lyrics_errors.jsonl"),
+        ),
+    ],
+)
+def test_get_output_paths(path, storage, compression, expected):
+    output_path, error_log_path = get.get_output_paths(path, storage, compression)
+    assert (output_path, error_log_path) == expected
+    assert get.get_storage(output_path) == storage
+
+
+class ListWriter(list):
+    def write(self, record: dict):
+        self.append(record)
+
+
+def test_process_response_dict():
+    output, error_log = ListWriter(), ListWriter()
+    for result in [
+        {"track_id": "a", "status_code": 200, "content": {"x": 1}},
+        {"track_id": "b", "status_code": 200, "content": {"error": "x"}},
+        {"track_id": "c", "status_code": 404, "content": "not found"},
+    ]:
+        get.process_response_dict(result=result, output=output, error_log=error_log)
+    assert [r["track_id"] for r in output] == ["a"]
+    assert [r["track_id"] for r in error_log] == ["b", "c"]
+
+    # endpoint-specific validator and post-processor
+    output, error_log = ListWriter(), ListWriter()
+    get.process_response_dict(
+        result={"track_id": "d", "status_code": 200, "content": {"error": "x"}},
+        output=output,
+        error_log=error_log,
+        validator=lambda result: result["status_code"] == 200,
+        post_processor=lambda result: {**result, "content": None},
+    )
+    assert output == [{"track_id": "d", "status_code": 200, "content": None}]
+    assert error_log == []
+
+
+def test_get_data_for_endpoints(tmp_path, stand_in_api):
+    from helpers.internal_spotify_apis.headers import HeadersLease, HeadersPool
+    from helpers.internal_spotify_apis.storage import read_status_codes
+
+    track_ids = {f"track{i}" for i in range(50)} | {"missing"}
+
+    async def run():
+        async with stand_in_api(max_concurrency=20) as api:
+            fetches = []
+            for resource in ["credits", "lyrics"]:
+                endpoint = {
+                    **get.internal_api_endpoints[resource],
+                    "url_getter": api.url_getter(resource),
+                }
+                headers_pool = HeadersPool(
+                    [
+                        HeadersLease(
+                            get_headers=lambda: {"authorization": "Bearer valid"},
+                            initial_headers={"authorization": "Bearer valid"},
+                        )
+                    ]
+                )
+                fetches.append(
+                    {
+                        "endpoint": endpoint,
+                        "output_path": str(tmp_path / f"{resource}.jsonl"),
+                        "error_log_path": str(tmp_path / f"{resource}_errors.jsonl"),
+                        "track_ids": track_ids,
+                        "headers_pool": headers_pool,
+                        "parallel_requests": 5,
+                        "requests_per_second": 0,
+                    }
+                )
+            results = await get.get_data_for_endpoints(
+                fetches, telemetry_path=str(tmp_path / "telemetry.jsonl")
+            )
+            return results, api.max_in_flight
+
+    results, max_in_flight = asyncio.run(run())
+    assert results == {"credits": {200: 50, 404: 1}, "lyrics": {200: 50, 404: 1}}
+    # the requests to both endpoints were in flight at the same time
+    assert max_in_flight > 5
+    with open(tmp_path / "telemetry.jsonl") as f:
+        snapshots = {s["endpoint"]: s for s in map(json.loads, f)}
+    assert snapshots["lyrics"]["status_code_counts"] == {"200": 50, "404": 1}
+    assert snapshots["lyrics"]["latency"]["p50"] > 0
+    for resource in ["credits", "lyrics"]:
+        output_path = str(tmp_path / f"{resource}.jsonl")
+        error_log_path = str(tmp_path / f"{resource}_errors.jsonl")
+        assert len(read_status_codes(output_path)) == 50
+        assert (
+            get.get_remaining_track_ids(track_ids, output_path, error_log_path) == set()
+        )
@@ -0,0 +1,41 @@
+from cli_scripts.spotify_charts.rank_tracks import create_track_ranking
+import pandas as pd
+import pytest
+
+charts = pd.DataFrame(
+    [
+        ("2023-01-01", "a", 1, 1000),
+        ("2023-01-02", "a", 3, 800),
+        ("2023-01-01", "b", 2, 900),
+        ("2023-01-03", "b", 5, 500),
+        ("2023-01-03", "c", 4, 1400),
+        ("2023-01-02", "d", 1, 1300),
+    ],
+    columns=["date", "track_id", "pos", "streams"],
+).astype({"date": "datetime64[ns]"})
+
+
+@pytest.mark.parametrize(
+    "by, expected_order",
+    [
+        ("streams", ["a", "b", "c", "d"]),
+        ("position", ["a", "d", "b", "c"]),
+        ("freshness", ["b", "c", "a", "d"]),
+    ],
+)
+def test_create_track_ranking(by, expected_order):
+    ranking = create_track_ranking(charts, by=by)
+    assert ranking.track_id.tolist() == expected_order
+    assert ranking["rank"].tolist() == [1, 2, 3, 4]
+
+
+def test_create_track_ranking_aggregates():
+    ranking = create_track_ranking(charts).set_index("track_id")
+    assert ranking.loc["a"].to_dict() == {
+        "rank": 1,
+        "total_streams": 1800,
+        "best_pos": 1,
+        "first_date": pd.Timestamp("2023-01-01"),
+        "last_date": pd.Timestamp("2023-01-02"),
+        "chart_entries": 2,
+    }
@@ -0,0 +1,93 @@
+import asyncio
+import json
+from collections import defaultdict
+import pytest
+from aiohttp import web
+
+
+class StandInInternalAPI:
+    """
+    Local stand-in for the internal Spotify API endpoints (credits and lyrics), for testing request engines without
+    sending requests to Spotify.
+
+    Like the real API, it responds with
+    - 429 if more than `max_concurrency` requests are in flight
+    - 401 if the 'authorization' header does not match `valid_authorization`
+    - 404 for track IDs starting with 'missing'
+
+    Usage: `async with StandInInternalAPI(...) as api: ...`
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = None,
+        latency: float = 0.01,
+        valid_authorization: str = "Bearer valid",
+    ):
+        self.max_concurrency = max_concurrency
+        self.latency = latency
+        self.valid_authorization = valid_authorization
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.request_counts = defaultdict(int)
+        self.status_code_counts = defaultdict(int)
+        self._runner = None
+        self.base_url = None
+
+    def url_getter(self, resource: str):
+        paths = {
+            "credits": "track-credits-view/v0/experimental/{}/credits",
+            "lyrics": "color-lyrics/v2/track/{}",
+        }
+        return lambda track_id: self.base_url + paths[resource].format(track_id)
+
+    async def _handle(self, request: web.Request, resource: str):
+        track_id = request.match_info["track_id"]
+        self.request_counts[track_id] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if (
+                self.max_concurrency is not None
+                and self.in_flight > self.max_concurrency
+            ):
+                status, body = 429, {"error": "too many requests"}
+            elif request.headers.get("authorization") != self.valid_authorization:
+                status, body = 401, {"error": "unauthorized"}
+            elif track_id.startswith("missing"):
+                status, body = 404, {"error": "not found"}
+            else:
+                status, body = 200, {"trackId": track_id, "resource": resource}
+        finally:
+            self.in_flight -= 1
+        self.status_code_counts[status] += 1
+        return web.Response(status=status, text=json.dumps(body))
+
+    async def __aenter__(self):
+        async def handle_credits(request: web.Request):
+            return await self._handle(request, "credits")
+
+        async def handle_lyrics(request: web.Request):
+            return await self._handle(request, "lyrics")
+
+        app = web.Application()
+        app.router.add_get(
+            "/track-credits-view/v0/experimental/{track_id}/credits", handle_credits
+        )
+        app.router.add_get("/color-lyrics/v2/track/{track_id}", handle_lyrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/"
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self._runner.cleanup()
+
+
+@pytest.fixture
+def stand_in_api():
+    return StandInInternalAPI
@@ -0,0 +1,266 @@
+from helpers.internal_spotify_apis.credits import (
+    _create_credits_df,
+    process_credits,
+    process_credits_file,
+    read_credits_table,
+)
+from helpers.internal_spotify_apis.storage import create_response_writer
+import os
+import pandas as pd
+import pytest
+
+
+def create_artist(name: str, subroles: list, uri: bool = True, external=False):
+    artist = {}
+    if uri:
+        artist["uri"] = f"spotify:artist:{name}id"
+    artist["name"] = name
+    if uri:
+        artist["imageUri"] = f"https://i.scdn.co/image/{name}"
+    artist["subroles"] = subroles
+    artist["weight"] = 0.5
+    if external:
+        artist["externalUrl"] = f"https://example.com/{name}"
+        artist["creatorUri"] = f"spotify:creator:{name}"
+    return artist
+
+
+role_credits = pd.Series(
+    [
+        [
+            {
+                "roleTitle": "Performers",
+                "artists": [
+                    create_artist("a", ["main artist"]),
+                    create_artist("b", ["featured artist", "main artist"]),
+                ],
+            },
+            {"roleTitle": "Writers", "artists": []},
+            {"roleTitle": "Producers", "artists": []},
+        ],
+        [],
+        [
+            {
+                "roleTitle": "Performers",
+                "artists": [create_artist("c", ["remixer", "remixer"], uri=False)],
+            },
+            {
+                "roleTitle": "Writers",
+                "artists": [
+                    create_artist("d", ["composer", "lyricist"], external=True),
+                    create_artist("e", ["composer", "composer", "lyricist"]),
+                ],
+            },
+            {
+                "roleTitle": "Producers",
+                "artists": [create_artist("f", ["producer", "producer"])],
+            },
+        ],
+    ],
+    index=pd.Index(["track1", "track2", "track3"], name="track_id"),
+)
+
+
+def test_create_credits_df():
+    artist_ids = ["aid", "bid", None, "did", "eid", "fid"]
+    names = ["a", "b", "c", "d", "e", "f"]
+    expected = pd.DataFrame(
+        {
+            "artist_id": artist_ids,
+            "name": names,
+            "pos": [1, 2, 1, 1, 2, 1],
+            "uri": [f"spotify:artist:{i}" if i else None for i in artist_ids],
+            "imageUri": [
+                f"https://i.scdn.co/image/{n}" if i else None
+                for i, n in zip(artist_ids, names)
+            ],
+            # duplicated subroles are removed, keeping the first occurrence
+            "subroles": [
+                ["main artist"],
+                ["featured artist", "main artist"],
+                ["remixer"],
+                ["composer", "lyricist"],
+                ["composer", "lyricist"],
+                ["producer"],
+            ],
+            "weight": [0.5] * 6,
+            "roleTitle": ["Performer"] * 3 + ["Writer"] * 2 + ["Producer"],
+            "track_id": ["track1"] * 2 + ["track3"] * 4,
+            "externalUrl": [None] * 3 + ["https://example.com/d"] + [None] * 2,
+            "creatorUri": [None] * 3 + ["spotify:creator:d"] + [None] * 2,
+        }
+    )
+    pd.testing.assert_frame_equal(_create_credits_df(role_credits), expected)
+
+
+def test_process_credits():
+    dfs = process_credits(pd.DataFrame({"roleCredits": role_credits}))
+    assert dfs["writers"].artist_id.tolist() == ["did", "eid"]
+    assert dfs["producers"].columns.tolist() == [
+        "artist_id",
+        "name",
+        "pos",
+        "uri",
+        "imageUri",
+        "weight",
+        "track_id",
+    ]
+    assert dfs["performers"].pos.tolist() == [1, 2, 1]
+    assert pd.isna(dfs["performers"].artist_id[2])
+
+
+def test_invalid_uri():
+    invalid = pd.Series(
+        [
+            [
+                {
+                    "roleTitle": "Writers",
+                    "artists": [{"uri": "spotify:user:x", "name": "x"}],
+                }
+            ]
+        ],
+        index=["track1"],
+    )
+    with pytest.raises(AssertionError):
+        _create_credits_df(invalid)
+
+
+def write_credits_responses(path: str, track_ids: list):
+    with create_response_writer(path) as writer:
+        for track_id in track_ids:
+            writer.write(
+                {
+                    "status_code": 200,
+                    # fields other than roleCredits are not parsed
+                    "content": {
+                        "trackUri": f"spotify:track:{track_id}",
+                        "roleCredits": role_credits[track_id],
+                        "extendedCredits": [{"something": ["else"]}],
+                    },
+                    "content_type": "json",
+                    "url": "https://example.com",
+                    "track_id": track_id,
+                    "timestamp": "2024-01-02T03:04:05.123456Z",
+                }
+            )
+
+
+@pytest.mark.parametrize(
+    "file_name", ["credits.jsonl", "credits.jsonl.zst", "credits.parquet"]
+)
+def test_process_credits_file(tmp_path, file_name):
+    input_path = str(tmp_path / file_name)
+    write_credits_responses(input_path, list(role_credits.keys()))
+    output_path = str(tmp_path / "output")
+
+    row_counts = process_credits_file(input_path, output_path, batch_size=2)
+
+    expected = process_credits(pd.DataFrame({"roleCredits": role_credits}))
+    assert row_counts == {name: len(df) for name, df in expected.items()}
+    for name, expected_df in expected.items():
+        actual_df = (
+            read_credits_table(output_path, name)
+            .to_pandas()
+            .drop(columns=["person_key"])
+        )
+        if "subroles" in expected_df.columns:
+            actual_df["subroles"] = actual_df.subroles.apply(list)
+        pd.testing.assert_frame_equal(
+            actual_df,
+            expected_df.reset_index(drop=True),
+            check_dtype=False,
+        )
+
+
+@pytest.mark.parametrize(
+    "file_name", ["credits.jsonl", "credits.jsonl.zst", "credits.parquet"]
+)
+def test_process_credits_file_incremental(tmp_path, file_name):
+    input_path = str(tmp_path / file_name)
+    output_path = str(tmp_path / "output")
+    track_ids = list(role_credits.keys())
+    write_credits_responses(input_path, track_ids[:1])
+    first_row_counts = process_credits_file(input_path, output_path)
+    first_persons = pd.read_parquet(os.path.join(output_path, "persons.parquet"))
+
+    # nothing new
+    assert set(process_credits_file(input_path, output_path).values()) == {0}
+
+    # only the appended responses are processed
+    write_credits_responses(input_path, track_ids[1:])
+    # a part file left behind by a killed run is removed
+    with open(os.path.join(output_path, "writers.parquet", "part-00042.parquet"), "wb"):
+        pass
+    second_row_counts = process_credits_file(input_path, output_path)
+    # the keys of the persons added in the first run don't change (their links to artists may)
+    persons = pd.read_parquet(os.path.join(output_path, "persons.parquet"))
+    pd.testing.assert_frame_equal(
+        persons.head(len(first_persons)).drop(columns=["linked_artist_key"]),
+        first_persons.drop(columns=["linked_artist_key"]),
+    )
+
+    expected = process_credits(pd.DataFrame({"roleCredits": role_credits}))
+    for name, expected_df in expected.items():
+        assert first_row_counts[name] + second_row_counts[name] == len(expected_df)
+        actual_df = pd.read_parquet(os.path.join(output_path, f"{name}.parquet"))
+        assert sorted(actual_df.track_id) == sorted(expected_df.track_id)
+
+    # processing everything again results in the same tables
+    full_row_counts = process_credits_file(input_path, output_path, full=True)
+    assert full_row_counts == {name: len(df) for name, df in expected.items()}
+    for name in expected:
+        assert len(os.listdir(os.path.join(output_path, f"{name}.parquet"))) == 1
+
+
+def test_name_only_credits(tmp_path):
+    # "max" is credited without artist URI before being credited with one
+    credits = pd.Series(
+        [
+            [
+                {
+                    "roleTitle": "Producers",
+                    "artists": [create_artist("max", ["producer"], uri=False)],
+                }
+            ],
+            [
+                {
+                    "roleTitle": "Writers",
+                    "artists": [create_artist("max", ["composer"])],
+                },
+                {
+                    "roleTitle": "Producers",
+                    "artists": [create_artist("Max", ["producer"], uri=False)],
+                },
+            ],
+        ],
+        index=pd.Index(["track1", "track2"], name="track_id"),
+    )
+    input_path = str(tmp_path / "credits.jsonl")
+    with create_response_writer(input_path) as writer:
+        for track_id, content in credits.items():
+            writer.write(
+                {
+                    "status_code": 200,
+                    "content": {"roleCredits": content},
+                    "content_type": "json",
+                    "url": "https://example.com",
+                    "track_id": track_id,
+                    "timestamp": "2024-01-02T03:04:05.123456Z",
+                }
+            )
+
+    outputs = []
+    for batch_size in [1, 2]:
+        output_path = str(tmp_path / f"output{batch_size}")
+        process_credits_file(input_path, output_path, batch_size=batch_size)
+        outputs.append(output_path)
+        producers = read_credits_table(output_path, "producers").to_pandas()
+        # the response didn't contain an artist URI, so none is returned
+        assert producers.artist_id.isna().all() and producers.uri.isna().all()
+        assert producers.person_key.nunique() == 1
+
+    # the persons don't depend on the batch size
+    persons = [pd.read_parquet(os.path.join(p, "persons.parquet")) for p in outputs]
+    pd.testing.assert_frame_equal(persons[0], persons[1])
+    assert pd.isna(persons[0].artist_id[0]) and persons[0].artist_id[1] == "maxid"
+    assert persons[0].linked_artist_key.tolist()[0] == 1
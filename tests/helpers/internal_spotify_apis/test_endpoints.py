@@ -0,0 +1,39 @@
+from helpers.internal_spotify_apis import (
+    internal_api_endpoints,
+    is_valid_response,
+    register_internal_api_endpoint,
+)
+
+
+def test_default_endpoints():
+    assert {"credits", "lyrics"} <= set(internal_api_endpoints.keys())
+    assert internal_api_endpoints["lyrics"]["requires_login"]
+    assert not internal_api_endpoints["credits"]["requires_login"]
+    for endpoint in internal_api_endpoints.values():
+        assert endpoint["parallel_requests"] > 0
+        assert endpoint["retry_status_codes"] == {401, 429}
+        assert endpoint["validator"] is is_valid_response
+
+
+def test_register_endpoint():
+    register_internal_api_endpoint(
+        name="canvas",
+        url_getter=lambda track_id: f"https://example.com/canvas/{track_id}",
+        request_trigger=lambda driver: None,
+        retry_status_codes=[429, 503],
+        validator=lambda result: result["status_code"] == 200,
+    )
+    try:
+        endpoint = internal_api_endpoints["canvas"]
+        assert endpoint["url_getter"]("abc") == "https://example.com/canvas/abc"
+        assert endpoint["retry_status_codes"] == {429, 503}
+        assert endpoint["requests_per_second"] == 0
+        assert endpoint["post_processor"] is None
+    finally:
+        del internal_api_endpoints["canvas"]
+
+
+def test_is_valid_response():
+    assert is_valid_response({"status_code": 200, "content": {"lyrics": {}}})
+    assert not is_valid_response({"status_code": 200, "content": {"error": "x"}})
+    assert not is_valid_response({"status_code": 404, "content": {}})
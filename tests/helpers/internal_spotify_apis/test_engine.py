@@ -0,0 +1,301 @@
+from helpers.internal_spotify_apis.engine import (
+    run_requests,
+    TokenBucket,
+    AIMDConcurrencyController,
+    _get_backoff_delay,
+)
+from helpers.internal_spotify_apis.headers import HeadersLease
+import aiohttp
+import asyncio
+import pytest
+import threading
+import time
+
+
+async def fetch_all(api, track_ids, get_headers, **kwargs):
+    """
+    Fetches data for the track IDs from the stand-in API, using headers returned by `get_headers`
+    (called once at the start and whenever headers are refreshed).
+    """
+    url_getter = api.url_getter("credits")
+    kwargs.setdefault("base_backoff", 0.01)
+    results = []
+    async with aiohttp.ClientSession() as session, HeadersLease(
+        get_headers=get_headers, min_lifetime=0
+    ) as headers_lease:
+
+        async def make_request(track_id: str, headers: dict):
+            async with session.get(url_getter(track_id), headers=headers) as response:
+                return {"track_id": track_id, "status_code": response.status}
+
+        status_code_counts = await run_requests(
+            track_ids=track_ids,
+            make_request=make_request,
+            on_response=results.append,
+            headers_source=headers_lease,
+            show_progress=False,
+            **kwargs,
+        )
+    return status_code_counts, results
+
+
+def headers_getter(*authorizations: str):
+    """
+    Returns a function returning headers with the given authorization values (one per call, the last one is repeated).
+    """
+    calls = []
+
+    def get_headers():
+        calls.append(threading.current_thread())
+        return {
+            "authorization": authorizations[min(len(calls), len(authorizations)) - 1]
+        }
+
+    get_headers.calls = calls
+    return get_headers
+
+
+def test_keeps_requests_in_flight(stand_in_api):
+    async def run():
+        async with stand_in_api(latency=0.05) as api:
+            track_ids = [f"track{i}" for i in range(100)]
+            start = time.monotonic()
+            counts, results = await fetch_all(
+                api, track_ids, headers_getter("Bearer valid"), max_concurrency=10
+            )
+            duration = time.monotonic() - start
+            assert counts == {200: 100}
+            assert sorted(r["track_id"] for r in results) == sorted(track_ids)
+            assert api.max_in_flight == 10
+            # 10 "rounds" of requests with 50 ms latency each
+            assert duration < 1.5
+
+    asyncio.run(run())
+
+
+def test_adapts_to_throttling(stand_in_api):
+    async def run():
+        async with stand_in_api(max_concurrency=4, latency=0.02) as api:
+            track_ids = [f"track{i}" for i in range(200)]
+            counts, results = await fetch_all(
+                api, track_ids, headers_getter("Bearer valid"), max_concurrency=32
+            )
+            assert counts[200] == 200
+            assert counts[429] > 0
+            # every track ID was eventually fetched successfully
+            assert set(
+                r["track_id"] for r in results if r["status_code"] == 200
+            ) == set(track_ids)
+            # the concurrency limit was decreased, so most requests succeeded
+            assert counts[429] < counts[200]
+
+    asyncio.run(run())
+
+
+def test_refreshes_headers_once_for_concurrent_401s(stand_in_api):
+    async def run():
+        async with stand_in_api(valid_authorization="Bearer new") as api:
+            get_headers = headers_getter("Bearer expired", "Bearer new")
+            counts, _ = await fetch_all(
+                api,
+                [f"track{i}" for i in range(20)] + ["missing1"],
+                get_headers,
+                max_concurrency=10,
+            )
+            # initial headers + a single refresh
+            assert len(get_headers.calls) == 2
+            assert counts[200] == 20
+            assert counts[401] >= 10
+            # 404 is not retried
+            assert counts[404] == 1
+            assert api.request_counts["missing1"] <= 2
+
+    asyncio.run(run())
+
+
+def test_gives_up_after_max_attempts(stand_in_api):
+    async def run():
+        async with stand_in_api(valid_authorization="Bearer never") as api:
+            get_headers = headers_getter("Bearer expired")
+            counts, results = await fetch_all(
+                api,
+                ["track1", "track2"],
+                get_headers,
+                max_concurrency=2,
+                max_attempts=3,
+            )
+            assert counts == {401: 6}
+            assert api.request_counts == {"track1": 3, "track2": 3}
+            assert len(get_headers.calls) >= 2
+
+    asyncio.run(run())
+
+
+def test_refreshing_headers_does_not_block_event_loop(stand_in_api):
+    async def run():
+        async with stand_in_api(valid_authorization="Bearer new") as api:
+            get_new_headers = headers_getter("Bearer expired", "Bearer new")
+
+            def get_headers():
+                if len(get_new_headers.calls) > 0:
+                    # e.g. driving a browser to get new headers
+                    time.sleep(0.3)
+                return get_new_headers()
+
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.create_task(tick())
+            counts, _ = await fetch_all(
+                api,
+                [f"track{i}" for i in range(5)],
+                get_headers,
+                max_concurrency=5,
+            )
+            ticker.cancel()
+            assert counts[200] == 5
+            assert get_new_headers.calls[1] is not threading.main_thread()
+            assert ticks >= 10
+
+    asyncio.run(run())
+
+
+def test_retries_keep_priority():
+    async def run():
+        sent = []
+
+        async def make_request(track_id: str, headers: dict):
+            sent.append(track_id)
+            await asyncio.sleep(0.005)
+            # the first request for the track with the highest priority is throttled
+            throttled = track_id == "track0" and sent.count("track0") == 1
+            return {"track_id": track_id, "status_code": 429 if throttled else 200}
+
+        await run_requests(
+            track_ids=[f"track{i}" for i in range(50)],
+            make_request=make_request,
+            on_response=lambda result: None,
+            max_concurrency=1,
+            base_backoff=0.001,
+            show_progress=False,
+        )
+        # the retry is sent right after the backoff delay, not after all other track IDs
+        assert sent[:2] == ["track0", "track1"]
+        assert sent.index("track0", 1) <= 3
+
+    asyncio.run(run())
+
+
+def test_backoff_delay():
+    for attempt in range(1, 10):
+        delay = _get_backoff_delay(attempt=attempt, base_backoff=0.5, max_backoff=10)
+        assert 0 <= delay <= min(10, 0.5 * 2 ** (attempt - 1))
+
+
+def test_token_bucket_paces_requests():
+    async def run():
+        bucket = TokenBucket(rate=100, capacity=1)
+        start = time.monotonic()
+        for _ in range(21):
+            await bucket.acquire()
+        assert time.monotonic() - start >= 0.19
+
+    asyncio.run(run())
+
+
+def test_aimd_controller():
+    async def run():
+        controller = AIMDConcurrencyController(initial_limit=8)
+        first = await controller.acquire()
+        second = await controller.acquire()
+        await controller.release(first, throttled=True)
+        assert controller.limit == 4
+        # requests sent before the last decrease don't decrease the limit again
+        await controller.release(second, throttled=True)
+        assert controller.limit == 4
+        await controller.release(await controller.acquire(), throttled=True)
+        assert controller.limit == 2
+        for _ in range(20):
+            await controller.release(await controller.acquire())
+        assert 2 < controller.limit <= 8
+
+    asyncio.run(run())
+
+
+class CountingHeadersSource:
+    """
+    Stand-in for a `HeadersPool`, counting the headers tickets that were not released.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.released_status_codes = []
+        self.age = 0
+
+    async def acquire(self):
+        self.in_flight += 1
+        return {}, None
+
+    def release(self, ticket, status_code):
+        self.in_flight -= 1
+        self.released_status_codes.append(status_code)
+
+
+def test_transport_errors_are_retried():
+    async def run():
+        attempts = []
+
+        async def make_request(track_id: str, headers: dict):
+            attempts.append(track_id)
+            if track_id == "unreachable":
+                raise aiohttp.ClientConnectionError("connection reset")
+            if track_id == "slow" and attempts.count("slow") == 1:
+                raise asyncio.TimeoutError()
+            return {"track_id": track_id, "status_code": 200}
+
+        headers_source = CountingHeadersSource()
+        results = []
+        status_code_counts = await run_requests(
+            track_ids=["a", "slow", "unreachable"],
+            make_request=make_request,
+            on_response=results.append,
+            max_concurrency=2,
+            headers_source=headers_source,
+            retry_exceptions=(aiohttp.ClientError, asyncio.TimeoutError),
+            max_attempts=3,
+            base_backoff=0.001,
+            show_progress=False,
+        )
+        assert status_code_counts == {200: 2}
+        assert sorted(r["track_id"] for r in results) == ["a", "slow"]
+        # the failed attempts count towards max_attempts
+        assert attempts.count("slow") == 2 and attempts.count("unreachable") == 3
+        assert headers_source.in_flight == 0
+        assert headers_source.released_status_codes.count(None) == 4
+
+    asyncio.run(run())
+
+
+def test_other_errors_release_headers():
+    async def run():
+        async def make_request(track_id: str, headers: dict):
+            raise ValueError("bug")
+
+        headers_source = CountingHeadersSource()
+        with pytest.raises(ValueError):
+            await run_requests(
+                track_ids=["a"],
+                make_request=make_request,
+                on_response=lambda result: None,
+                max_concurrency=1,
+                headers_source=headers_source,
+                show_progress=False,
+            )
+        assert headers_source.in_flight == 0
+
+    asyncio.run(run())
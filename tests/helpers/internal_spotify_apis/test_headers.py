@@ -0,0 +1,121 @@
+from helpers.internal_spotify_apis.headers import HeadersLease, HeadersPool
+import asyncio
+import itertools
+import threading
+
+
+def counting_headers_getter():
+    counter = itertools.count(1)
+    calls = []
+
+    def get_headers():
+        calls.append(threading.current_thread())
+        return {"authorization": f"Bearer {next(counter)}"}
+
+    get_headers.calls = calls
+    return get_headers
+
+
+def test_refreshes_headers_before_expiry():
+    async def run():
+        get_headers = counting_headers_getter()
+        async with HeadersLease(
+            get_headers=get_headers, lifetime=0.1, refresh_at=0.5, min_lifetime=0
+        ) as lease:
+            headers, generation = await lease.acquire()
+            assert headers == {"authorization": "Bearer 1"}
+            await asyncio.sleep(0.12)
+            headers, new_generation = await lease.acquire()
+            assert new_generation > generation
+            assert headers != {"authorization": "Bearer 1"}
+            # the headers are refreshed in a separate thread
+            assert get_headers.calls[-1] is not threading.main_thread()
+
+    asyncio.run(run())
+
+
+def test_invalidate_refreshes_once():
+    async def run():
+        get_headers = counting_headers_getter()
+        async with HeadersLease(
+            get_headers=get_headers, initial_headers={"authorization": "Bearer 0"}
+        ) as lease:
+            _, generation = await lease.acquire()
+            for _ in range(10):
+                lease.invalidate(generation)
+            headers, new_generation = await lease.acquire()
+            assert headers == {"authorization": "Bearer 1"}
+            assert new_generation == generation + 1
+            # 401 responses for requests with old headers don't trigger another refresh
+            lease.invalidate(generation)
+            assert (await lease.acquire())[1] == new_generation
+            assert len(get_headers.calls) == 1
+
+    asyncio.run(run())
+
+
+def test_invalidate_shortens_lifetime():
+    async def run():
+        async with HeadersLease(
+            get_headers=counting_headers_getter(), lifetime=3600, min_lifetime=0.05
+        ) as lease:
+            _, generation = await lease.acquire()
+            lease.invalidate(generation)
+            assert lease.lifetime == 0.05
+            await lease.acquire()
+
+    asyncio.run(run())
+
+
+def test_pool_balances_load():
+    async def run():
+        leases = [
+            HeadersLease(get_headers=None, initial_headers={"authorization": str(i)})
+            for i in range(3)
+        ]
+        async with HeadersPool(leases) as pool:
+            acquired = [await pool.acquire() for _ in range(6)]
+            assert [h["authorization"] for h, _ in acquired] == list("012012")
+            # release the requests of the first lease, so it is the least loaded one
+            for _, ticket in acquired[::3]:
+                pool.release(ticket, 200)
+            headers, _ = await pool.acquire()
+            assert headers["authorization"] == "0"
+
+    asyncio.run(run())
+
+
+def test_pool_quarantines_throttled_leases():
+    async def run():
+        leases = [
+            HeadersLease(get_headers=None, initial_headers={"authorization": str(i)})
+            for i in range(2)
+        ]
+        async with HeadersPool(leases, base_quarantine=0.1) as pool:
+            headers, ticket = await pool.acquire()
+            assert headers["authorization"] == "0"
+            pool.release(ticket, 429)
+            assert pool.is_quarantined(0)
+            for _ in range(3):
+                headers, ticket = await pool.acquire()
+                assert headers["authorization"] == "1"
+                pool.release(ticket, 200)
+            # if all leases are quarantined, acquire waits until the first quarantine ends
+            headers, ticket = await pool.acquire()
+            pool.release(ticket, 429)
+            headers, _ = await pool.acquire()
+            assert headers["authorization"] == "0"
+            assert not pool.is_quarantined(0)
+
+    asyncio.run(run())
+
+
+def test_single_lease_pool_is_never_quarantined():
+    async def run():
+        lease = HeadersLease(get_headers=None, initial_headers={"authorization": "0"})
+        async with HeadersPool([lease]) as pool:
+            _, ticket = await pool.acquire()
+            pool.release(ticket, 429)
+            assert not pool.is_quarantined(0)
+
+    asyncio.run(run())
@@ -0,0 +1,116 @@
+from helpers.internal_spotify_apis.lyrics import process_lyrics_file
+from helpers.internal_spotify_apis.storage import create_response_writer
+import os
+import pandas as pd
+import pytest
+
+
+def create_lyrics(sync_type: str, language: str, words: list):
+    return {
+        "lyrics": {
+            "syncType": sync_type,
+            "lines": [
+                {
+                    "startTimeMs": str(1000 * (i + 1)),
+                    "words": w,
+                    "syllables": [],
+                    "endTimeMs": "0",
+                }
+                for i, w in enumerate(words)
+            ],
+            "provider": "MusixMatch",
+            "providerLyricsId": "123",
+            "providerDisplayName": "Musixmatch",
+            "syncLyricsUri": "",
+            "isDenseTypeface": False,
+            "alternatives": [],
+            "language": language,
+            "isRtlLanguage": language == "he",
+            "fullscreenAction": "FULLSCREEN_LYRICS",
+            "showUpsell": False,
+        },
+        "colors": {"background": -1568728, "text": -16777216, "highlightText": -1},
+        "hasVocalRemoval": False,
+    }
+
+
+lyrics = {
+    f"track{i}": create_lyrics(
+        "UNSYNCED" if i % 3 == 0 else "LINE_SYNCED",
+        ["en", "es", "he"][i % 3],
+        [f"line {j} of track {i}" for j in range(i % 4)],
+    )
+    for i in range(30)
+}
+
+
+@pytest.mark.parametrize(
+    "file_name, processes",
+    [
+        ("lyrics.jsonl", 1),
+        ("lyrics.jsonl.zst", 1),
+        ("lyrics.jsonl", 2),
+        ("lyrics.parquet", 2),
+    ],
+)
+def test_process_lyrics_file(tmp_path, file_name, processes):
+    input_path = str(tmp_path / file_name)
+    # flush often, so that the file can be split into several chunks
+    with create_response_writer(input_path, flush_every=4) as writer:
+        for track_id, content in lyrics.items():
+            writer.write(
+                {
+                    "status_code": 200,
+                    "content": content,
+                    "content_type": "json",
+                    "url": "https://example.com",
+                    "track_id": track_id,
+                    "timestamp": "2024-01-02T03:04:05.123456Z",
+                }
+            )
+    output_path = str(tmp_path / "output")
+
+    row_counts = process_lyrics_file(
+        input_path, output_path, batch_size=3, processes=processes
+    )
+
+    expected_line_count = sum(i % 4 for i in range(30))
+    assert row_counts == {"lyrics": 30, "lyrics_lines": expected_line_count}
+    tracks = (
+        pd.read_parquet(os.path.join(output_path, "lyrics.parquet"))
+        .set_index("track_id")
+        .sort_index()
+    )
+    assert len(tracks) == 30
+    assert isinstance(tracks.language.dtype, pd.CategoricalDtype)
+    assert tracks.loc["track5"].to_dict() == {
+        "sync_type": "LINE_SYNCED",
+        "language": "he",
+        "provider": "MusixMatch",
+        "provider_lyrics_id": "123",
+        "is_rtl_language": True,
+        "is_dense_typeface": False,
+        "line_count": 1,
+    }
+
+    lines = pd.read_parquet(os.path.join(output_path, "lyrics_lines.parquet"))
+    assert len(lines) == expected_line_count
+    track7 = lines[lines.track_id == "track7"].sort_values("line_number")
+    assert track7.line_number.tolist() == [1, 2, 3]
+    assert track7.start_time_ms.tolist() == [1000, 2000, 3000]
+    assert track7.words.tolist() == [f"line {j} of track 7" for j in range(3)]
+    # unsynced lyrics have no start times
+    assert lines[lines.track_id == "track3"].start_time_ms.isna().all()
+
+
+def test_process_lyrics_file_empty(tmp_path):
+    input_path = str(tmp_path / "lyrics.jsonl")
+    with create_response_writer(input_path):
+        pass
+    output_path = str(tmp_path / "output")
+
+    assert process_lyrics_file(input_path, output_path) == {
+        "lyrics": 0,
+        "lyrics_lines": 0,
+    }
+    assert len(pd.read_parquet(os.path.join(output_path, "lyrics_lines.parquet"))) == 0
@@ -0,0 +1,90 @@
+from helpers.internal_spotify_apis.parquet_storage import (
+    ParquetResponseWriter,
+    convert_jsonl_to_parquet,
+    get_part_file_paths,
+    read_parquet_responses,
+)
+from helpers.internal_spotify_apis.storage import (
+    ResponseWriter,
+    create_response_writer,
+    read_status_codes,
+)
+import json
+
+
+def create_record(i: int, status_code: int = 200):
+    return {
+        "status_code": status_code,
+        "content": {"trackId": f"track{i}"} if status_code == 200 else "not found",
+        "content_type": "json" if status_code == 200 else "text",
+        "url": f"https://example.com/track{i}",
+        "track_id": f"track{i:02d}",
+        "timestamp": "2024-01-02T03:04:05.123456Z",
+    }
+
+
+records = [create_record(i, 404 if i % 5 == 0 else 200) for i in range(25)]
+
+
+def test_write_and_read(tmp_path):
+    path = str(tmp_path / "responses.parquet")
+    writer = create_response_writer(path, flush_every=10)
+    assert isinstance(writer, ParquetResponseWriter)
+    with writer:
+        # written in reverse order, every part file is sorted by track ID
+        for record in reversed(records):
+            writer.write(record)
+    assert len(get_part_file_paths(path)) == 3
+
+    table = read_parquet_responses(path)
+    assert sorted(table.column("track_id").to_pylist()) == [
+        r["track_id"] for r in records
+    ]
+    rows = {row["track_id"]: row for row in table.to_pylist()}
+    assert json.loads(rows["track01"]["content"]) == records[1]["content"]
+    assert rows["track05"]["content"] == "not found"
+    assert (
+        rows["track01"]["timestamp"].isoformat() == "2024-01-02T03:04:05.123456+00:00"
+    )
+
+    # appending adds new part files
+    with ParquetResponseWriter(path) as writer:
+        writer.write(create_record(99))
+    assert len(get_part_file_paths(path)) == 4
+    assert len(read_status_codes(path)) == len(records) + 1
+
+
+def test_read_with_filters(tmp_path):
+    path = str(tmp_path / "responses.parquet")
+    with ParquetResponseWriter(path, flush_every=10) as writer:
+        for record in records:
+            writer.write(record)
+
+    table = read_parquet_responses(
+        path, columns=["track_id"], track_ids=["track03", "track05", "unknown"]
+    )
+    assert table.column_names == ["track_id"]
+    assert sorted(table.column("track_id").to_pylist()) == ["track03", "track05"]
+
+    table = read_parquet_responses(path, status_codes=[404])
+    assert table.num_rows == 5
+    table = read_parquet_responses(path, track_ids=["track03"], status_codes=[404])
+    assert table.num_rows == 0
+
+    assert read_parquet_responses(str(tmp_path / "empty.parquet")).num_rows == 0
+
+
+def test_convert_jsonl_to_parquet(tmp_path):
+    jsonl_path = str(tmp_path / "responses.jsonl.zst")
+    with ResponseWriter(jsonl_path) as writer:
+        for record in records:
+            writer.write(record)
+    parquet_path = str(tmp_path / "responses.parquet")
+
+    assert convert_jsonl_to_parquet(jsonl_path, parquet_path, batch_size=10) == len(
+        records
+    )
+    assert len(get_part_file_paths(parquet_path)) == 3
+    assert sorted(read_status_codes(parquet_path)) == sorted(
+        read_status_codes(jsonl_path)
+    )
@@ -0,0 +1,104 @@
+from helpers.internal_spotify_apis.persons import (
+    PersonDimension,
+    load_persons,
+    normalize_person_names,
+    save_persons,
+)
+import pyarrow as pa
+import pytest
+
+
+def test_normalize_person_names():
+    names = pa.array(["  Max  Martin ", "ＭＡＸ\tmartin", "Björk", None])
+    assert normalize_person_names(names).to_pylist() == [
+        "max martin",
+        "max martin",
+        "björk",
+        None,
+    ]
+
+
+def test_get_keys():
+    persons = PersonDimension()
+    keys = persons.get_keys(
+        pa.array(["Max Martin", "Shellback", "max  martin", "Max Martin", "Shellback"]),
+        pa.array(["maxid", None, None, "maxid", None]),
+    )
+    assert keys.to_pylist() == [0, 1, 2, 0, 1]
+    assert persons.to_table().to_pylist() == [
+        {
+            "person_key": 0,
+            "name": "Max Martin",
+            "normalized_name": "max martin",
+            "artist_id": "maxid",
+            "linked_artist_key": None,
+        },
+        {
+            "person_key": 1,
+            "name": "Shellback",
+            "normalized_name": "shellback",
+            "artist_id": None,
+            "linked_artist_key": None,
+        },
+        # name-only credits are linked to the (only) artist with the same normalized name
+        {
+            "person_key": 2,
+            "name": "max  martin",
+            "normalized_name": "max martin",
+            "artist_id": None,
+            "linked_artist_key": 0,
+        },
+    ]
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 3, 5])
+def test_get_keys_independent_of_batches(batch_size):
+    names = ["Max Martin", "Shellback", "Max Martin", "Max Martin", "Shellback"]
+    artist_ids = [None, None, "maxid", None, "shellbackid"]
+    expected = PersonDimension()
+    expected_keys = expected.get_keys(pa.array(names), pa.array(artist_ids))
+
+    persons = PersonDimension()
+    keys = []
+    for start in range(0, len(names), batch_size):
+        keys += persons.get_keys(
+            pa.array(names[start : start + batch_size], pa.string()),
+            pa.array(artist_ids[start : start + batch_size], pa.string()),
+        ).to_pylist()
+    assert keys == expected_keys.to_pylist() == [0, 1, 2, 0, 3]
+    assert persons.to_table().equals(expected.to_table())
+    # the name-only persons are linked to the artists seen later
+    assert persons.to_table().column("linked_artist_key").to_pylist() == [
+        2,
+        3,
+        None,
+        None,
+    ]
+
+
+def test_get_keys_ambiguous_name():
+    persons = PersonDimension()
+    persons.get_keys(pa.array(["John Smith", "John Smith"]), pa.array(["id1", "id2"]))
+    keys = persons.get_keys(pa.array(["John Smith"]), pa.array([None], pa.string()))
+    # two artists have this name, so the name-only person is not linked to either of them
+    assert keys.to_pylist() == [2]
+    assert persons.to_table().column("linked_artist_key").to_pylist() == [
+        None,
+        None,
+        None,
+    ]
+
+
+def test_keys_are_stable(tmp_path):
+    persons = PersonDimension()
+    first_keys = persons.get_keys(
+        pa.array(["A", "B", "C"]), pa.array(["aid", None, "cid"])
+    )
+    save_persons(str(tmp_path), persons)
+
+    persons = load_persons(str(tmp_path))
+    keys = persons.get_keys(
+        pa.array(["D", "C", "b", "A"]), pa.array([None, "cid", None, "aid"])
+    )
+    assert keys.to_pylist() == [3, first_keys[2].as_py(), first_keys[1].as_py(), 0]
+    assert len(persons) == 4
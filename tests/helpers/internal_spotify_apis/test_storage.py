@@ -0,0 +1,144 @@
+from helpers.internal_spotify_apis.storage import (
+    ResponseWriter,
+    get_chunk_offsets,
+    get_index_path,
+    load_index,
+    read_index,
+    read_line_batches,
+    read_response,
+    read_responses,
+    repair_tail,
+)
+import json
+import os
+import pytest
+
+records = [{"track_id": f"track{i}", "status_code": 200} for i in range(25)]
+
+
+@pytest.mark.parametrize("file_name", ["responses.jsonl", "responses.jsonl.zst"])
+def test_write_and_read(tmp_path, file_name):
+    path = str(tmp_path / file_name)
+    with ResponseWriter(path, flush_every=10) as writer:
+        for record in records[:5]:
+            writer.write(record)
+        # still buffered
+        assert os.path.getsize(path) == 0
+        for record in records[5:]:
+            writer.write(record)
+    assert list(read_responses(path)) == records
+
+    # appending to an existing file
+    with ResponseWriter(path) as writer:
+        writer.write({"track_id": "another", "status_code": 404})
+    assert len(list(read_responses(path))) == len(records) + 1
+
+
+def test_repair_tail_jsonl(tmp_path):
+    path = str(tmp_path / "responses.jsonl")
+    with ResponseWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+    with open(path, "ab") as f:
+        f.write(b'{"track_id": "incomp')
+
+    assert repair_tail(path) == len(b'{"track_id": "incomp')
+    assert list(read_responses(path)) == records
+    assert repair_tail(path) == 0
+
+
+def test_repair_tail_zstd(tmp_path):
+    path = str(tmp_path / "responses.jsonl.zst")
+    with ResponseWriter(path, flush_every=10) as writer:
+        for record in records:
+            writer.write(record)
+    size = os.path.getsize(path)
+    # the last flush (a frame with 5 records) was only partially written
+    with ResponseWriter(path) as writer:
+        for record in records[:5]:
+            writer.write(record)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+
+    assert list(read_responses(path)) == records
+    assert repair_tail(path) > 0
+    assert os.path.getsize(path) == size
+    # new data can be appended after the repair
+    with ResponseWriter(path) as writer:
+        writer.write({"track_id": "another", "status_code": 200})
+    assert list(read_responses(path))[-1]["track_id"] == "another"
+
+
+@pytest.mark.parametrize("file_name", ["responses.jsonl", "responses.jsonl.zst"])
+def test_index(tmp_path, file_name):
+    path = str(tmp_path / file_name)
+    with ResponseWriter(path, flush_every=10) as writer:
+        for record in records:
+            writer.write(record)
+        writer.write({"track_id": "missing", "status_code": 404})
+    entries = read_index(path)
+    assert [(e.track_id, e.status_code) for e in entries] == [
+        (r["track_id"], r["status_code"]) for r in records
+    ] + [("missing", 404)]
+
+    # random access to single responses
+    index = load_index(path)
+    assert read_response(path, "track17", index) == records[17]
+    assert read_response(path, "missing", index)["status_code"] == 404
+    assert read_response(path, "unknown", index) is None
+
+
+@pytest.mark.parametrize("file_name", ["responses.jsonl", "responses.jsonl.zst"])
+def test_index_created_for_existing_file(tmp_path, file_name):
+    path = str(tmp_path / file_name)
+    with ResponseWriter(path, flush_every=10) as writer:
+        for record in records:
+            writer.write(record)
+    index_path = get_index_path(path)
+    with open(index_path, "rb") as f:
+        index_data = f.read()
+    os.remove(index_path)
+
+    assert len(read_index(path)) == len(records)
+    with open(index_path, "rb") as f:
+        assert f.read() == index_data
+
+
+def test_repair_tail_unindexed_data(tmp_path):
+    path = str(tmp_path / "responses.jsonl")
+    with ResponseWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+    size = os.path.getsize(path)
+    # killed after writing the data, but before writing (all of) the index
+    with open(path, "ab") as f:
+        f.write(b'{"track_id": "unindexed", "status_code": 200}\n')
+    with open(get_index_path(path), "ab") as f:
+        f.write(b"unindexed\t20")
+
+    assert repair_tail(path) > 0
+    assert os.path.getsize(path) == size
+    assert len(read_index(path)) == len(records)
+    assert list(read_responses(path)) == records
+
+
+@pytest.mark.parametrize("file_name", ["responses.jsonl", "responses.jsonl.zst"])
+def test_get_chunk_offsets(tmp_path, file_name):
+    path = str(tmp_path / file_name)
+    with ResponseWriter(path, flush_every=5) as writer:
+        for record in records:
+            writer.write(record)
+
+    chunks = get_chunk_offsets(path, 3)
+    assert len(chunks) == 3
+    assert chunks[0][0] == 0 and chunks[-1][1] == os.path.getsize(path)
+    lines = b"".join(
+        batch
+        for start_offset, end_offset in chunks
+        for batch in read_line_batches(path, 2, start_offset, end_offset)
+    )
+    assert [json.loads(line) for line in lines.splitlines()] == records
+    # not more chunks than blocks
+    assert len(get_chunk_offsets(path, 100)) == (
+        len(records) if file_name.endswith(".jsonl") else 5
+    )
@@ -0,0 +1,76 @@
+from helpers.internal_spotify_apis.telemetry import (
+    RequestTelemetry,
+    TelemetryExporter,
+    format_prometheus_metrics,
+)
+import aiohttp
+import asyncio
+import json
+import socket
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def test_snapshot():
+    telemetry = RequestTelemetry(name="credits", window=60)
+    telemetry.set_gauge("in_flight", lambda: 3)
+    for i in range(1, 101):
+        telemetry.record(200 if i <= 90 else 429, latency=i / 100)
+    telemetry.record(401, latency=0.5)
+
+    snapshot = telemetry.snapshot()
+    assert snapshot["endpoint"] == "credits"
+    assert snapshot["latency"] == {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+    assert snapshot["throttled_rate"] == 10 / 101
+    assert snapshot["unauthorized_rate"] == 1 / 101
+    assert snapshot["in_flight"] == 3
+    assert snapshot["status_code_counts"] == {"200": 90, "401": 1, "429": 10}
+    assert snapshot["requests_per_second"] > 0
+    json.dumps(snapshot)
+
+
+def test_prometheus_metrics():
+    telemetry = RequestTelemetry(name="lyrics")
+    text = format_prometheus_metrics([telemetry.snapshot()])
+    assert 'internal_api_latency_seconds{endpoint="lyrics",quantile="0.5"} NaN' in text
+
+    telemetry.record(200, latency=0.25)
+    text = format_prometheus_metrics([telemetry.snapshot()])
+    assert "# TYPE internal_api_responses_total counter" in text
+    assert (
+        'internal_api_responses_total{endpoint="lyrics",status_code="200"} 1.0' in text
+    )
+    assert (
+        'internal_api_latency_seconds{endpoint="lyrics",quantile="0.99"} 0.25' in text
+    )
+
+
+def test_exporter(tmp_path):
+    port = get_free_port()
+    snapshot_path = str(tmp_path / "telemetry.jsonl")
+    telemetries = [RequestTelemetry(name="credits"), RequestTelemetry(name="lyrics")]
+    telemetries[0].record(200, latency=0.1)
+
+    async def run():
+        async with TelemetryExporter(
+            telemetries,
+            snapshot_path=snapshot_path,
+            interval=0.05,
+            prometheus_port=port,
+        ):
+            await asyncio.sleep(0.12)
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://localhost:{port}/metrics") as response:
+                    return await response.text()
+
+    metrics = asyncio.run(run())
+    assert 'internal_api_requests_per_second{endpoint="lyrics"}' in metrics
+    with open(snapshot_path) as f:
+        snapshots = [json.loads(line) for line in f]
+    # periodic snapshots and a final one, for both endpoints
+    assert len(snapshots) >= 4 and len(snapshots) % 2 == 0
+    assert [s["endpoint"] for s in snapshots[-2:]] == ["credits", "lyrics"]
@@ -0,0 +1,129 @@
+from helpers.spotify_api.checkpoints import (
+    ChunkCheckpoints,
+    fetch_isolating_rejected_ids,
+)
+import os
+import pytest
+from spotipy import SpotifyException
+
+
+def test_resume_from_checkpoints(tmp_path):
+    checkpoints = ChunkCheckpoints(str(tmp_path))
+    checkpoints.save_chunk(["a", "b"], {"metadata": [{"id": "a"}, {"id": "b"}]})
+    checkpoints.save_chunk(["c"], {"metadata": [{"id": "c"}], "images": [("c", 1)]})
+    checkpoints.add_dead_letter("d", "invalid id")
+
+    # simulate a process killed while writing the next chunk
+    with open(checkpoints.chunks_path, "ab") as f:
+        f.write(b"\x80\x04\x95garbage")
+
+    results, processed_ids = ChunkCheckpoints(str(tmp_path)).load()
+    assert processed_ids == {"a", "b", "c", "d"}
+    assert [row["id"] for row in results["metadata"]] == ["a", "b", "c"]
+    assert results["images"] == [("c", 1)]
+
+    # the incomplete chunk has been removed, so new chunks can be appended
+    checkpoints.save_chunk(["e"], {"metadata": [{"id": "e"}]})
+    results, processed_ids = checkpoints.load()
+    assert [row["id"] for row in results["metadata"]] == ["a", "b", "c", "e"]
+
+    checkpoints.remove_chunks()
+    results, processed_ids = checkpoints.load()
+    assert processed_ids == {"d"}
+    assert len(results) == 0
+
+
+def test_fetch_isolating_rejected_ids():
+    calls = []
+
+    def fetch(ids):
+        calls.append(ids)
+        if "invalid" in ids:
+            raise SpotifyException(400, -1, "invalid id")
+        return [{"id": id} if id != "unavailable" else None for id in ids]
+
+    results, errors = fetch_isolating_rejected_ids(fetch, ["a", "invalid", "b"])
+    assert results == [{"id": "a"}, None, {"id": "b"}]
+    assert list(errors.keys()) == ["invalid"]
+    assert calls == [["a", "invalid", "b"], ["a"], ["invalid"], ["b"]]
+
+    results, errors = fetch_isolating_rejected_ids(fetch, ["a", "unavailable"])
+    assert results == [{"id": "a"}, None]
+    assert errors == {}
+
+
+def test_fetch_isolating_rejected_ids_reraises_other_errors():
+    def fetch(ids):
+        raise SpotifyException(500, -1, "server error")
+
+    with pytest.raises(SpotifyException):
+        fetch_isolating_rejected_ids(fetch, ["a", "b"])
+
+
+def test_checkpoints_of_other_runs_are_reset(tmp_path):
+    checkpoints = ChunkCheckpoints(str(tmp_path))
+    checkpoints.load(["a", "b", "c"], {"markets_format": "long"})
+    checkpoints.save_chunk(["a", "b"], {"markets": [("a", "AT"), ("b", "DE")]})
+    checkpoints.add_dead_letter("c", "invalid id")
+
+    # resuming the same run (the order of the IDs doesn't matter)
+    results, processed_ids = checkpoints.load(
+        ["c", "b", "a"], {"markets_format": "long"}
+    )
+    assert processed_ids == {"a", "b", "c"}
+    assert results["markets"] == [("a", "AT"), ("b", "DE")]
+
+    # the rows of the long format can't be used for the bitmap format
+    results, processed_ids = checkpoints.load(
+        ["a", "b", "c"], {"markets_format": "bitmap"}
+    )
+    assert len(results) == 0 and processed_ids == set()
+    assert not os.path.exists(checkpoints.dead_letters_path)
+
+    # other IDs
+    checkpoints.save_chunk(["a"], {"markets": [("a", ["AT"])]})
+    results, processed_ids = checkpoints.load(["a", "d"], {"markets_format": "bitmap"})
+    assert len(results) == 0 and processed_ids == set()
+
+
+def test_completed_run_is_not_resumed(tmp_path):
+    checkpoints = ChunkCheckpoints(str(tmp_path))
+    checkpoints.load(["a", "b"])
+    checkpoints.save_chunk(["a"], {"metadata": [{"id": "a"}]})
+    checkpoints.add_dead_letter("b", "invalid id")
+    checkpoints.remove_chunks()
+
+    # running the same fetch again starts from scratch (with new dead letters)
+    results, processed_ids = checkpoints.load(["a", "b"])
+    assert len(results) == 0 and processed_ids == set()
+    assert not os.path.exists(checkpoints.dead_letters_path)
+
+
+class RejectingSpotify:
+    def tracks(self, ids):
+        raise SpotifyException(400, -1, "invalid id")
+
+    def albums(self, ids):
+        raise SpotifyException(400, -1, "invalid id")
+
+    def artists(self, ids):
+        raise SpotifyException(400, -1, "invalid id")
+
+
+@pytest.mark.parametrize("resource", ["track", "album", "artist"])
+def test_all_ids_are_dead_letters(tmp_path, resource):
+    import helpers.spotify_api as spotify_api
+
+    get_metadata = getattr(spotify_api, f"get_{resource}_metadata_from_api")
+    dfs = get_metadata(
+        ["x", "y"],
+        RejectingSpotify(),
+        original_responses_path=str(tmp_path / "original_responses.jsonl.gz"),
+        checkpoint_dir=str(tmp_path / "checkpoints"),
+    )
+    assert dfs["metadata"].empty
+    assert dfs["metadata"].index.name == f"{resource}_id"
+    assert ChunkCheckpoints(str(tmp_path / "checkpoints")).dead_letter_ids() == {
+        "x",
+        "y",
+    }
@@ -0,0 +1,122 @@
+from helpers.spotify_api.markets import (
+    create_market_bitmaps,
+    market_bitmaps_from_long,
+    market_bitmaps_to_long,
+    is_available_in_market,
+    filter_by_markets,
+    count_available_markets,
+    create_market_index,
+    write_market_index,
+    read_market_index,
+    get_markets_file_format,
+    read_market_bitmaps,
+)
+import pandas as pd
+import pytest
+
+ids = ["a", "b", "c", "d"]
+# more than 8 markets to make sure bitmaps spanning multiple bytes work
+market_lists = [
+    ["AT", "DE"],
+    ["US"],
+    [],
+    ["AT", "BR", "CA", "CH", "DE", "ES", "FR", "IT", "US"],
+]
+
+
+def test_create_market_bitmaps():
+    dfs = create_market_bitmaps(ids=ids, market_lists=market_lists, id_col="track_id")
+    assert dfs.keys() == {"market_bitmaps", "market_codes"}
+    bitmaps, codes = dfs["market_bitmaps"], dfs["market_codes"]
+    assert bitmaps.index.name == "track_id"
+    assert bitmaps.index.tolist() == ids
+    assert codes.market.tolist() == sorted(set(sum(market_lists, [])))
+    assert all(len(b) == 2 for b in bitmaps.markets)
+
+
+def test_market_bitmaps_parquet_roundtrip(tmp_path):
+    dfs = create_market_bitmaps(ids=ids, market_lists=market_lists, id_col="track_id")
+    for name, df in dfs.items():
+        df.to_parquet(tmp_path / f"{name}.parquet")
+    bitmaps, codes = read_market_bitmaps(str(tmp_path / "market_bitmaps.parquet"))
+
+    assert is_available_in_market(bitmaps, codes, "US").tolist() == [
+        False,
+        True,
+        False,
+        True,
+    ]
+    assert is_available_in_market(bitmaps, codes, "XX").sum() == 0
+
+    (tmp_path / "market_codes.parquet").unlink()
+    with pytest.raises(ValueError, match="require the market codes"):
+        read_market_bitmaps(str(tmp_path / "market_bitmaps.parquet"))
+
+
+def test_filter_by_markets():
+    dfs = create_market_bitmaps(ids=ids, market_lists=market_lists, id_col="track_id")
+    bitmaps, codes = dfs["market_bitmaps"], dfs["market_codes"]
+    assert filter_by_markets(bitmaps, codes, ["DE", "US"]).tolist() == ["a", "b", "d"]
+    assert filter_by_markets(
+        bitmaps, codes, ["DE", "US"], require_all=True
+    ).tolist() == ["d"]
+    assert count_available_markets(bitmaps, codes).tolist() == [2, 1, 0, 9]
+
+
+def test_long_format_roundtrip():
+    long_df = pd.DataFrame(
+        [(i, m) for i, markets in zip(ids, market_lists) for m in markets],
+        columns=["track_id", "market"],
+    ).set_index("track_id")
+
+    dfs = market_bitmaps_from_long(long_df, ids=ids)
+    assert dfs["market_bitmaps"].index.tolist() == ids
+
+    derived = market_bitmaps_to_long(dfs["market_bitmaps"], dfs["market_codes"])
+    assert derived.index.name == "track_id"
+    pd.testing.assert_frame_equal(
+        derived.reset_index().sort_values(["track_id", "market"], ignore_index=True),
+        long_df.reset_index().sort_values(["track_id", "market"], ignore_index=True),
+    )
+
+
+def test_market_index(tmp_path):
+    dfs = create_market_bitmaps(
+        ids=list(reversed(ids)),
+        market_lists=list(reversed(market_lists)),
+        id_col="track_id",
+    )
+    market_index = create_market_index(dfs["market_bitmaps"], dfs["market_codes"])
+    assert market_index.index.tolist() == dfs["market_codes"].market.tolist()
+    # sorted IDs
+    assert market_index.loc["US", "ids"] == ["b", "d"]
+
+    path = str(tmp_path / "market_index.parquet")
+    write_market_index(market_index, path)
+    assert read_market_index(path, "AT") == ["a", "d"]
+    assert read_market_index(path, "BR") == ["d"]
+    assert read_market_index(path, "XX") == []
+
+
+def test_get_markets_file_format(tmp_path):
+    dfs = create_market_bitmaps(ids=ids, market_lists=market_lists, id_col="track_id")
+    # the file names don't matter
+    paths = {
+        f: str(tmp_path / f"{f}_copy.parquet") for f in ["bitmap", "long", "index"]
+    }
+    dfs["market_bitmaps"].to_parquet(paths["bitmap"])
+    market_bitmaps_to_long(dfs["market_bitmaps"], dfs["market_codes"]).to_parquet(
+        paths["long"]
+    )
+    write_market_index(
+        create_market_index(dfs["market_bitmaps"], dfs["market_codes"]), paths["index"]
+    )
+    for markets_format, path in paths.items():
+        assert get_markets_file_format(path) == markets_format
+
+    pd.DataFrame({"track_id": ids}).to_parquet(tmp_path / "other.parquet")
+    with pytest.raises(ValueError, match="none of the known formats"):
+        get_markets_file_format(str(tmp_path / "other.parquet"))
+    (tmp_path / "markets.txt").write_text("AT")
+    with pytest.raises(ValueError, match="not a .parquet file"):
+        get_markets_file_format(str(tmp_path / "markets.txt"))
@@ -0,0 +1,82 @@
+from helpers.spotify_api.original_responses import (
+    OriginalResponsesLog,
+    read_original_responses,
+    load_original_responses,
+)
+import os
+
+example_responses = [
+    [{"id": "a", "name": "Track A"}, {"id": "b", "name": "Track B"}],
+    [None, {"id": "c", "name": "Track C"}],
+]
+
+
+def write_example_log(path, resumed_ids=None):
+    with OriginalResponsesLog(path, resumed_ids=resumed_ids) as log:
+        for resp in example_responses:
+            log.append(
+                response=resp,
+                client_method_name="tracks",
+                requested_ids=["a", "b"] if resp[0] else ["x", "c"],
+            )
+
+
+def test_log_roundtrip(tmp_path):
+    path = os.path.join(tmp_path, "original_responses.jsonl.gz")
+    write_example_log(path)
+    # appending to an existing log when resuming should work as well
+    write_example_log(path, resumed_ids=["a", "b", "x", "c"])
+
+    entries = list(read_original_responses(path))
+    assert len(entries) == 4
+    assert [e["content"] for e in entries[:2]] == example_responses
+    assert entries[1]["requested_ids"] == ["x", "c"]
+    assert entries[0]["client_method_name"] == "tracks"
+    assert entries[0]["source"].startswith("Spotify API")
+
+    df = load_original_responses(path)
+    assert df.shape[0] == 4
+    assert str(df.timestamp.dtype).startswith("datetime64")
+
+
+def test_read_truncated_log(tmp_path):
+    path = os.path.join(tmp_path, "original_responses.jsonl.gz")
+    write_example_log(path)
+    size = os.path.getsize(path)
+    with open(path, "r+b") as f:
+        f.truncate(size - 10)
+
+    entries = list(read_original_responses(path))
+    assert len(entries) <= 2
+    assert entries[0]["content"] == example_responses[0]
+
+
+def test_new_log_replaces_existing_one(tmp_path):
+    path = os.path.join(tmp_path, "original_responses.jsonl.gz")
+    write_example_log(path)
+    write_example_log(path)
+    assert len(list(read_original_responses(path))) == 2
+
+
+def test_resume_after_kill(tmp_path):
+    path = os.path.join(tmp_path, "original_responses.jsonl.gz")
+    killed_path = os.path.join(tmp_path, "killed.jsonl.gz")
+    log = OriginalResponsesLog(path)
+    log.append(response=[{"id": "a"}], client_method_name="tracks", requested_ids=["a"])
+    log.append(response=[{"id": "b"}], client_method_name="tracks", requested_ids=["b"])
+    # the state of the file when the process is killed: flushed, but the gzip member is not finished
+    with open(path, "rb") as f:
+        data = f.read()
+    log.close()
+    with open(killed_path, "wb") as f:
+        f.write(data)
+
+    # only "a" was checkpointed, "b" is fetched again
+    with OriginalResponsesLog(killed_path, resumed_ids=["a"]) as log:
+        for id in ["b", "c"]:
+            log.append(
+                response=[{"id": id}], client_method_name="tracks", requested_ids=[id]
+            )
+
+    entries = list(read_original_responses(killed_path))
+    assert [e["requested_ids"] for e in entries] == [["a"], ["b"], ["c"]]
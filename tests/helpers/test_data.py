@@ -0,0 +1,103 @@
+from helpers.data import get_cache_path, load_parquet_files_in_dir, read_parquet_cached
+import os
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    pd.DataFrame({"track_id": ["a", "b", "c"], "name": ["A", "B", "C"]}).to_parquet(
+        tmp_path / "metadata.parquet"
+    )
+    pd.DataFrame(
+        {"track_id": ["a", "a", "b"], "market": ["AT", "DE", "AT"]}
+    ).to_parquet(tmp_path / "markets.parquet")
+    (tmp_path / "not_parquet.txt").write_text("ignored")
+    return tmp_path
+
+
+def test_tables_are_read_on_first_access(data_dir):
+    tables = load_parquet_files_in_dir(str(data_dir), index_col="track_id")
+    assert sorted(tables.keys()) == ["markets", "metadata"]
+    assert not tables.is_loaded("metadata")
+
+    metadata = tables["metadata"]
+    assert metadata.index.name == "track_id"
+    assert metadata.name.tolist() == ["A", "B", "C"]
+    assert tables.is_loaded("metadata") and not tables.is_loaded("markets")
+    # read only once
+    assert tables["metadata"] is metadata
+    with pytest.raises(KeyError):
+        tables["missing"]
+
+
+def test_columns_and_filters(data_dir):
+    tables = load_parquet_files_in_dir(
+        str(data_dir),
+        columns={"metadata": ["track_id"]},
+        filters={"markets": [("market", "==", "AT")]},
+    )
+    assert tables["metadata"].columns.tolist() == ["track_id"]
+    assert tables["markets"].track_id.tolist() == ["a", "b"]
+
+
+def test_load_concurrently(data_dir):
+    tables = load_parquet_files_in_dir(str(data_dir), max_workers=2)
+    dfs = tables.load()
+    assert dfs.keys() == {"markets", "metadata"}
+    assert all(tables.is_loaded(name) for name in tables)
+    assert dfs["markets"] is tables["markets"]
+
+
+def test_read_parquet_cached(data_dir):
+    path = str(data_dir / "metadata.parquet")
+    expected = pd.read_parquet(path)
+    pd.testing.assert_frame_equal(read_parquet_cached(path), expected)
+    cache_path = get_cache_path(path)
+    assert os.path.exists(cache_path)
+
+    # read from the cache (memory-mapped)
+    mtime = os.path.getmtime(cache_path)
+    table = read_parquet_cached(path, columns=["name"], as_arrow=True)
+    assert table.column("name").to_pylist() == ["A", "B", "C"]
+    assert os.path.getmtime(cache_path) == mtime
+
+    # changing the source invalidates the cache
+    pd.DataFrame({"track_id": ["d"], "name": ["D"]}).to_parquet(path)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    assert read_parquet_cached(path).name.tolist() == ["D"]
+
+
+def test_cached_tables_keep_index_and_filters(data_dir):
+    pd.DataFrame(
+        {"name": ["A", "B"]}, index=pd.Index(["a", "b"], name="track_id")
+    ).to_parquet(data_dir / "indexed.parquet")
+    tables = load_parquet_files_in_dir(
+        str(data_dir), cache=True, filters={"markets": [("market", "==", "AT")]}
+    )
+    assert tables["indexed"].index.tolist() == ["a", "b"]
+    assert tables["markets"].track_id.tolist() == ["a", "b"]
+    # the cache directory is not a table
+    assert sorted(load_parquet_files_in_dir(str(data_dir))) == [
+        "indexed",
+        "markets",
+        "metadata",
+    ]
+
+
+def test_cached_tables_equal_uncached_with_columns(data_dir):
+    pd.DataFrame(
+        {"name": ["A", "B"], "popularity": [1, 2]},
+        index=pd.Index(["a", "b"], name="track_id"),
+    ).to_parquet(data_dir / "indexed.parquet")
+    columns = {"indexed": ["name"], "markets": ["market"]}
+    filters = {"markets": [("track_id", "==", "a")]}
+    uncached = load_parquet_files_in_dir(
+        str(data_dir), columns=columns, filters=filters
+    ).load()
+    cached = load_parquet_files_in_dir(
+        str(data_dir), columns=columns, filters=filters, cache=True
+    ).load()
+    assert cached["indexed"].index.name == "track_id"
+    for name, df in uncached.items():
+        pd.testing.assert_frame_equal(cached[name], df)
@@ -0,0 +1,36 @@
+import subprocess
+import sys
+import pytest
+
+heavy_modules = ["pandas", "spotipy", "selenium"]
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "helpers.data",
+        "helpers.spotify_util",
+        "helpers.scraping",
+        "helpers.spotify_api",
+        "helpers.internal_spotify_apis",
+    ],
+)
+def test_import_does_not_load_heavy_dependencies(module):
+    # import in a fresh interpreter, as other tests may already have imported the heavy dependencies
+    code = f"import sys, {module}; print(','.join(m for m in {heavy_modules} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == ""
+
+
+def test_lazy_attributes():
+    import helpers.spotify_api as spotify_api
+    import helpers.internal_spotify_apis as internal_spotify_apis
+    from helpers.spotify_util import get_spotipy_version, SPOTIFY_VERSION
+
+    assert callable(spotify_api.get_track_metadata_from_api)
+    assert callable(internal_spotify_apis.process_credits)
+    assert get_spotipy_version() == SPOTIFY_VERSION
+    with pytest.raises(AttributeError):
+        spotify_api.does_not_exist
@@ -0,0 +1,81 @@
+from helpers.spotify_client import SharedTokenCacheHandler, create_pooled_session
+from helpers.spotify_util import create_spotipy_client, get_shared_spotipy_client
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+
+def create_token_info(expires_in: int):
+    return {
+        "access_token": "abc",
+        "token_type": "Bearer",
+        "expires_in": expires_in,
+        "expires_at": int(time.time()) + expires_in,
+    }
+
+
+def test_token_cache_shared_via_file(tmp_path):
+    path = os.path.join(tmp_path, "token.json")
+    writer = SharedTokenCacheHandler(path)
+    reader = SharedTokenCacheHandler(path)  # e.g. in another process
+    assert reader.get_cached_token() is None
+
+    token_info = create_token_info(3600)
+    writer.save_token_to_cache(token_info)
+    assert reader.get_cached_token() == token_info
+    assert os.listdir(tmp_path) == ["token.json"]  # no leftover temporary files
+    if os.name == "posix":
+        assert os.stat(path).st_mode & 0o777 == 0o600
+
+
+def test_token_cache_rereads_file_only_if_expired(tmp_path):
+    path = os.path.join(tmp_path, "token.json")
+    handler = SharedTokenCacheHandler(path)
+    valid_token = create_token_info(3600)
+    handler.save_token_to_cache(valid_token)
+
+    SharedTokenCacheHandler(path).save_token_to_cache(create_token_info(7200))
+    assert handler.get_cached_token() == valid_token  # still valid, file not read
+
+    handler.save_token_to_cache(create_token_info(10))  # about to expire
+    new_token = create_token_info(3600)
+    SharedTokenCacheHandler(path).save_token_to_cache(new_token)
+    assert handler.get_cached_token() == new_token
+
+
+def test_pooled_session():
+    session = create_pooled_session(pool_size=32)
+    adapter = session.get_adapter("https://api.spotify.com/v1/")
+    assert adapter._pool_maxsize == 32
+    assert 429 in adapter.max_retries.status_forcelist
+
+
+def test_shared_client(monkeypatch, tmp_path):
+    monkeypatch.setenv("SPOTIPY_CLIENT_ID", "id")
+    monkeypatch.setenv("SPOTIPY_CLIENT_SECRET", "secret")
+    token_cache_path = os.path.join(tmp_path, "token.json")
+
+    with ThreadPoolExecutor(8) as executor:
+        clients = list(
+            executor.map(
+                lambda _: get_shared_spotipy_client(
+                    pool_size=8, token_cache_path=token_cache_path
+                ),
+                range(16),
+            )
+        )
+    assert all(c is clients[0] for c in clients)
+    assert (
+        get_shared_spotipy_client(pool_size=4, token_cache_path=token_cache_path)
+        is not clients[0]
+    )
+
+
+def test_default_token_cache_path(monkeypatch, tmp_path):
+    monkeypatch.setenv("SPOTIPY_CLIENT_ID", "id")
+    monkeypatch.setenv("SPOTIPY_CLIENT_SECRET", "secret")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+
+    client = create_spotipy_client()
+    cache_path = client.auth_manager.cache_handler.cache_path
+    assert os.path.dirname(os.path.dirname(cache_path)) == str(tmp_path)